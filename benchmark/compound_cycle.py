@@ -0,0 +1,278 @@
+'''
+对模拟服务器(benchmark/mock_server.py)跑完整的自动复合循环和自动合成，
+统计每个循环的请求数、耗时和刷新仓库次数。
+
+每个复合循环与AutoCompoundMan.compound_loop中的一次循环相同：check_data、need_compound、compound_one_cycle。
+在仓库根目录运行：python benchmark/compound_cycle.py [--cycles 3] [--schemes 1] [--latency 0.005]
+'''
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockGameServer, ServerStats, SimulatedWarehouse, warehouse_path
+from pypvz import Config, Library, Repository
+from pypvz.library import attribute_list
+from pypvz.ui.message import Logger
+from pypvz.ui.user.compound import AutoCompoundMan
+from pypvz.ui.user.manager import AutoSynthesisMan
+from pypvz.utils.trace import request_tracer
+
+# 图鉴中的道具id，见mock_server
+tool_amount_dict = {
+    445: 10**6,  # HP合成书
+    446: 10**6,  # 攻击合成书
+    447: 10**6,  # 护甲合成书
+    448: 10**6,  # 穿透合成书
+    1078: 10**6,  # 特级攻击合成书
+    1082: 10**6,  # 特效HP合成书
+    1093: 10**6,  # 闪避合成书
+    1094: 10**6,  # 命中合成书
+    450: 10**7,  # 增强卷轴
+    1131: 10**6,  # HP传承书
+    1132: 10**6,  # 攻击传承书
+    1133: 10**6,  # 护甲传承书
+    1134: 10**6,  # 穿透传承书
+    1135: 10**6,  # 闪避传承书
+    1136: 10**6,  # 命中传承书
+    1138: 10**6,  # 全属性传承书
+    1139: 10**7,  # 传承增强卷轴
+}
+# 复合属性对应的仓库xml字段
+attribute2xml_attribute = {
+    "HP特": "hm",
+    "攻击特": "at",
+    "命中": "new_precision",
+    "闪避": "new_miss",
+    "穿透": "pr",
+    "护甲": "mi",
+    "HP": "hm",
+    "攻击": "at",
+}
+
+
+class _NullChannel:
+    # 代替Logger的info_channel，丢弃界面消息
+    def put(self, msg):
+        pass
+
+
+class _PrintChannel:
+    def put(self, msg):
+        print("    " + "".join(item[0] for item in msg))
+
+
+def make_config(host):
+    return Config(
+        {
+            "cookie": "",
+            "username": "benchmark",
+            "region": 1,
+            "host": host,
+            "server": "mock",
+        }
+    )
+
+
+def prepare_workdir():
+    # Library从相对路径读技能表、写图鉴缓存，放到临时目录里，不影响助手自己的数据
+    work_dir = tempfile.mkdtemp(prefix="pypvz_benchmark_")
+    os.makedirs(os.path.join(work_dir, "data", "cache", "pvz"))
+    for name in ("skills.json", "spec_skills.json"):
+        with open(os.path.join(work_dir, "data", "cache", "pvz", name), "w") as f:
+            json.dump([], f)
+    os.chdir(work_dir)
+    return work_dir
+
+
+class Measurement:
+    '''
+    统计一段操作的服务器请求、耗时和刷新仓库次数
+    '''
+
+    def __init__(self, server: MockGameServer, repo: Repository):
+        self.server = server
+        self.repo = repo
+
+    def __enter__(self):
+        self.stats_before = self.server.stats.snapshot()
+        self.refresh_before = (
+            self.repo.refresh_stats.request_count,
+            self.repo.refresh_stats.fetch_count,
+        )
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_time = time.perf_counter() - self.start_time
+        self.stats = ServerStats.diff(self.server.stats.snapshot(), self.stats_before)
+        self.refresh_request_count = (
+            self.repo.refresh_stats.request_count - self.refresh_before[0]
+        )
+        self.refresh_fetch_count = (
+            self.repo.refresh_stats.fetch_count - self.refresh_before[1]
+        )
+
+    def report(self, name):
+        print(
+            "{}: 耗时{:.3f}秒，HTTP请求{}次，刷新仓库{}次(实际下载{}次)，amf错误{}次".format(
+                name,
+                self.wall_time,
+                self.stats["http_count"],
+                self.refresh_request_count,
+                self.refresh_fetch_count,
+                self.stats["error_count"],
+            )
+        )
+        for target, count in sorted(self.stats["amf_count"].items()):
+            print("    {:<32} {}".format(target, count))
+        print(
+            "    {:<32} {}".format(
+                "仓库xml", self.stats["path_count"].get(warehouse_path, 0)
+            )
+        )
+
+
+def report_endpoint_stats():
+    print("各请求耗时(按总耗时排序)：")
+    for endpoint, stats in request_tracer.endpoint_stats():
+        total = stats["total_time"]
+        print(
+            "    {:<40} {:>5}次 总计{:.3f}秒 p50 {:.1f}ms p99 {:.1f}ms 重试{}次".format(
+                endpoint,
+                stats["count"],
+                total["sum"],
+                total["p50"] * 1000,
+                total["p99"] * 1000,
+                stats["retry_count"],
+            )
+        )
+
+
+def setup_compound(warehouse: SimulatedWarehouse, args):
+    # 返回(主力id, 劣质双格id, [(属性, 底座id)], 副植物id列表)
+    receiver_id = warehouse.add_plant(hm=10**15, at=10**12)
+    liezhi_id = warehouse.add_plant(quality="劣质")
+    source_list = []
+    for attribute in attribute_list[: args.schemes]:
+        source_list.append(
+            (
+                attribute,
+                warehouse.add_plant(**{attribute2xml_attribute[attribute]: 10**18}),
+            )
+        )
+    deputy_num = (args.n1 + args.n2 + 1) * args.m * args.schemes * args.cycles
+    deputy_id_list = [warehouse.add_plant() for _ in range(deputy_num)]
+    return receiver_id, liezhi_id, source_list, deputy_id_list
+
+
+def run_compound(server, cfg, lib, repo, logger, args):
+    receiver_id, liezhi_id, source_list, deputy_id_list = setup_compound(
+        server.warehouse, args
+    )
+    repo.refresh_repository()
+    man = AutoCompoundMan(cfg, lib, repo, logger)
+    man.receiver_plant_id = receiver_id
+    man.liezhi_plant_id = liezhi_id
+    man.auto_compound_pool_id = set(deputy_id_list)
+    for attribute, source_id in source_list:
+        man.new_scheme()
+        scheme = man.scheme_list[-1]
+        scheme.name = attribute
+        scheme.set_chosen_attribute(attribute)
+        scheme.n1, scheme.n2, scheme.k, scheme.m = args.n1, args.n2, args.k, args.m
+        scheme.end_mantissa, scheme.end_exponent = 1.0, 40
+        scheme.source_plant_id = source_id
+
+    measurement_list = []
+    for i in range(args.cycles):
+        with Measurement(server, repo) as measurement:
+            man.check_data()
+            if not man.need_compound():
+                break
+            success = man.compound_one_cycle(None)
+        measurement.report("复合第{}个循环".format(i + 1))
+        measurement_list.append(measurement)
+        if not success:
+            print("复合失败，停止测试")
+            break
+    return measurement_list
+
+
+def run_synthesis(server, cfg, lib, repo, logger, args):
+    warehouse = server.warehouse
+    main_plant_id = warehouse.add_plant(hm=10**12)
+    pool_id_list = [warehouse.add_plant() for _ in range(args.synthesis)]
+    repo.refresh_repository()
+    man = AutoSynthesisMan(cfg, lib, repo)
+    man.chosen_attribute = "HP"
+    man.main_plant_id = main_plant_id
+    man.auto_synthesis_pool_id = set(pool_id_list)
+    with Measurement(server, repo) as measurement:
+        man.synthesis_all(logger)
+    measurement.report("自动合成{}个植物".format(args.synthesis))
+    return measurement
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=3, help="复合循环数")
+    parser.add_argument(
+        "--schemes", type=int, default=1, help="同时进行的复合方案数，按attribute_list取属性"
+    )
+    parser.add_argument("--n1", type=int, default=2)
+    parser.add_argument("--n2", type=int, default=1)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", type=int, default=3)
+    parser.add_argument("--synthesis", type=int, default=20, help="自动合成的植物数，0为不测")
+    parser.add_argument("--latency", type=float, default=0.005, help="模拟的网络延迟秒数")
+    parser.add_argument("--verbose", action="store_true", help="输出复合日志")
+    parser.add_argument(
+        "--export", default=None, help="导出请求统计，.json结尾导出JSON，否则为Prometheus文本格式"
+    )
+    args = parser.parse_args()
+
+    export_path = os.path.abspath(args.export) if args.export is not None else None
+    prepare_workdir()
+    # 每个请求一行的日志只在--verbose时输出
+    request_tracer.log_level = logging.INFO if args.verbose else None
+    warehouse = SimulatedWarehouse()
+    for tool_id, amount in tool_amount_dict.items():
+        warehouse.add_tool(tool_id, amount)
+    logger = Logger(
+        logging.getLogger("benchmark"),
+        _PrintChannel() if args.verbose else _NullChannel(),
+    )
+    with MockGameServer(warehouse, latency=args.latency) as server:
+        cfg = make_config(server.address)
+        lib = Library(cfg)
+        repo = Repository(cfg)
+
+        measurement_list = run_compound(server, cfg, lib, repo, logger, args)
+        if len(measurement_list) > 0:
+            print(
+                "复合平均每个循环：耗时{:.3f}秒，HTTP请求{:.1f}次，刷新仓库{:.1f}次(实际下载{:.1f}次)".format(
+                    sum(m.wall_time for m in measurement_list) / len(measurement_list),
+                    sum(m.stats["http_count"] for m in measurement_list)
+                    / len(measurement_list),
+                    sum(m.refresh_request_count for m in measurement_list)
+                    / len(measurement_list),
+                    sum(m.refresh_fetch_count for m in measurement_list)
+                    / len(measurement_list),
+                )
+            )
+        if args.synthesis > 0:
+            run_synthesis(server, cfg, lib, repo, logger, args)
+        print(repo.refresh_stats)
+        report_endpoint_stats()
+        if export_path is not None:
+            request_tracer.export(export_path)
+
+
+if __name__ == "__main__":
+    main()
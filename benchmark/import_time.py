@@ -0,0 +1,86 @@
+'''
+测量各入口模块的冷启动导入耗时。
+
+每次都新开一个解释器，用python -X importtime导入目标模块，取多次中的最小值，
+并列出自身耗时最多的模块，方便找出拖慢启动的依赖。
+
+在仓库根目录运行：python benchmark/import_time.py [--repeat 5] [--top 10] [模块 ...]
+'''
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+default_target_list = [
+    "pypvz",
+    "pypvz.config",
+    "pypvz.web",
+    "pypvz.ui.user",
+    "pypvz.daemon",
+    "webUI",
+]
+
+line_pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def import_once(target):
+    '''
+    Returns:
+        tuple: (总耗时us, {模块名: 自身耗时us})，导入失败时返回(None, 错误信息)
+    '''
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=root_dir,
+        capture_output=True,
+        text=True,
+    )
+    self_time_dict = {}
+    total = None
+    for line in proc.stderr.splitlines():
+        match = line_pattern.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        self_time_dict[name] = int(self_us)
+        if name == target:
+            total = int(cumulative_us)
+    if proc.returncode != 0 or total is None:
+        return None, proc.stderr.strip().splitlines()[-1:] or ["未知错误"]
+    return total, self_time_dict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_list", nargs="*", help="要测量的模块")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数")
+    parser.add_argument("--top", type=int, default=10, help="列出自身耗时最多的模块数")
+    args = parser.parse_args()
+
+    for target in args.target_list or default_target_list:
+        best, best_self_time_dict = None, None
+        for _ in range(args.repeat):
+            total, self_time_dict = import_once(target)
+            if total is None:
+                break
+            if best is None or total < best:
+                best, best_self_time_dict = total, self_time_dict
+        if best is None:
+            print("{:<16} 导入失败：{}".format(target, self_time_dict[0]))
+            continue
+        print(
+            "{:<16} {:8.1f}ms  模块{}个".format(
+                target, best / 1000, len(best_self_time_dict)
+            )
+        )
+        top_list = sorted(
+            best_self_time_dict.items(), key=lambda item: item[1], reverse=True
+        )[: args.top]
+        for name, self_us in top_list:
+            print("    {:<40} {:8.1f}ms".format(name, self_us / 1000))
+
+
+if __name__ == "__main__":
+    main()
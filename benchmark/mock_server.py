@@ -0,0 +1,407 @@
+'''
+本地模拟的游戏服务器，用来离线测试和测量复合、合成流程。
+
+实现了仓库xml(/pvz/index.php/Warehouse/index/sig/0)、图鉴xml(/pvz/php_xml/)和以下amf接口，
+支持一个envelope里打包多个调用：
+    api.tool.synthesis          合成
+    api.apiorganism.exchangeOne 单项属性传承
+    api.apiorganism.exchangeAll 全属性传承
+    api.shop.buy                购买道具(商品id即道具id)
+数值规则是简化过的，只保证流程和请求次数与真实服务器一致，不保证数值一致。
+所有请求都会计数，见MockGameServer.stats
+
+单独运行时在本地端口上提供服务：python benchmark/mock_server.py [--port 8080] [--plants 100]
+'''
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pyamf import AMF3, remoting
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+php_xml_dir = os.path.join(root_dir, "data", "cache", "pvz", "php_xml")
+warehouse_path = "/pvz/index.php/Warehouse/index/sig/0"
+
+# 合成书、传承书对应的仓库xml字段，道具id与data/cache/pvz/php_xml/tool.xml一致
+synthesis_book_attr_dict = {
+    445: "hm",  # HP合成书
+    1082: "hm",  # 特效HP合成书
+    446: "at",  # 攻击合成书
+    1078: "at",  # 特级攻击合成书
+    447: "mi",  # 护甲合成书
+    448: "pr",  # 穿透合成书
+    449: "sp",  # 速度合成书
+    1094: "new_precision",  # 命中合成书
+    1093: "new_miss",  # 闪避合成书
+}
+heritage_book_attr_dict = {
+    1131: "hm",  # HP传承书
+    1132: "at",  # 攻击传承书
+    1133: "mi",  # 护甲传承书
+    1134: "pr",  # 穿透传承书
+    1136: "new_precision",  # 命中传承书
+    1135: "new_miss",  # 闪避传承书
+    1137: "sp",  # 速度传承书
+}
+synthesis_reinforce_id = 450  # 增强卷轴
+heritage_reinforce_id = 1139  # 传承增强卷轴
+heritage_all_book_id = 1138  # 全属性传承书
+heritage_all_attr_list = ["hm", "at", "mi", "pr", "new_precision", "new_miss"]
+# api.tool.synthesis返回的增加值的键，与AutoSynthesisMan.synthesis中的用法一致
+synthesis_body_key_dict = {
+    "hm": "hp",
+    "at": "attack",
+    "mi": "miss",
+    "pr": "precision",
+    "new_precision": "new_precision",
+    "new_miss": "new_miss",
+    "sp": "speed",
+}
+
+
+class MockError(Exception):
+    # 服务器以onStatus返回的错误，description与真实服务器的提示一致
+    pass
+
+
+class SimulatedWarehouse:
+    '''
+    模拟的仓库，所有操作都在锁内完成
+
+    Args:
+        quality_coef: 被吃植物的品质系数
+        book_coef: 合成书系数(10增强)
+        heritage_ratio_per_reinforce: 每个传承增强卷轴传出的比例
+    '''
+
+    def __init__(self, quality_coef=1.55, book_coef=0.88, heritage_ratio_per_reinforce=0.1):
+        self.quality_coef = quality_coef
+        self.book_coef = book_coef
+        self.heritage_ratio_per_reinforce = heritage_ratio_per_reinforce
+        self.lock = threading.Lock()
+        self.tools: dict[int, int] = {}
+        self.plants: dict[int, dict] = {}
+        self._next_plant_id = 1
+
+    def add_tool(self, tool_id, amount):
+        with self.lock:
+            self.tools[tool_id] = self.tools.get(tool_id, 0) + amount
+            return self.tools[tool_id]
+
+    def add_plant(self, quality="魔神", grade=150, pid=1, **attr):
+        '''
+        Args:
+            attr: 仓库xml中的字段，如hm=10**12、at=10**10
+        '''
+        with self.lock:
+            plant_id = self._next_plant_id
+            self._next_plant_id += 1
+            plant = {
+                "id": plant_id,
+                "pid": pid,
+                "at": 1000,
+                "mi": 1000,
+                "sp": 100,
+                "hp": 1000,
+                "hm": 1000,
+                "gr": grade,
+                "pr": 1000,
+                "new_precision": 1000,
+                "new_miss": 1000,
+                "fight": 0,
+                "qu": quality,
+                "soul": 0,
+            }
+            plant.update(attr)
+            plant["fight"] = self._fight(plant)
+            self.plants[plant_id] = plant
+            return plant_id
+
+    @staticmethod
+    def _fight(plant):
+        return sum(plant[name] for name in heritage_all_attr_list)
+
+    def _get_plant(self, plant_id):
+        plant = self.plants.get(int(plant_id))
+        if plant is None:
+            raise MockError("该生物不存在")
+        return plant
+
+    def _use_tool(self, tool_id, amount):
+        tool_id = int(tool_id)
+        if self.tools.get(tool_id, 0) < amount:
+            raise MockError("道具异常")
+        self.tools[tool_id] -= amount
+        if self.tools[tool_id] == 0:
+            del self.tools[tool_id]
+
+    def synthesis(self, id1, id2, book_id, reinforce_number):
+        # id1吃掉id2，增加的属性由合成书决定
+        with self.lock:
+            attr = synthesis_book_attr_dict.get(int(book_id))
+            if attr is None:
+                raise MockError("道具异常")
+            eater, eaten = self._get_plant(id1), self._get_plant(id2)
+            if eater is eaten:
+                raise MockError("该生物不存在")
+            reinforce_number = int(reinforce_number)
+            self._use_tool(book_id, 1)
+            self._use_tool(synthesis_reinforce_id, reinforce_number)
+            gain = int(
+                eaten[attr]
+                * self.quality_coef
+                * self.book_coef
+                * min(reinforce_number, 10)
+                / 10
+            )
+            eater[attr] += gain
+            if attr == "hm":
+                eater["hp"] = eater["hm"]
+            del self.plants[eaten["id"]]
+            old_fight = eater["fight"]
+            eater["fight"] = self._fight(eater)
+            body = {key: "0" for key in synthesis_body_key_dict.values()}
+            body[synthesis_body_key_dict[attr]] = str(gain)
+            body["fight"] = str(eater["fight"] - old_fight)
+            return body
+
+    def exchange_one(self, receiver_id, giver_id, book_id, reinforce_number):
+        with self.lock:
+            attr = heritage_book_attr_dict.get(int(book_id))
+            if attr is None:
+                raise MockError("道具异常")
+            receiver, giver = self._get_plant(receiver_id), self._get_plant(giver_id)
+            reinforce_number = int(reinforce_number)
+            self._use_tool(book_id, 1)
+            self._use_tool(heritage_reinforce_id, reinforce_number)
+            amount = int(
+                giver[attr]
+                * min(1.0, reinforce_number * self.heritage_ratio_per_reinforce)
+            )
+            giver[attr] -= amount
+            receiver[attr] += amount
+            for plant in (giver, receiver):
+                plant["hp"] = plant["hm"]
+                plant["fight"] = self._fight(plant)
+            return {"status": "success"}
+
+    def exchange_all(self, receiver_id, giver_id):
+        with self.lock:
+            receiver, giver = self._get_plant(receiver_id), self._get_plant(giver_id)
+            self._use_tool(heritage_all_book_id, 1)
+            for attr in heritage_all_attr_list:
+                receiver[attr] += giver[attr]
+                giver[attr] = 1000
+            for plant in (giver, receiver):
+                plant["hp"] = plant["hm"]
+                plant["fight"] = self._fight(plant)
+            return {"status": "success"}
+
+    def buy(self, item_id, amount):
+        amount = self.add_tool(int(item_id), int(amount))
+        return {"status": "success", "tool": {"id": str(int(item_id)), "amount": str(amount)}}
+
+    def to_xml(self):
+        with self.lock:
+            tool_list = [
+                '<item id="{}" amount="{}"/>'.format(tool_id, amount)
+                for tool_id, amount in sorted(self.tools.items())
+            ]
+            plant_list = [
+                '<item id="{id}" pid="{pid}" at="{at}" mi="{mi}" sp="{sp}" hp="{hp}" '
+                'hm="{hm}" gr="{gr}" im="0" pr="{pr}" new_precision="{new_precision}" '
+                'new_miss="{new_miss}" qu="{qu}" fight="{fight}"><sk></sk><ssk></ssk>'
+                '<tals></tals><soul>{soul}</soul></item>'.format(**plant)
+                for plant in self.plants.values()
+            ]
+            return (
+                '<root><response><status>success</status></response>'
+                '<warehouse organism_grid_amount="{}"><tools>{}</tools>'
+                '<organisms>{}</organisms></warehouse></root>'.format(
+                    max(len(self.plants), 1000), "".join(tool_list), "".join(plant_list)
+                )
+            ).encode("utf-8")
+
+
+class ServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.http_count = 0  # HTTP请求数
+        self.path_count: dict[str, int] = {}
+        self.amf_count: dict[str, int] = {}  # 按target计的amf调用数，打包的调用分别计数
+        self.error_count = 0  # 返回onStatus的amf调用数
+
+    def record_http(self, path):
+        with self.lock:
+            self.http_count += 1
+            self.path_count[path] = self.path_count.get(path, 0) + 1
+
+    def record_amf(self, target, error):
+        with self.lock:
+            self.amf_count[target] = self.amf_count.get(target, 0) + 1
+            if error:
+                self.error_count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "http_count": self.http_count,
+                "path_count": dict(self.path_count),
+                "amf_count": dict(self.amf_count),
+                "error_count": self.error_count,
+            }
+
+    @staticmethod
+    def diff(after, before):
+        # 两次snapshot之差，用来统计一段时间内的请求
+        def diff_dict(a, b):
+            result = {k: v - b.get(k, 0) for k, v in a.items()}
+            return {k: v for k, v in result.items() if v != 0}
+
+        return {
+            "http_count": after["http_count"] - before["http_count"],
+            "path_count": diff_dict(after["path_count"], before["path_count"]),
+            "amf_count": diff_dict(after["amf_count"], before["amf_count"]),
+            "error_count": after["error_count"] - before["error_count"],
+        }
+
+
+class MockGameServer:
+    '''
+    在后台线程里运行的模拟服务器
+
+    Args:
+        warehouse: 模拟的仓库
+        host: 监听地址
+        port: 监听端口，0表示随机选择
+        latency: 每个请求额外等待的秒数，模拟网络延迟
+    '''
+
+    def __init__(self, warehouse: SimulatedWarehouse, host="127.0.0.1", port=0, latency=0.0):
+        self.warehouse = warehouse
+        self.latency = latency
+        self.stats = ServerStats()
+        self.amf_handler_dict = {
+            "api.tool.synthesis": lambda body: warehouse.synthesis(*body),
+            "api.apiorganism.exchangeOne": lambda body: warehouse.exchange_one(*body),
+            "api.apiorganism.exchangeAll": lambda body: warehouse.exchange_all(*body),
+            "api.shop.buy": lambda body: warehouse.buy(*body),
+        }
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        # 用作Config的host字段
+        host, port = self.httpd.server_address[:2]
+        return "{}:{}".format(host, port)
+
+    def handle_amf(self, data: bytes) -> bytes:
+        request_ev = remoting.decode(data)
+        response_ev = remoting.Envelope(AMF3)
+        for name, message in request_ev:
+            handler = self.amf_handler_dict.get(message.target)
+            try:
+                if handler is None:
+                    raise MockError("未知接口{}".format(message.target))
+                response = remoting.Response(handler(message.body))
+                error = False
+            except MockError as e:
+                response = remoting.Response(
+                    remoting.ErrorFault(description=str(e)),
+                    status=remoting.STATUS_ERROR,
+                )
+                error = True
+            self.stats.record_amf(message.target, error)
+            response_ev[name] = response
+        return remoting.encode(response_ev, strict=True).getvalue()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头和响应体一起发出，避免Nagle和延迟确认给每个请求多加几十毫秒
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def _reply(self, status, content: bytes, content_type="text/xml"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                server.stats.record_http(self.path)
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                if self.path == warehouse_path:
+                    self._reply(200, server.warehouse.to_xml())
+                    return
+                if self.path.startswith("/pvz/php_xml/"):
+                    path = os.path.join(php_xml_dir, os.path.basename(self.path))
+                    if os.path.exists(path):
+                        with open(path, "rb") as f:
+                            self._reply(200, f.read())
+                        return
+                self._reply(404, b"")
+
+            def do_POST(self):
+                server.stats.record_http(self.path)
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                if self.path != "/pvz/amf/":
+                    self._reply(404, b"")
+                    return
+                self._reply(200, server.handle_amf(data), "application/x-amf")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080, help="监听端口")
+    parser.add_argument("--plants", type=int, default=100, help="初始魔神植物数")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟秒数")
+    args = parser.parse_args()
+
+    warehouse = SimulatedWarehouse()
+    for _ in range(args.plants):
+        warehouse.add_plant()
+    server = MockGameServer(warehouse, port=args.port, latency=args.latency)
+    print("模拟服务器运行在{}，按Ctrl+C退出".format(server.address))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+'''
+对比整树解析(fromstring)与流式解析(ChildElementStream)在图鉴和仓库xml上的耗时和峰值内存。
+
+在仓库根目录运行：python benchmark/xml_parse.py [--plants 5000] [--repeat 5]
+'''
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from xml.etree.ElementTree import fromstring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypvz.library import Plant as LibPlant, Tool
+from pypvz.repository import PlantTable
+from pypvz.utils.xmlstream import ChildElementStream
+
+
+def make_warehouse(num_plants, seed=0):
+    # 构造与服务器格式一致的仓库xml
+    rnd = random.Random(seed)
+    item_list = []
+    for i in range(num_plants):
+        item_list.append(
+            '<item id="{}" pid="{}" at="{}" mi="{}" sp="{}" hp="{}" hm="{}" gr="{}" '
+            'im="0" pr="{}" new_precision="{}" new_miss="{}" qu="魔神" fight="{}">'
+            '<sk><item id="{}"/><item id="{}"/></sk><ssk><item id="{}"/></ssk>'
+            '<tals>{}</tals><soul>{}</soul></item>'.format(
+                i + 1,
+                rnd.randint(1, 1000),
+                rnd.randint(1, 10**9),
+                rnd.randint(1, 10**9),
+                rnd.randint(1, 500),
+                rnd.randint(1, 10**9),
+                10**9,
+                rnd.randint(1, 250),
+                rnd.randint(1, 10**6),
+                rnd.randint(1, 10**6),
+                rnd.randint(1, 10**6),
+                rnd.randint(1, 10**12),
+                rnd.randint(1, 500),
+                rnd.randint(1, 500),
+                rnd.randint(1, 100),
+                "".join(
+                    '<tal level="{}"/>'.format(rnd.randint(0, 10)) for _ in range(9)
+                ),
+                rnd.randint(0, 10),
+            )
+        )
+    tool_list = [
+        '<item id="{}" amount="{}"/>'.format(i, rnd.randint(1, 10**6))
+        for i in range(1, 1001)
+    ]
+    return (
+        '<root><response><status>success</status></response>'
+        '<warehouse organism_grid_amount="{}"><tools>{}</tools>'
+        '<organisms>{}</organisms></warehouse></root>'.format(
+            num_plants, "".join(tool_list), "".join(item_list)
+        )
+    ).encode("utf-8")
+
+
+def warehouse_plant_factory():
+    # 仓库植物是PlantTable中一行的视图，每次解析写入一张新表，与Repository._parse_warehouse相同
+    return PlantTable().append_element
+
+
+def tree_parse(data: bytes, container_path, make_factory):
+    factory = make_factory()
+    root = fromstring(data.decode("utf-8"))
+    return [factory(item) for item in root.find(container_path)]
+
+
+def stream_parse(data: bytes, container_path, make_factory):
+    factory = make_factory()
+    return [factory(item) for _, item in ChildElementStream(data, (container_path,))]
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plants", type=int, default=5000, help="仓库植物数")
+    parser.add_argument("--repeat", type=int, default=5, help="计时重复次数")
+    args = parser.parse_args()
+
+    case_list = []
+    php_xml_dir = "./data/cache/pvz/php_xml"
+    for filename, container_path, make_factory in [
+        ("organism.xml", "organisms", lambda: LibPlant),
+        ("tool.xml", "tools", lambda: Tool),
+    ]:
+        path = os.path.join(php_xml_dir, filename)
+        if not os.path.exists(path):
+            print("跳过{}：文件不存在".format(path))
+            continue
+        with open(path, "rb") as f:
+            case_list.append((filename, f.read(), container_path, make_factory))
+    case_list.append(
+        (
+            "warehouse({}植物)".format(args.plants),
+            make_warehouse(args.plants),
+            "warehouse/organisms",
+            warehouse_plant_factory,
+        )
+    )
+
+    for name, data, container_path, make_factory in case_list:
+        print("{}，大小{:.1f}KB".format(name, len(data) / 1024))
+        for method_name, method in [("fromstring", tree_parse), ("stream", stream_parse)]:
+            cost, peak, amount = measure(
+                lambda: method(data, container_path, make_factory), args.repeat
+            )
+            print(
+                "  {:<10} 耗时{:8.1f}ms  峰值内存{:8.1f}KB  对象{}个".format(
+                    method_name, cost * 1000, peak / 1024, amount
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,62 @@
-from .config import Config
-from .web import WebRequest
-from .command import Command
-from .library import Library
-from .repository import Repository
-from .garden import GardenMan
-from .user import User, FriendMan
-from .cave import CaveMan
-from .task import Task
-from .upgrade import UpgradeMan, SynthesisMan, HeritageMan, StoneMan
-from .arena import Arena
-from .serverbattle import Serverbattle
-from .fuben import WorldFubenRequest
-from .shop import Shop
+'''
+包内的类在第一次访问时才导入对应模块(PEP 562)，
+这样只用到Config或daemon时不会把requests、pyamf、dns等全部导入进来
+'''
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+_lazy_attr_module = {
+    "Config": ".config",
+    "WebRequest": ".web",
+    "AsyncWebRequest": ".async_web",
+    "Command": ".command",
+    "Library": ".library",
+    "Repository": ".repository",
+    "GardenMan": ".garden",
+    "User": ".user",
+    "FriendMan": ".user",
+    "CaveMan": ".cave",
+    "Task": ".task",
+    "UpgradeMan": ".upgrade",
+    "SynthesisMan": ".upgrade",
+    "HeritageMan": ".upgrade",
+    "StoneMan": ".upgrade",
+    "Arena": ".arena",
+    "Serverbattle": ".serverbattle",
+    "WorldFubenRequest": ".fuben",
+    "Shop": ".shop",
+}
+
+__all__ = list(_lazy_attr_module.keys())
+
+
+def __getattr__(name):
+    module_name = _lazy_attr_module.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
+
+
+# 不会执行，供IDE补全和pyinstaller分析依赖
+if TYPE_CHECKING:
+    from .config import Config
+    from .web import WebRequest
+    from .async_web import AsyncWebRequest
+    from .command import Command
+    from .library import Library
+    from .repository import Repository
+    from .garden import GardenMan
+    from .user import User, FriendMan
+    from .cave import CaveMan
+    from .task import Task
+    from .upgrade import UpgradeMan, SynthesisMan, HeritageMan, StoneMan
+    from .arena import Arena
+    from .serverbattle import Serverbattle
+    from .fuben import WorldFubenRequest
+    from .shop import Shop
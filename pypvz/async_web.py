@@ -0,0 +1,404 @@
+import asyncio
+import threading
+import concurrent.futures
+from functools import partial
+from time import perf_counter
+
+from .config import Config
+from .ratelimit import endpoint_name
+from .web import (
+    WebRequest,
+    proxy_man,
+    encode_amf,
+    encode_amf_batch,
+    decode_amf_batch,
+    batch_endpoint,
+    batch_outcome,
+    get_retry_steps,
+    amf_post_retry_steps,
+    amf_batch_retry_steps,
+)
+from .utils.trace import request_tracer, amf_outcome, RequestTrace
+from .utils.optional import is_installed
+
+
+class _EventLoopThread(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+
+
+def get_event_loop():
+    # 进程内共享的后台事件循环，线程代码通过run_coroutine把协程丢进来执行
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None or not _loop_thread.is_alive():
+            _loop_thread = _EventLoopThread()
+            _loop_thread.start()
+            _loop_thread.ready.wait()
+        return _loop_thread.loop
+
+
+def submit_coroutine(coro):
+    # 把协程丢进后台事件循环，返回concurrent.futures.Future，可以和线程池的future一样等待
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_coroutine(coro, timeout=None):
+    return submit_coroutine(coro).result(timeout)
+
+
+def submit_gather(coro_list, max_concurrency=None):
+    '''
+    把一组协程丢进后台事件循环并发运行
+
+    Args:
+        coro_list: 协程列表
+        max_concurrency: 最多同时运行的协程数，None表示不限制
+
+    Returns:
+        list: 与coro_list一一对应的concurrent.futures.Future
+    '''
+    if max_concurrency is None:
+        return [submit_coroutine(coro) for coro in coro_list]
+    semaphore = None
+
+    async def run(coro):
+        nonlocal semaphore
+        # 在事件循环里创建，所有协程都在同一个线程上运行，不会重复创建
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max_concurrency)
+        async with semaphore:
+            return await coro
+
+    return [submit_coroutine(run(coro)) for coro in coro_list]
+
+
+def run_gather(coro_list, max_concurrency=None, return_exceptions=True):
+    '''
+    在后台事件循环中并发运行一组协程并同步等待全部结果
+
+    Args:
+        coro_list: 协程列表
+        max_concurrency: 最多同时运行的协程数，None表示不限制
+        return_exceptions: 为True时异常作为结果返回，而不是直接抛出
+
+    Returns:
+        list: 与coro_list一一对应的结果
+    '''
+    futures = submit_gather(coro_list, max_concurrency=max_concurrency)
+    concurrent.futures.wait(futures)
+    result = []
+    for future in futures:
+        exception = future.exception()
+        if exception is None:
+            result.append(future.result())
+        elif return_exceptions:
+            result.append(exception)
+        else:
+            raise exception
+    return result
+
+
+class AsyncWebRequest:
+    '''
+    WebRequest的协程版本。装了aiohttp时所有请求都在一个事件循环里完成，
+    没装时退化为在线程池里调用同步的WebRequest，接口保持一致。
+    重试使用web.py中与WebRequest相同的重试状态机，限流、服务器更新等待和代理选择
+    走Config和proxy_man的协程接口，等待时不占用线程。
+    '''
+
+    def __init__(self, cfg: Config, cache_dir=None):
+        self.cfg = cfg
+        self.wr = WebRequest(cfg, cache_dir=cache_dir)
+
+    @property
+    def use_aiohttp(self):
+        return is_installed("aiohttp")
+
+    def _get_session(self):
+        # 与同账号的WebRequest共用一个PooledTransport
+        return self.wr.transport.get_async_session(asyncio.get_running_loop())
+
+    @staticmethod
+    def _form_proxy_url(lease):
+        if lease.proxy is None:
+            return None
+        if "://" in lease.proxy:
+            return lease.proxy
+        return "http://" + lease.proxy
+
+    async def _request(self, trace: RequestTrace, method, url, **kwargs):
+        import aiohttp
+
+        start = perf_counter()
+        lease = await proxy_man.lease_async()
+        trace.proxy_id = lease.item.item_id
+        trace.queue_time += perf_counter() - start
+        data = kwargs.get("data")
+        if data is not None:
+            trace.bytes_out += len(data)
+        start = perf_counter()
+        with lease:
+            async with self._get_session().request(
+                method,
+                url,
+                proxy=self._form_proxy_url(lease),
+                timeout=aiohttp.ClientTimeout(total=kwargs.pop("timeout")),
+                **kwargs,
+            ) as resp:
+                result = resp.status, await resp.read()
+        trace.network_time += perf_counter() - start
+        trace.bytes_in = len(result[1])
+        return result
+
+    async def _send(
+        self,
+        method,
+        url,
+        init_header=True,
+        url_format=True,
+        endpoint=None,
+        attempt=1,
+        trace: RequestTrace = None,
+        **kwargs,
+    ):
+        if url_format:
+            url = "http://" + self.cfg.host + url
+        private_cached = self.wr.get_private_cache(url)
+        if private_cached is not None:
+            return private_cached
+        if init_header:
+            if kwargs.get("headers") is None:
+                kwargs["headers"] = {}
+            self.wr.init_header(kwargs["headers"])
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = self.cfg.timeout
+        if endpoint is None:
+            endpoint = endpoint_name(url)
+        if trace is None:
+            trace = request_tracer.trace(
+                self.wr.account, endpoint, url, method, attempt=attempt
+            )
+        trace.url = url
+        with trace:
+            token = None
+            try:
+                start = perf_counter()
+                token = await self.cfg.acquire_async(endpoint)
+                trace.queue_time += perf_counter() - start
+                status_code, content = await self._request(trace, method, url, **kwargs)
+            finally:
+                self.cfg.release(token)
+            if status_code == 502:
+                raise RuntimeError(f"服务器更新中")
+            if status_code != 200:
+                raise RuntimeError(
+                    f"Request {method.capitalize()} Error: {status_code} Url: {url}"
+                )
+            return content
+
+    async def get(self, url, use_cache=False, init_header=True, url_format=True, **kwargs):
+        if use_cache or not self.use_aiohttp:
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                partial(
+                    self.wr.get,
+                    url,
+                    use_cache=use_cache,
+                    init_header=init_header,
+                    url_format=url_format,
+                    **kwargs,
+                ),
+            )
+        return await self._send(
+            "GET", url, init_header=init_header, url_format=url_format, **kwargs
+        )
+
+    async def post(self, url, init_header=True, url_format=True, **kwargs):
+        if not self.use_aiohttp:
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                partial(
+                    self.wr.post,
+                    url,
+                    init_header=init_header,
+                    url_format=url_format,
+                    **kwargs,
+                ),
+            )
+        return await self._send(
+            "POST", url, init_header=init_header, url_format=url_format, **kwargs
+        )
+
+    async def _run_step(self, step):
+        kind = step[0]
+        if kind == "call":
+            _, method, args, kwargs = step
+            return await getattr(self, method)(*args, **kwargs)
+        if kind == "wait_free":
+            await self.cfg.wait_free_async()
+        elif kind == "sleep_freq":
+            await self.cfg.sleep_freq_async(step[1])
+        else:
+            await asyncio.sleep(step[1])
+
+    async def _run_retry(self, steps):
+        # 同WebRequest._run_retry，以协程方式执行动作
+        value, error = None, None
+        while True:
+            try:
+                if error is None:
+                    step = steps.send(value)
+                else:
+                    step = steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            value, error = None, None
+            try:
+                value = await self._run_step(step)
+            except Exception as e:
+                error = e
+
+    async def get_retry(
+        self,
+        url,
+        msg,
+        use_cache=False,
+        init_header=True,
+        url_format=True,
+        max_retry=50,
+        logger=None,
+        except_retry=False,
+        **kwargs,
+    ):
+        return await self._run_retry(
+            get_retry_steps(
+                self.cfg,
+                url,
+                msg,
+                max_retry=max_retry,
+                logger=logger,
+                except_retry=except_retry,
+                use_cache=use_cache,
+                init_header=init_header,
+                url_format=url_format,
+                **kwargs,
+            )
+        )
+
+    async def amf_post(self, body, target, url, attempt=1, **kwargs):
+        with request_tracer.trace(
+            self.wr.account, target, url, "POST", attempt=attempt
+        ) as trace:
+            start = perf_counter()
+            data = encode_amf(target, body)
+            trace.encode_time += perf_counter() - start
+            kwargs.setdefault("endpoint", target)
+            resp = await self.post(
+                url,
+                data=data,
+                headers={"Content-Type": "application/x-amf"},
+                trace=trace,
+                **kwargs,
+            )
+            if len(resp) == 0:
+                raise RuntimeError("amf返回结果为空")
+            from pyamf import remoting
+
+            start = perf_counter()
+            result = remoting.decode(resp)["/1"]
+            trace.decode_time += perf_counter() - start
+            trace.outcome = amf_outcome(result)
+            return result
+
+    async def amf_post_retry(
+        self,
+        body,
+        target,
+        url,
+        msg,
+        max_retry=50,
+        logger=None,
+        allow_empty=False,
+        except_retry=False,
+        **kwargs,
+    ):
+        return await self._run_retry(
+            amf_post_retry_steps(
+                self.cfg,
+                body,
+                target,
+                url,
+                msg,
+                max_retry=max_retry,
+                logger=logger,
+                allow_empty=allow_empty,
+                except_retry=except_retry,
+                **kwargs,
+            )
+        )
+
+    async def amf_batch(self, call_list, url, attempt=1, **kwargs):
+        kwargs.setdefault("endpoint", call_list[0][0])
+        with request_tracer.trace(
+            self.wr.account,
+            batch_endpoint(call_list),
+            url,
+            "POST",
+            attempt=attempt,
+            call_num=len(call_list),
+        ) as trace:
+            start = perf_counter()
+            data = encode_amf_batch(call_list)
+            trace.encode_time += perf_counter() - start
+            resp = await self.post(
+                url,
+                data=data,
+                headers={"Content-Type": "application/x-amf"},
+                trace=trace,
+                **kwargs,
+            )
+            start = perf_counter()
+            response_list = decode_amf_batch(resp, len(call_list))
+            trace.decode_time += perf_counter() - start
+            trace.outcome = batch_outcome(response_list)
+            return response_list
+
+    async def amf_batch_retry(
+        self,
+        call_list,
+        url,
+        msg,
+        batch_size=20,
+        max_retry=50,
+        logger=None,
+        allow_empty=False,
+        except_retry=False,
+        **kwargs,
+    ):
+        # 规则同WebRequest.amf_batch_retry
+        return await self._run_retry(
+            amf_batch_retry_steps(
+                self.cfg,
+                call_list,
+                url,
+                msg,
+                batch_size=batch_size,
+                max_retry=max_retry,
+                logger=logger,
+                allow_empty=allow_empty,
+                except_retry=except_retry,
+                **kwargs,
+            )
+        )
@@ -1,7 +1,12 @@
 import json
+import asyncio
 import logging
 from threading import Lock, Event
-from time import perf_counter, sleep
+from time import sleep
+
+from .ratelimit import RateLimiter, TokenBucketRateLimiter, AIMDRateLimiter
+from .utils.cache import DEFAULT_RESPONSE_TTL
+from .utils.waiter import AsyncWaiters
 
 
 class Config:
@@ -33,12 +38,15 @@ class Config:
         if 'server' not in self.config:
             error("server")
         self.timeout = 7
-        self.millsecond_delay = 0
-        self._lock = Lock()
-        self.last_time = 0
-        self.wait_requests_over = False
+        self.rate_limiter: RateLimiter = TokenBucketRateLimiter()
+        self._millsecond_delay = 0
+        self._burst = 1
+        self._wait_requests_over = False
+        self.pool_size = 10  # 该账号共用连接池的最大keep-alive连接数
+        self.cache_ttl = DEFAULT_RESPONSE_TTL  # use_cache的缓存有效秒数，过期后向服务器验证，None表示永不过期
         self.free_event = Event()
         self.free_event.set()
+        self.free_waiters = AsyncWaiters()  # 等待free_event的协程
         self._freq_lock = Lock()
 
     def sleep_freq(self, t):
@@ -53,20 +61,110 @@ class Config:
         finally:
             self._freq_lock.release()
             self.free_event.set()
+            self.free_waiters.notify_all()
+
+    async def wait_free_async(self):
+        # free_event.wait的协程版本
+        while not self.free_event.is_set():
+            waiter = self.free_waiters.wait()
+            if self.free_event.is_set():
+                break
+            await waiter
+
+    async def sleep_freq_async(self, t):
+        # sleep_freq的协程版本：只让一个线程或协程睡，其余等待它睡完
+        if not self.free_event.is_set() or not self._freq_lock.acquire(blocking=False):
+            await self.wait_free_async()
+            return
+        try:
+            self.free_event.clear()
+            await asyncio.sleep(t)
+        finally:
+            self._freq_lock.release()
+            self.free_event.set()
+            self.free_waiters.notify_all()
+
+    @property
+    def millsecond_delay(self):
+        return self._millsecond_delay
+
+    @millsecond_delay.setter
+    def millsecond_delay(self, value):
+        self._millsecond_delay = value
+        self._apply_rate()
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @burst.setter
+    def burst(self, value):
+        self._burst = value
+        self._apply_rate()
+
+    @property
+    def wait_requests_over(self):
+        return self._wait_requests_over
+
+    @wait_requests_over.setter
+    def wait_requests_over(self, value):
+        self._wait_requests_over = value
+        if isinstance(self.rate_limiter, TokenBucketRateLimiter):
+            self.rate_limiter.set_max_concurrency(1 if value else None)
+
+    @property
+    def congestion_control(self):
+        # 是否按endpoint做AIMD拥塞控制，默认关闭。
+        # 开启后每个endpoint的初始并发窗口为连接池大小，被限流后才收缩
+        return isinstance(self.rate_limiter, AIMDRateLimiter)
+
+    @congestion_control.setter
+    def congestion_control(self, value):
+        if value == self.congestion_control:
+            return
+        if value:
+            self.set_rate_limiter(AIMDRateLimiter(initial_window=self.pool_size))
+        else:
+            self.set_rate_limiter(TokenBucketRateLimiter())
+
+    def _apply_rate(self):
+        # millsecond_delay换算为账号令牌桶的速率，burst为令牌桶容量
+        if not isinstance(self.rate_limiter, TokenBucketRateLimiter):
+            return
+        rate = None
+        if self._millsecond_delay > 0:
+            rate = 1000 / self._millsecond_delay
+        self.rate_limiter.set_rate(rate, self._burst)
+
+    def set_rate_limiter(self, rate_limiter: RateLimiter):
+        self.rate_limiter = rate_limiter
+        self._apply_rate()
+        self.wait_requests_over = self._wait_requests_over
+
+    def acquire(self, endpoint=None):
+        return self.rate_limiter.acquire(endpoint)
+
+    async def acquire_async(self, endpoint=None):
+        return await self.rate_limiter.acquire_async(endpoint)
+
+    def release(self, token=None):
+        self.rate_limiter.release(token)
+
+    def reserve_delay(self, endpoint=None):
+        # 不阻塞地预约下一个请求时间片，返回需要等待的秒数，供协程用asyncio.sleep等待
+        return self.rate_limiter.reserve(endpoint)
 
-    def acquire(self):
-        self._lock.acquire()
-        now = perf_counter()
-        if now - self.last_time < self.millsecond_delay / 1000:
-            sleep((self.millsecond_delay / 1000) - (now - self.last_time))
-        if not self.wait_requests_over:
-            self._lock.release()
-            self.last_time = perf_counter()
+    def feedback(self, endpoint=None, throttled=False):
+        self.rate_limiter.feedback(endpoint, throttled)
 
-    def release(self):
-        if self.wait_requests_over:
-            self._lock.release()
-            self.last_time = perf_counter()
+    def congestion_window(self, endpoint, limit=None):
+        # endpoint当前允许的并发数，不超过limit。用于按服务器承受能力调整线程池大小
+        window = self.rate_limiter.window(endpoint)
+        if window is None:
+            return limit
+        if limit is None:
+            return window
+        return max(1, min(window, limit))
 
     @property
     def username(self):
@@ -93,6 +191,9 @@ class Config:
             "config": self.config,
             "timeout": self.timeout,
             "millsecond_delay": self.millsecond_delay,
+            "burst": self.burst,
+            "pool_size": self.pool_size,
+            "cache_ttl": self.cache_ttl,
         }
         return data
 
@@ -0,0 +1,177 @@
+'''
+无界面运行入口，不依赖PyQt6，适合在没有显示器的服务器上挂机。
+
+读取webUI保存的data/config/config.json和各用户的usersettings，
+按用户设置循环运行，收到SIGINT/SIGTERM后停止所有用户并保存设置。
+
+在助手根目录运行：python -m pypvz.daemon [-u 用户名 ...] [--max-concurrency 4]
+'''
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+import threading
+
+from .config import Config
+from .web import proxy_man
+from .library import library_registry
+from .ui.user import UserSettings, LoginOrchestrator, LoginTask
+from .utils.common import CallbackSignal
+
+
+class HeadlessRunner:
+    '''
+    Args:
+        root_dir: 助手根目录
+        config_list: 需要运行的用户配置，格式与data/config/config.json中的一致
+        max_concurrency: 同时登录的最大账号数
+    '''
+
+    def __init__(self, root_dir, config_list: list[dict], max_concurrency=4):
+        self.root_dir = root_dir
+        self.config_list = config_list
+        self.orchestrator = LoginOrchestrator(root_dir, max_concurrency=max_concurrency)
+        self.stop_event = threading.Event()
+        self._changed = threading.Event()
+        self._lock = threading.Lock()
+        self.task_list: list[LoginTask] = []
+        self.usersettings_list: list[UserSettings] = []
+        self.running_set: set[UserSettings] = set()
+
+    def start(self):
+        for config in self.config_list:
+            self.task_list.append(
+                self.orchestrator.submit(Config(config), self._login_finished)
+            )
+
+    def _login_finished(self, task: LoginTask):
+        usersettings = task.usersettings
+        with self._lock:
+            self.usersettings_list.append(usersettings)
+            if self.stop_event.is_set():
+                return
+            self.running_set.add(usersettings)
+        usersettings.start(
+            CallbackSignal(lambda: self._user_closed(task)),
+            CallbackSignal(lambda: self._user_finished(task)),
+        )
+
+    def _user_closed(self, task: LoginTask):
+        logging.info("{}没有可以做的事情了，退出用户".format(task.user_info))
+
+    def _user_finished(self, task: LoginTask):
+        logging.info("{}停止工作".format(task.user_info))
+        with self._lock:
+            self.running_set.discard(task.usersettings)
+        self._changed.set()
+
+    def _all_finished(self):
+        if not all(task.done.is_set() for task in self.task_list):
+            return False
+        with self._lock:
+            return len(self.running_set) == 0
+
+    def wait(self):
+        # 定时醒来，保证主线程能及时处理信号
+        while not self.stop_event.is_set():
+            if self._all_finished():
+                logging.info("所有用户都已停止工作")
+                return
+            self._changed.wait(1)
+            self._changed.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        self._changed.set()
+
+    def shutdown(self):
+        '''
+        停止所有用户，等待工作线程退出后保存设置
+        '''
+        self.stop_event.set()
+        # 正在登录的账号登录完成后不会再启动
+        for task in self.task_list:
+            task.done.wait()
+        with self._lock:
+            usersettings_list = list(self.usersettings_list)
+        for usersettings in usersettings_list:
+            usersettings.stop_channel.put(True)
+        for usersettings in usersettings_list:
+            if usersettings.start_thread is not None:
+                usersettings.start_thread.join()
+            usersettings.save()
+            usersettings.io_logger.close()
+            library_registry.release(usersettings.lib)
+        logging.info("已保存{}个用户的设置".format(len(usersettings_list)))
+
+
+def load_config_list(root_dir, username_list=None):
+    cfg_path = os.path.join(root_dir, "data/config/config.json")
+    if not os.path.exists(cfg_path):
+        return []
+    with open(cfg_path, "r", encoding="utf-8") as f:
+        config_list = json.load(f)
+    if username_list:
+        config_list = [
+            config for config in config_list if config["username"] in username_list
+        ]
+    return config_list
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pypvz.daemon")
+    parser.add_argument(
+        "-u",
+        "--user",
+        action="append",
+        dest="username_list",
+        help="只运行指定用户名的用户，可以重复指定，默认运行所有已保存的用户",
+    )
+    parser.add_argument(
+        "--root-dir", default=os.getcwd(), help="助手根目录，默认为当前目录"
+    )
+    parser.add_argument(
+        "--max-concurrency", type=int, default=4, help="同时登录的最大账号数"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    root_dir = os.path.abspath(args.root_dir)
+    # 图鉴等缓存按相对路径读取
+    os.chdir(root_dir)
+    proxy_man_save_path = os.path.join(root_dir, "data", "config", "proxy.bin")
+    if os.path.exists(proxy_man_save_path):
+        try:
+            proxy_man.load(proxy_man_save_path)
+        except Exception as e:
+            logging.warning(f"代理配置文件解析错误，Exception: {str(e)}")
+
+    config_list = load_config_list(root_dir, args.username_list)
+    if len(config_list) == 0:
+        logging.warning("没有可以运行的用户，请先在webUI中登录并保存用户")
+        return 1
+
+    runner = HeadlessRunner(root_dir, config_list, args.max_concurrency)
+
+    def handle_signal(signum, frame):
+        logging.info("收到信号{}，正在停止所有用户，再次发送将强制退出".format(signum))
+        signal.signal(signum, signal.SIG_DFL)
+        runner.stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    runner.start()
+    try:
+        runner.wait()
+    finally:
+        runner.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
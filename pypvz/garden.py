@@ -1,8 +1,5 @@
 from xml.etree.ElementTree import fromstring
 
-import pyamf
-from pyamf import remoting
-
 from .config import Config
 from .library import Library
 from .user import FriendMan
@@ -30,6 +27,9 @@ class GardenMan:
         Raises:
             RuntimeError: web request failed.
         """
+        import pyamf
+        from pyamf import remoting
+
         if not isinstance(plant_list, (list, tuple)):
             plant_list = [plant_list]
         resp = self.wr.get(
@@ -1,8 +1,15 @@
-from xml.etree.ElementTree import Element, fromstring
+from xml.etree.ElementTree import Element
+import os
 import json
+import pickle
+import hashlib
+import logging
+from concurrent.futures import Future
+from threading import Lock, Thread
 
 from .web import WebRequest
 from .config import Config
+from .utils.xmlstream import ChildElementStream
 
 
 attribute_list = ["HP特", "攻击特", "命中", "闪避", "穿透", "护甲", "HP", "攻击"]
@@ -42,6 +49,163 @@ stone_name_list = [
 ]
 
 
+# 解析后图鉴的磁盘缓存，按内容hash命名，Tool、Plant的字段有变化时需要增加版本号
+LIBRARY_CACHE_VERSION = 1
+library_cache_dir = "./data/cache/library"
+
+# 每个区服最近一次下载到的图鉴内容hash，启动时据此直接读磁盘缓存
+library_index_name = "index.json"
+_library_index_lock = Lock()
+
+# 进程内按内容hash共用解析结果，多个账号的Library共用同一份tools和plants
+_parsed_library_dict: dict[str, tuple[dict, dict]] = {}
+_parsed_library_lock = Lock()
+
+
+def _parse_library(tool_xml: bytes, organism_xml: bytes):
+    # 图鉴xml较大，流式解析，每个节点构造完对象后立即释放
+    tools = {}
+    for _, item in ChildElementStream(tool_xml, ("tools",)):
+        tool = Tool(item)
+        tools[tool.id] = tool
+    plants = {}
+    for _, item in ChildElementStream(organism_xml, ("organisms",)):
+        plant = Plant(item)
+        plants[plant.id] = plant
+    return tools, plants
+
+
+def _prune_library_cache(keep=8):
+    # 不同区服的图鉴不同，保留最近写入的keep份
+    entries = [
+        entry
+        for entry in os.scandir(library_cache_dir)
+        if entry.is_file() and entry.name.endswith(".pickle")
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        os.remove(entry.path)
+
+
+def _library_cache_path(digest):
+    return os.path.join(
+        library_cache_dir, "v{}_{}.pickle".format(LIBRARY_CACHE_VERSION, digest)
+    )
+
+
+def _load_library_cache(digest):
+    # 调用时已持有_parsed_library_lock，没有缓存时返回None
+    parsed = _parsed_library_dict.get(digest)
+    if parsed is not None:
+        return parsed
+    path = _library_cache_path(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data["version"] == LIBRARY_CACHE_VERSION:
+            parsed = data["tools"], data["plants"]
+            _parsed_library_dict[digest] = parsed
+    except Exception as e:
+        logging.warning(
+            "图鉴缓存读取失败，将重新解析。异常类型：{}".format(type(e).__name__)
+        )
+    return parsed
+
+
+def get_library_digest(server_key):
+    '''
+    区服最近一次下载到的图鉴内容hash，没有记录时返回None
+
+    Args:
+        server_key: 区服，同LibraryRegistry._key
+    '''
+    path = os.path.join(library_cache_dir, library_index_name)
+    with _library_index_lock:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+    return index.get("|".join(str(item) for item in server_key))
+
+
+def set_library_digest(server_key, digest):
+    path = os.path.join(library_cache_dir, library_index_name)
+    key = "|".join(str(item) for item in server_key)
+    with _library_index_lock:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        if index.get(key) == digest:
+            return
+        index[key] = digest
+        try:
+            os.makedirs(library_cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("图鉴缓存索引写入失败：{}".format(str(e)))
+
+
+def load_cached_library(digest):
+    '''
+    按内容hash返回已经解析过的(tools, plants)，进程内和磁盘上都没有时返回None
+    '''
+    with _parsed_library_lock:
+        return _load_library_cache(digest)
+
+
+def library_digest(tool_xml: bytes, organism_xml: bytes):
+    return hashlib.sha256(
+        len(tool_xml).to_bytes(8, "little") + tool_xml + organism_xml
+    ).hexdigest()
+
+
+def load_parsed_library(tool_xml: bytes, organism_xml: bytes, digest=None):
+    '''
+    返回解析好的(tools, plants)。按两个xml内容的hash依次查找进程内缓存和磁盘缓存，
+    都没有时才解析xml，并写入磁盘缓存。返回的字典由多个Library共用，不要修改
+
+    Args:
+        tool_xml: tool.xml的内容
+        organism_xml: organism.xml的内容
+        digest: 已经算好的library_digest，None时现算
+    '''
+    if digest is None:
+        digest = library_digest(tool_xml, organism_xml)
+    with _parsed_library_lock:
+        parsed = _load_library_cache(digest)
+        if parsed is not None:
+            return parsed
+        parsed = _parse_library(tool_xml, organism_xml)
+        path = _library_cache_path(digest)
+        try:
+            os.makedirs(library_cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "version": LIBRARY_CACHE_VERSION,
+                        "tools": parsed[0],
+                        "plants": parsed[1],
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, path)
+            _prune_library_cache()
+        except OSError as e:
+            logging.warning("图鉴缓存写入失败：{}".format(str(e)))
+        _parsed_library_dict[digest] = parsed
+        return parsed
+
+
 class Tool:
     def __init__(self, root: Element):
         self.id = int(root.get("id"))
@@ -55,64 +219,196 @@ class Tool:
         self.lottery_name = root.get("lottery_name")
 
 
+class _LibraryData:
+    # 一次刷新得到的图鉴内容，发布后不再修改
+    def __init__(self, tools: dict, plants: dict, skills: list, spec_skills: list):
+        self.tools = tools
+        self.plants = plants
+        self.name2tool = {tool.name: tool for tool in tools.values()}
+        self.skills = skills
+        self.spec_skills = spec_skills
+        self.id2skill = {int(item['id']): item for item in skills}
+        self.id2spec_skill = {int(item['id']): item for item in spec_skills}
+
+
 class Library:
+    '''
+    图鉴。内容放在不可变的_LibraryData里，refresh_library整体替换，
+    所以可以由多个账号、多个线程共用，见LibraryRegistry。
+    区服上次下载的图鉴有磁盘缓存时先用缓存，再在后台下载验证，内容变了才替换
+    '''
+
     def __init__(self, cfg: Config):
         self.cfg = cfg
         self.wr = WebRequest(cfg)
-        self.refresh_library()
+        self._refresh_lock = Lock()
+        self._data: _LibraryData = None
+        self.server_key = (cfg.server, cfg.host)
+        digest = get_library_digest(self.server_key)
+        parsed = load_cached_library(digest) if digest is not None else None
+        if parsed is not None:
+            self._publish(*parsed)
+            Thread(target=self._revalidate, daemon=True).start()
+        else:
+            self.refresh_library()
         self.watch_id = 613  # 时之怀表id
         self.fuben_book_id = 612  # 副本挑战书id
 
     def refresh_library(self):
-        results = self.wr.get_async_gather(
-            self.wr.get_async(
-                "/pvz/php_xml/tool.xml", "获取道具图鉴", except_retry=True
-            ),
-            self.wr.get_async(
-                "/pvz/php_xml/organism.xml", "获取植物图鉴", except_retry=True
-            ),
-        )
-        resp = results[0]
-        tools = fromstring(resp.decode("utf-8")).find("tools")
-        self.tools = [Tool(item) for item in tools]
-
-        resp = results[1]
-        plants = fromstring(resp.decode("utf-8")).find("organisms")
-        self.plants = [Plant(item) for item in plants]
-
-        self.tools = {tool.id: tool for tool in self.tools}
-        self.plants = {plant.id: plant for plant in self.plants}
+        with self._refresh_lock:
+            results = self.wr.get_async_gather(
+                self.wr.get_async(
+                    "/pvz/php_xml/tool.xml", "获取道具图鉴", except_retry=True
+                ),
+                self.wr.get_async(
+                    "/pvz/php_xml/organism.xml", "获取植物图鉴", except_retry=True
+                ),
+            )
+            digest = library_digest(results[0], results[1])
+            tools, plants = load_parsed_library(results[0], results[1], digest)
+            set_library_digest(self.server_key, digest)
+            if self._data is None or self._data.tools is not tools:
+                self._publish(tools, plants)
 
-        self.name2tool = {tool.name: tool for tool in self.tools.values()}
+    def _revalidate(self):
+        try:
+            self.refresh_library()
+        except Exception as e:
+            logging.warning(
+                "后台刷新图鉴失败，继续使用缓存。异常类型：{}".format(type(e).__name__)
+            )
 
+    def _publish(self, tools, plants):
         with open("./data/cache/pvz/skills.json", "r", encoding="utf-8") as f:
-            self.skills = json.load(f)
+            skills = json.load(f)
         with open("./data/cache/pvz/spec_skills.json", "r", encoding="utf-8") as f:
-            self.spec_skills = json.load(f)
+            spec_skills = json.load(f)
+        self._data = _LibraryData(tools, plants, skills, spec_skills)
+
+    @property
+    def tools(self) -> dict[int, "Tool"]:
+        return self._data.tools
+
+    @property
+    def plants(self) -> dict[int, "Plant"]:
+        return self._data.plants
+
+    @property
+    def name2tool(self) -> dict[str, "Tool"]:
+        return self._data.name2tool
+
+    @property
+    def skills(self) -> list:
+        return self._data.skills
+
+    @property
+    def spec_skills(self) -> list:
+        return self._data.spec_skills
 
     def get_plant_by_id(self, pid):
         if isinstance(pid, str):
             pid = int(pid)
-        result = self.plants.get(pid, None)
+        result = self._data.plants.get(pid, None)
         return result
 
     def get_tool_by_id(self, id):
         if isinstance(id, str):
             id = int(id)
-        result = self.tools.get(id, None)
+        result = self._data.tools.get(id, None)
         return result
 
     def get_skill(self, skill_id: int):
-        for item in self.skills:
-            if int(item['id']) == skill_id:
-                return item
-        return None
+        return self._data.id2skill.get(skill_id, None)
 
     def get_spec_skill(self, skill_id: int):
-        for item in self.spec_skills:
-            if int(item['id']) == skill_id:
-                return item
-        return None
+        return self._data.id2spec_skill.get(skill_id, None)
+
+
+class _LibraryEntry:
+    def __init__(self):
+        self.future = Future()
+        self.ref_count = 0
+
+
+class LibraryRegistry:
+    '''
+    进程内按区服共用Library，带引用计数。
+    同一区服的第一个账号负责下载和解析图鉴，同时登录的其它账号等待它完成后直接使用；
+    所有引用都release之后移除该Library
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries: dict[tuple, _LibraryEntry] = {}
+
+    @staticmethod
+    def _key(cfg: Config):
+        return (cfg.server, cfg.host)
+
+    def acquire(self, cfg: Config) -> Library:
+        key = self._key(cfg)
+        with self._lock:
+            entry = self._entries.get(key)
+            is_creator = entry is None
+            if is_creator:
+                entry = _LibraryEntry()
+                self._entries[key] = entry
+            entry.ref_count += 1
+        if is_creator:
+            try:
+                entry.future.set_result(Library(cfg))
+            except BaseException as e:
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        self._entries.pop(key)
+                entry.future.set_exception(e)
+                raise
+        try:
+            return entry.future.result()
+        except BaseException:
+            with self._lock:
+                entry.ref_count -= 1
+            raise
+
+    def release(self, lib: Library):
+        key = self._key(lib.cfg)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.future.done():
+                return
+            if entry.future.exception() is not None or entry.future.result() is not lib:
+                return
+            entry.ref_count -= 1
+            if entry.ref_count <= 0:
+                self._entries.pop(key)
+
+    def refresh_all(self):
+        '''
+        重新加载所有已登录区服的图鉴，使用这些Library的账号都会看到新的内容
+        '''
+        with self._lock:
+            entry_list = [
+                entry for entry in self._entries.values() if entry.future.done()
+            ]
+        for entry in entry_list:
+            if entry.future.exception() is not None:
+                continue
+            lib: Library = entry.future.result()
+            try:
+                lib.refresh_library()
+            except Exception as e:
+                logging.warning(
+                    "刷新{}图鉴失败，异常类型：{}".format(
+                        lib.cfg.server, type(e).__name__
+                    )
+                )
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+library_registry = LibraryRegistry()
 
 
 class EvolutionLibPath:
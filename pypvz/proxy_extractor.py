@@ -9,6 +9,7 @@ class BaseProxyExtractor:
             test_url_list = ["http://pvzol.org/"]
         self.test_url_list = test_url_list
         self.name = name
+        self.max_workers = 8
     
     def test_proxy(self, proxy):
         headers = {
@@ -31,7 +32,11 @@ class BaseProxyExtractor:
     
     def test_proxies(self, proxies):
         filterd_proxies = []
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        if len(proxies) == 0:
+            return filterd_proxies
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(proxies))
+        ) as executor:
             futures = [executor.submit(self.test_proxy, proxy) for proxy in proxies]
             for future in concurrent.futures.as_completed(futures):
                 proxy = future.result()
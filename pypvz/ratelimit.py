@@ -0,0 +1,354 @@
+import re
+import asyncio
+from threading import Condition, Lock, Semaphore
+from time import perf_counter, sleep
+from urllib.parse import urlparse
+
+from .utils.waiter import AsyncWaiters
+
+_NUMERIC_SEGMENT = re.compile(r"/-?\d+(?=/|$)")
+
+
+def endpoint_name(url):
+    '''
+    get/post请求的endpoint：url路径中的纯数字段(用户id、植物id等)替换成{id}，
+    对不同好友、不同植物的同一个接口归到同一个endpoint，限流状态和统计不会随id无限增长。
+    如/pvz/index.php/cave/index/id/123/type/private_2/sig/0
+    -> /pvz/index.php/cave/index/id/{id}/type/private_2/sig/{id}
+    '''
+    return _NUMERIC_SEGMENT.sub("/{id}", urlparse(url).path)
+
+
+class TokenBucket:
+    '''
+    预约式令牌桶：令牌可以透支，reserve返回需要等待的秒数。
+    调用方在锁外睡眠，多个线程之间不会因为等待而互相串行。
+    rate为None表示不限速。
+    '''
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.last_time = perf_counter()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_time) * self.rate
+            )
+        self.last_time = now
+
+    def set_rate(self, rate, burst=None):
+        self._refill(perf_counter())
+        self.rate = rate
+        if burst is not None:
+            self.burst = max(1, burst)
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, now):
+        self._refill(now)
+        if self.rate is None:
+            return 0
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    '''
+    限流器接口。Config在每个请求前后调用acquire/release，
+    WebRequest在识别到频繁/429或者请求成功时调用feedback。
+    endpoint是amf的target或者get/post的endpoint_name(url)，None表示不区分。
+    协程用acquire_async，并发已满时由release唤醒。
+    '''
+
+    def __init__(self):
+        self.async_waiters = AsyncWaiters()
+
+    def reserve(self, endpoint=None):
+        # 返回需要等待的秒数，不阻塞
+        return 0
+
+    def acquire(self, endpoint=None):
+        # 返回值原样传给release
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            sleep(delay)
+
+    def try_acquire(self, endpoint=None):
+        # 不阻塞的acquire。并发已满时返回None，否则返回(token, 需要等待的秒数)
+        return None, self.reserve(endpoint)
+
+    async def acquire_async(self, endpoint=None):
+        # acquire的协程版本，不占用线程。返回值原样传给release
+        result = self.try_acquire(endpoint)
+        while result is None:
+            waiter = self.async_waiters.wait()
+            result = self.try_acquire(endpoint)
+            if result is None:
+                await waiter
+        token, delay = result
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.release(token)
+                raise
+        return token
+
+    def release(self, token=None):
+        pass
+
+    def feedback(self, endpoint=None, throttled=False):
+        pass
+
+    def window(self, endpoint=None):
+        # endpoint当前允许的在途请求数，None表示不限制
+        return None
+
+
+class _EndpointState:
+    def __init__(self, window=None):
+        self.bucket = TokenBucket()
+        self.base_rate = None
+        self.rate_scale = 1.0
+        self.penalty_until = 0
+        self.backoff = 0
+        self.window = window
+        self.inflight = 0
+        self.slow_start = True
+
+
+class TokenBucketRateLimiter(RateLimiter):
+    '''
+    按账号的令牌桶，加上按endpoint的令牌桶预算和退避。
+
+    Args:
+        rate: 账号每秒请求数，None表示不限速
+        burst: 账号令牌桶容量，即允许的突发请求数
+        max_concurrency: 同时在途请求数上限，None表示不限制
+        min_backoff: 某个endpoint第一次被限流后暂停的秒数，之后连续被限流则翻倍
+        max_backoff: 退避时间上限
+    '''
+
+    def __init__(
+        self,
+        rate=None,
+        burst=1,
+        max_concurrency=None,
+        min_backoff=0.5,
+        max_backoff=10,
+    ):
+        super().__init__()
+        self._lock = Lock()
+        self.account_bucket = TokenBucket(rate, burst)
+        self.endpoint_dict: dict[str, _EndpointState] = {}
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._semaphore = None
+        self.max_concurrency = None
+        self.set_max_concurrency(max_concurrency)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.account_bucket.set_rate(rate, burst)
+
+    def set_max_concurrency(self, max_concurrency):
+        # 正在使用旧信号量的请求仍然释放旧的，不会错乱
+        self.max_concurrency = max_concurrency
+        self._semaphore = (
+            Semaphore(max_concurrency) if max_concurrency is not None else None
+        )
+        self.async_waiters.notify_all()
+
+    def set_endpoint_budget(self, endpoint, rate, burst=1):
+        with self._lock:
+            state = self._get_endpoint(endpoint)
+            state.base_rate = rate
+            state.bucket.set_rate(rate, burst)
+
+    def _new_endpoint_state(self):
+        return _EndpointState()
+
+    def _get_endpoint(self, endpoint):
+        state = self.endpoint_dict.get(endpoint)
+        if state is None:
+            state = self._new_endpoint_state()
+            self.endpoint_dict[endpoint] = state
+        return state
+
+    def reserve(self, endpoint=None):
+        with self._lock:
+            now = perf_counter()
+            delay = self.account_bucket.reserve(now)
+            if endpoint is not None:
+                state = self._get_endpoint(endpoint)
+                delay = max(
+                    delay, state.bucket.reserve(now), state.penalty_until - now
+                )
+            return max(delay, 0)
+
+    def acquire(self, endpoint=None):
+        semaphore = self._semaphore
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            super().acquire(endpoint)
+        except:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+        return semaphore
+
+    def try_acquire(self, endpoint=None):
+        semaphore = self._semaphore
+        if semaphore is not None and not semaphore.acquire(blocking=False):
+            return None
+        return semaphore, self.reserve(endpoint)
+
+    def release(self, token=None):
+        if token is not None:
+            token.release()
+        self.async_waiters.notify_all()
+
+    def feedback(self, endpoint=None, throttled=False):
+        with self._lock:
+            self._on_feedback(self._get_endpoint(endpoint), throttled)
+
+    def _on_feedback(self, state: _EndpointState, throttled):
+        # 调用时已持有self._lock
+        if throttled:
+            state.backoff = min(
+                self.max_backoff, max(self.min_backoff, state.backoff * 2)
+            )
+            state.penalty_until = max(
+                state.penalty_until, perf_counter() + state.backoff
+            )
+        elif state.backoff > 0:
+            state.backoff = 0
+
+    def window(self, endpoint=None):
+        return self.max_concurrency
+
+
+class AIMDRateLimiter(TokenBucketRateLimiter):
+    '''
+    在TokenBucketRateLimiter基础上按endpoint做AIMD拥塞控制。
+
+    每个endpoint维护一个在途请求窗口：成功时加性增大（慢启动阶段每次加1，
+    之后每个窗口的成功加1），被限流时乘性减小，同时按同样比例降低该endpoint
+    令牌桶的速率。被限流只影响对应的endpoint，其它endpoint照常请求。
+
+    Args:
+        initial_window: 新endpoint的初始窗口
+        min_window: 窗口下限
+        max_window: 窗口上限
+        decrease: 被限流时窗口和速率的缩小比例
+        min_rate_scale: 速率最多缩小到预算的多少倍
+        其余参数同TokenBucketRateLimiter
+    '''
+
+    def __init__(
+        self,
+        rate=None,
+        burst=1,
+        max_concurrency=None,
+        min_backoff=0.5,
+        max_backoff=10,
+        initial_window=4,
+        min_window=1,
+        max_window=64,
+        decrease=0.5,
+        min_rate_scale=1 / 16,
+    ):
+        super().__init__(
+            rate=rate,
+            burst=burst,
+            max_concurrency=max_concurrency,
+            min_backoff=min_backoff,
+            max_backoff=max_backoff,
+        )
+        self._cond = Condition(self._lock)
+        self.initial_window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease = decrease
+        self.min_rate_scale = min_rate_scale
+
+    def _new_endpoint_state(self):
+        return _EndpointState(window=self.initial_window)
+
+    def _leave(self, state: _EndpointState):
+        if state is None:
+            return
+        with self._cond:
+            state.inflight -= 1
+            self._cond.notify_all()
+        self.async_waiters.notify_all()
+
+    def acquire(self, endpoint=None):
+        state = None
+        if endpoint is not None:
+            with self._cond:
+                state = self._get_endpoint(endpoint)
+                while state.inflight >= int(state.window):
+                    self._cond.wait()
+                state.inflight += 1
+        try:
+            semaphore = super().acquire(endpoint)
+        except:
+            self._leave(state)
+            raise
+        return semaphore, state
+
+    def try_acquire(self, endpoint=None):
+        state = None
+        if endpoint is not None:
+            with self._cond:
+                state = self._get_endpoint(endpoint)
+                if state.inflight >= int(state.window):
+                    return None
+                state.inflight += 1
+        result = super().try_acquire(endpoint)
+        if result is None:
+            self._leave(state)
+            return None
+        semaphore, delay = result
+        return (semaphore, state), delay
+
+    def release(self, token=None):
+        if token is None:
+            return
+        semaphore, state = token
+        self._leave(state)
+        super().release(semaphore)
+
+    def _on_feedback(self, state: _EndpointState, throttled):
+        super()._on_feedback(state, throttled)
+        if throttled:
+            state.slow_start = False
+            state.window = max(self.min_window, state.window * self.decrease)
+            state.rate_scale = max(
+                self.min_rate_scale, state.rate_scale * self.decrease
+            )
+        else:
+            if state.slow_start:
+                state.window = min(self.max_window, state.window + 1)
+            else:
+                state.window = min(self.max_window, state.window + 1 / state.window)
+            state.rate_scale = min(1.0, state.rate_scale + self.min_rate_scale)
+            self._cond.notify_all()
+            self.async_waiters.notify_all()
+        if state.base_rate is not None:
+            state.bucket.set_rate(state.base_rate * state.rate_scale)
+
+    def window(self, endpoint=None):
+        if endpoint is None:
+            return self.max_concurrency
+        with self._lock:
+            window = int(self._get_endpoint(endpoint).window)
+        if self.max_concurrency is not None:
+            window = min(window, self.max_concurrency)
+        return window
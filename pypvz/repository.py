@@ -1,62 +1,393 @@
-from xml.etree.ElementTree import Element, fromstring
+from xml.etree.ElementTree import Element
 import logging
 import time
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import Future
 from threading import Lock
 
 from .config import Config
 from .web import WebRequest
 from .library import Plant, Library
 from .upgrade import quality_name_list
+from .utils.xmlstream import ChildElementStream
+from .utils.optional import optional_import
 
 
-class Plant:
-    def __init__(self, root: Element) -> None:
-        self.id = int(root.get("id"))
-        self.pid = int(root.get("pid"))
-        self.attack = int(root.get("at"))
-        self.armor = int(root.get("mi"))
-        self.speed = int(root.get("sp"))
-        self.hp_now = int(root.get("hp"))
-        self.hp_max = int(root.get("hm"))
-        self.grade = int(root.get("gr"))
-        self.growth = root.get("im")
-        self.piercing = int(root.get("pr"))
-        self.precision = int(root.get("new_precision"))
-        self.miss = int(root.get("new_miss"))
-        self.quality_str = root.get("qu")
-        self.fight = int(root.get("fight"))
+# 数值列，用array("q")存放，超出int64范围时该列退化为list
+_INT_FIELDS = (
+    "id",
+    "pid",
+    "attack",
+    "armor",
+    "speed",
+    "hp_now",
+    "hp_max",
+    "grade",
+    "piercing",
+    "precision",
+    "miss",
+    "fight",
+    "quality_index",
+    "soul_level",
+)
+_OBJECT_FIELDS = (
+    "growth",
+    "quality_str",
+    "special_skill_id",
+    "skill_id_list",
+    "stone_level_list",
+)
+# 服务器下发的植物字段，本地修改这些字段后该植物不能在增量刷新时复用
+_PLANT_FIELDS = _INT_FIELDS + _OBJECT_FIELDS
+
+
+def element_signature(root: Element):
+    # 植物节点自身属性值的hash，不遍历子节点。技能、宝石、灵魂变化时战力等属性会跟着变，
+    # 只有子节点变化的情况由Repository定期的校验刷新兜底
+    return hash(tuple(root.attrib.values()))
+
+
+def _hp_ratio(hp_now, hp_max):
+    return hp_now / hp_max if hp_max != 0 else float("inf")
+
+
+class PlantIndex:
+    '''
+    PlantTable上的二级索引：按血量比例和血量排序的有序表，以及按品质、pid、等级分的桶。
+    由PlantTable在第一次查询时建立，之后随PlantTable.set和remove同步更新。
+    非线程安全，由PlantTable加锁
+    '''
+
+    bucket_fields = ("quality_index", "pid", "grade")
+
+    def __init__(self, table: "PlantTable"):
+        columns = table.columns
+        rows = [row for row, alive in enumerate(table.alive) if alive]
+        hp_now, hp_max = columns["hp_now"], columns["hp_max"]
+        self.hp_ratio_keys = sorted(
+            (_hp_ratio(hp_now[row], hp_max[row]), row) for row in rows
+        )
+        self.hp_keys = sorted((hp_now[row], row) for row in rows)
+        self.buckets: dict[str, dict[int, set[int]]] = {}
+        for name in self.bucket_fields:
+            column = columns[name]
+            bucket = {}
+            for row in rows:
+                bucket.setdefault(column[row], set()).add(row)
+            self.buckets[name] = bucket
+
+    @staticmethod
+    def _remove_key(keys, key):
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            keys.pop(index)
+
+    def add(self, table: "PlantTable", row):
+        columns = table.columns
+        hp_now, hp_max = columns["hp_now"][row], columns["hp_max"][row]
+        insort(self.hp_ratio_keys, (_hp_ratio(hp_now, hp_max), row))
+        insort(self.hp_keys, (hp_now, row))
+        for name in self.bucket_fields:
+            self.buckets[name].setdefault(columns[name][row], set()).add(row)
+
+    def discard(self, table: "PlantTable", row):
+        columns = table.columns
+        hp_now, hp_max = columns["hp_now"][row], columns["hp_max"][row]
+        self._remove_key(self.hp_ratio_keys, (_hp_ratio(hp_now, hp_max), row))
+        self._remove_key(self.hp_keys, (hp_now, row))
+        for name in self.bucket_fields:
+            bucket = self.buckets[name]
+            value = columns[name][row]
+            rows = bucket.get(value)
+            if rows is not None:
+                rows.discard(row)
+                if len(rows) == 0:
+                    bucket.pop(value)
+
+    def hp_below(self, high):
+        if isinstance(high, float):
+            keys = self.hp_ratio_keys
+        else:
+            keys = self.hp_keys
+        end = bisect_right(keys, (high, float("inf")))
+        return [row for _, row in keys[:end]]
+
+    def where(self, **values):
+        result = None
+        # 从最小的桶开始求交集
+        bucket_list = sorted(
+            (self.buckets[name].get(value, ()) for name, value in values.items()),
+            key=len,
+        )
+        for rows in bucket_list:
+            result = set(rows) if result is None else result & rows
+            if len(result) == 0:
+                break
+        return sorted(result) if result is not None else []
+
+
+class PlantTable:
+    '''
+    按列存放仓库植物的属性，一行对应一株植物。
+    每次刷新仓库都构造一张新表，构造完成后只会原地修改某一行的值或者把某一行标记为移除，
+    不再增加行，所以持有旧表的Plant仍然读到旧的值。
+    按血量和按品质、pid、等级的查询走PlantIndex；
+    其余按属性筛选、取前几名的查询在列上扫描，装有numpy时向量化
+    '''
+
+    def __init__(self):
+        self.columns: dict[str, list] = {name: array("q") for name in _INT_FIELDS}
+        self.columns.update({name: [] for name in _OBJECT_FIELDS})
+        self.signatures = []
+        self.alive = bytearray()
+        self.id2row: dict[int, int] = {}
+        self.row2plant: list[Plant] = []
+        # 每次修改某一行或移除某一行时加一，供调用方判断缓存是否失效
+        self.version = 0
+        self._index: PlantIndex = None
+        self._index_lock = Lock()
+
+    def __len__(self):
+        return len(self.alive)
+
+    def _append(self, values, signature):
+        row = len(self.alive)
+        for name, value in zip(_PLANT_FIELDS, values):
+            column = self.columns[name]
+            try:
+                column.append(value)
+            except OverflowError:
+                column = list(column)
+                column.append(value)
+                self.columns[name] = column
+        self.signatures.append(signature)
+        self.alive.append(1)
+        self.id2row[values[0]] = row
+        plant = Plant(self, row)
+        self.row2plant.append(plant)
+        return plant
+
+    def append_element(self, root: Element, signature=None):
+        quality_str = root.get("qu")
         try:
-            self.quality_index = quality_name_list.index(self.quality_str)
+            quality_index = quality_name_list.index(quality_str)
         except:
-            self.quality_index = -1
-            logging.warning(f"未知的品质{self.quality_str}")
-        self.skill_id_list = []
-        for item in root.find("sk").findall("item"):
-            self.skill_id_list.append(
-                int(item.get("id")),
-            )
-        self.special_skill_id = None
+            quality_index = -1
+            logging.warning(f"未知的品质{quality_str}")
+        special_skill_id = None
         item = root.find("ssk").find("item")
         if item is not None:
-            self.special_skill_id = int(item.get("id"))
-        self.stone_level_list = []
-        for item in root.find("tals").findall("tal"):
-            self.stone_level_list.append(int(item.get("level")))
-        self.soul_level = int(root.find("soul").text)
+            special_skill_id = int(item.get("id"))
+        values = (
+            int(root.get("id")),
+            int(root.get("pid")),
+            int(root.get("at")),
+            int(root.get("mi")),
+            int(root.get("sp")),
+            int(root.get("hp")),
+            int(root.get("hm")),
+            int(root.get("gr")),
+            int(root.get("pr")),
+            int(root.get("new_precision")),
+            int(root.get("new_miss")),
+            int(root.get("fight")),
+            quality_index,
+            int(root.find("soul").text),
+            root.get("im"),
+            quality_str,
+            special_skill_id,
+            [int(item.get("id")) for item in root.find("sk").findall("item")],
+            [int(item.get("level")) for item in root.find("tals").findall("tal")],
+        )
+        return self._append(values, signature)
+
+    def row_values(self, row):
+        return [self.columns[name][row] for name in _PLANT_FIELDS]
+
+    def append_copy(self, table: "PlantTable", row):
+        # 从另一张表复制一行，列表类型的字段复制一份，互不影响
+        values = table.row_values(row)
+        values[-2] = list(values[-2])
+        values[-1] = list(values[-1])
+        return self._append(values, table.signatures[row])
+
+    def set(self, row, name, value):
+        with self._index_lock:
+            index = self._index
+            if index is not None and self.alive[row]:
+                index.discard(self, row)
+            column = self.columns[name]
+            try:
+                column[row] = value
+            except OverflowError:
+                column = list(column)
+                column[row] = value
+                self.columns[name] = column
+            self.signatures[row] = None
+            if index is not None and self.alive[row]:
+                index.add(self, row)
+            self.version += 1
+
+    def remove(self, row):
+        with self._index_lock:
+            if not self.alive[row]:
+                return
+            if self._index is not None:
+                self._index.discard(self, row)
+            self.alive[row] = 0
+            self.version += 1
+
+    def _get_index(self):
+        # 调用时已持有self._index_lock
+        if self._index is None:
+            self._index = PlantIndex(self)
+        return self._index
+
+    def _vector(self, name):
+        # numpy可用且该列没有退化为list时，返回与列共享内存的ndarray
+        column = self.columns[name]
+        if not isinstance(column, array) or len(column) == 0:
+            return None
+        np = optional_import("numpy")
+        if np is None:
+            return None
+        return np.frombuffer(column, dtype=np.int64)
+
+    def _alive_rows(self):
+        return [row for row, alive in enumerate(self.alive) if alive]
+
+    def hp_below(self, high):
+        '''
+        血量不高于high的行号，按血量(比例)从低到高排列
+
+        Args:
+            high: float为血量比例，int为血量
+        '''
+        if not isinstance(high, (float, int)):
+            raise TypeError("high must be float or int")
+        with self._index_lock:
+            return self._get_index().hp_below(high)
+
+    def where(self, **values):
+        '''
+        所有给定字段都等于对应值的行号，字段只能是PlantIndex.bucket_fields中的，
+        如where(pid=151, quality_index=12)
+        '''
+        for name in values:
+            if name not in PlantIndex.bucket_fields:
+                raise ValueError("{}没有索引".format(name))
+        with self._index_lock:
+            return self._get_index().where(**values)
+
+    def at_least(self, **min_values):
+        '''
+        所有给定字段都不小于对应值的行号，如at_least(grade=100, fight=1e18)
+        '''
+        vector_list = [(self._vector(name), value) for name, value in min_values.items()]
+        if all(vector is not None for vector, _ in vector_list):
+            np = optional_import("numpy")
+            mask = np.frombuffer(self.alive, dtype=np.bool_).copy()
+            for vector, value in vector_list:
+                mask &= vector >= value
+            return np.flatnonzero(mask).tolist()
+        column_list = [(self.columns[name], value) for name, value in min_values.items()]
+        return [
+            row
+            for row in self._alive_rows()
+            if all(column[row] >= value for column, value in column_list)
+        ]
+
+    def top(self, name, n, largest=True):
+        '''
+        按某个字段取前n名的行号，按该字段排好序
+
+        Args:
+            name: 字段名
+            n: 数量
+            largest: True取最大的n个，False取最小的n个
+        '''
+        vector = self._vector(name)
+        if vector is not None:
+            np = optional_import("numpy")
+            rows = np.flatnonzero(np.frombuffer(self.alive, dtype=np.bool_))
+            values = vector[rows] if largest else -vector[rows]
+            if n < len(rows):
+                part = np.argpartition(-values, n)[:n]
+                rows, values = rows[part], values[part]
+            return rows[np.argsort(-values, kind="stable")].tolist()
+        column = self.columns[name]
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return select(n, self._alive_rows(), key=column.__getitem__)
+
+
+class _Field:
+    # Plant上的字段，读写所在PlantTable对应列的当前行
+    __slots__ = ("name",)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, plant, owner=None):
+        if plant is None:
+            return self
+        return plant._table.columns[self.name][plant._row]
+
+    def __set__(self, plant, value):
+        plant._table.set(plant._row, self.name, value)
+
+
+class Plant:
+    '''
+    仓库中的一株植物，是PlantTable中一行的视图。
+    读写字段都落到表的列上，修改字段后该植物在下次增量刷新时会重新解析
+    '''
+
+    __slots__ = ("_table", "_row", "predict_grade")
+
+    id = _Field()
+    pid = _Field()
+    attack = _Field()
+    armor = _Field()
+    speed = _Field()
+    hp_now = _Field()
+    hp_max = _Field()
+    grade = _Field()
+    piercing = _Field()
+    precision = _Field()
+    miss = _Field()
+    fight = _Field()
+    quality_index = _Field()
+    soul_level = _Field()
+    growth = _Field()
+    quality_str = _Field()
+    special_skill_id = _Field()
+    skill_id_list = _Field()
+    stone_level_list = _Field()
+
+    def __init__(self, table: PlantTable, row: int) -> None:
+        self._table = table
+        self._row = row
+
+    @property
+    def _signature(self):
+        # 仓库xml中该植物节点属性的hash，用于增量刷新时判断植物是否变化
+        return self._table.signatures[self._row]
+
+    @property
+    def sort_key(self):
+        return (-self.grade, self.pid, -self.quality_index, -self.fight)
 
     def width(self, lib: Library):
-        assert hasattr(self, "_width") or lib is not None
-        if hasattr(self, "_width"):
-            return self.plant_width
-        self.plant_width = lib.get_plant_by_id(self.pid).width
-        return self.plant_width
+        if lib is None:
+            raise ValueError("lib can't be None")
+        return lib.get_plant_by_id(self.pid).width
 
     def name(self, lib: Library):
-        assert hasattr(self, "_name") or lib is not None
-        if hasattr(self, "_name"):
-            return self.plant_name
-        self.plant_name = lib.get_plant_by_id(self.pid).name
-        return self.plant_name
+        if lib is None:
+            raise ValueError("lib can't be None")
+        return lib.get_plant_by_id(self.pid).name
 
     def info(self, lib: Library = None, quality=True):
         if lib is None:
@@ -67,41 +398,308 @@ class Plant:
         return result
 
 
+class RepositoryChange:
+    '''
+    一次刷新仓库相对于上一次的变化，记录的都是植物id和道具id
+    '''
+
+    def __init__(self):
+        self.added_plants: list[int] = []
+        self.removed_plants: list[int] = []
+        self.modified_plants: list[int] = []
+        self.added_tools: list[int] = []
+        self.removed_tools: list[int] = []
+        self.modified_tools: list[int] = []
+
+    def is_empty(self):
+        return (
+            len(self.added_plants)
+            + len(self.removed_plants)
+            + len(self.modified_plants)
+            + len(self.added_tools)
+            + len(self.removed_tools)
+            + len(self.modified_tools)
+            == 0
+        )
+
+    def __str__(self):
+        return "植物新增{}个，移除{}个，变化{}个；道具新增{}种，移除{}种，变化{}种".format(
+            len(self.added_plants),
+            len(self.removed_plants),
+            len(self.modified_plants),
+            len(self.added_tools),
+            len(self.removed_tools),
+            len(self.modified_tools),
+        )
+
+
+class RepositorySnapshot:
+    '''
+    仓库某一时刻的内容。发布之后列表和字典都不再修改，修改仓库时构造新的快照整体替换，
+    读者拿到快照后不用加锁。
+    PlantTable由相邻的快照共用，只会原地修正某株植物的字段或标记移除
+    '''
+
+    def __init__(
+        self,
+        plants: list[Plant] = None,
+        plant_keys: list = None,
+        table: PlantTable = None,
+        id2plant: dict[int, Plant] = None,
+        tools: list[dict] = None,
+        id2tool: dict[int, dict] = None,
+        organism_grid_amount=0,
+    ):
+        self.plants = plants if plants is not None else []
+        self.plant_keys = plant_keys if plant_keys is not None else []
+        self.table = table if table is not None else PlantTable()
+        self.id2plant = id2plant if id2plant is not None else {}
+        self.tools = tools if tools is not None else []
+        self.id2tool = id2tool if id2tool is not None else {}
+        self.organism_grid_amount = organism_grid_amount
+        self._plant_rank: array = None
+
+    def plant_rank(self):
+        # 行号到该植物在plants中下标的映射，第一次用到时建立。不在plants中的行排在最后
+        rank = self._plant_rank
+        if rank is None:
+            rank = array("q", [len(self.plants)]) * len(self.table)
+            for index, plant in enumerate(self.plants):
+                rank[plant._row] = index
+            self._plant_rank = rank
+        return rank
+
+    def sort_rows(self, rows):
+        # 把索引查询得到的行号按plants的顺序排列
+        return sorted(rows, key=self.plant_rank().__getitem__)
+
+    @property
+    def organism_grid_rest_amount(self):
+        return self.organism_grid_amount - len(self.plants)
+
+    def replace(self, **kwargs):
+        # 复制一份快照并替换给定的字段
+        values = dict(
+            plants=self.plants,
+            plant_keys=self.plant_keys,
+            table=self.table,
+            id2plant=self.id2plant,
+            tools=self.tools,
+            id2tool=self.id2tool,
+            organism_grid_amount=self.organism_grid_amount,
+        )
+        values.update(kwargs)
+        return RepositorySnapshot(**values)
+
+
+class RefreshStats:
+    '''
+    refresh_repository的调用统计
+    '''
+
+    def __init__(self):
+        self.request_count = 0  # 调用次数
+        self.fetch_count = 0  # 实际下载仓库的次数
+        self.fresh_hit_count = 0  # 数据足够新，直接返回的次数
+        self.joined_count = 0  # 合并到正在进行的刷新上的次数
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+
+    def record_fetch(self, latency):
+        self.fetch_count += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+
+    @property
+    def avg_latency(self):
+        if self.fetch_count == 0:
+            return None
+        return self.total_latency / self.fetch_count
+
+    def __str__(self):
+        if self.fetch_count == 0:
+            latency_info = "无"
+        else:
+            latency_info = "平均{:.2f}秒，最长{:.2f}秒".format(
+                self.avg_latency, self.max_latency
+            )
+        return "刷新仓库{}次，实际下载{}次，合并{}次，直接使用已有数据{}次。下载耗时：{}".format(
+            self.request_count,
+            self.fetch_count,
+            self.joined_count,
+            self.fresh_hit_count,
+            latency_info,
+        )
+
+
+class _WarehouseData:
+    # 一次解析仓库xml的结果
+    def __init__(self):
+        self.tool_list: list[dict] = []
+        self.table = PlantTable()
+        self.id2plant: dict[int, Plant] = {}
+        self.new_plant_list: list[Plant] = []
+        self.change = RepositoryChange()
+        self.organism_grid_amount = 0
+
+
 class Repository:
+    '''
+    仓库。内容放在不可变的RepositorySnapshot里，修改时整体替换(写时复制)：
+    读取不加锁，刷新仓库期间读到的是上一次的快照。
+    写操作之间用self._lock串行，刷新仓库只在替换快照时持有self._lock，下载和解析期间
+    本地修改照常进行，这些修改会记下来，在新快照上重放
+    '''
+
     def __init__(self, cfg: Config):
         self.cfg = cfg
         self.wr = WebRequest(cfg)
-        self._lock = Lock()
-        self._refresh_lock = Lock()
+        self._lock = Lock()  # 写锁，只在写操作之间互斥
+        # 刷新仓库下载期间的本地修改，没有在刷新时为None
+        self._edit_log: list = None
+        # 正在进行的刷新及其发出请求的时间，最近一次成功刷新发出请求的时间
+        self._flight_lock = Lock()
+        self._flight: Future = None
+        self._flight_start = None
+        self._fetched_time = None
+        self.refresh_stats = RefreshStats()
+        # 只做检查、不依赖刚刚发生的操作时，可以接受的仓库数据的最大秒数
+        self.check_max_age = 3
+        self._snapshot = RepositorySnapshot()
+        self.last_change: RepositoryChange = None
+        self._listener_list = []
+        # 变化的植物数超过总数的这个比例时直接整体重新排序
+        self.incremental_sort_ratio = 0.125
+        # 增量刷新只比较植物节点自身的属性，每隔这么多次增量刷新完整解析一次所有植物做校验
+        self.verify_interval = 20
+        self._incremental_count = 0
         self.refresh_repository()
 
-    def refresh_repository(self, logger=None):
+    def snapshot(self) -> RepositorySnapshot:
+        # 当前快照。需要同时读多个字段并且保证它们一致时使用
+        return self._snapshot
+
+    @property
+    def plants(self) -> list[Plant]:
+        return self._snapshot.plants
+
+    @property
+    def table(self) -> PlantTable:
+        return self._snapshot.table
+
+    @property
+    def id2plant(self) -> dict[int, Plant]:
+        return self._snapshot.id2plant
+
+    @property
+    def tools(self) -> list[dict]:
+        return self._snapshot.tools
+
+    @property
+    def id2tool(self) -> dict[int, dict]:
+        return self._snapshot.id2tool
+
+    @property
+    def organism_grid_amount(self):
+        return self._snapshot.organism_grid_amount
+
+    @property
+    def organism_grid_rest_amount(self):
+        return self._snapshot.organism_grid_rest_amount
+
+    def add_listener(self, callback):
+        # 每次刷新仓库后以RepositoryChange为参数调用callback
+        self._listener_list.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listener_list:
+            self._listener_list.remove(callback)
+
+    def refresh_repository(self, logger=None, incremental=True, max_age=None):
+        '''
+        刷新仓库。同一时刻只有一个线程在下载仓库，其它线程的调用合并到这次刷新上
+
+        Args:
+            logger: 日志
+            incremental: 是否增量刷新
+            max_age: 能接受的仓库数据的最大秒数。None表示必须用本次调用之后发出的请求刷新；
+                否则最近一次刷新的请求在max_age秒以内发出时直接返回，不再下载
+        '''
+        threshold = time.perf_counter() - (max_age or 0)
+        stats = self.refresh_stats
+        with self._flight_lock:
+            stats.request_count += 1
+        while True:
+            with self._flight_lock:
+                if self._fetched_time is not None and self._fetched_time >= threshold:
+                    stats.fresh_hit_count += 1
+                    return
+                flight = self._flight
+                if flight is None:
+                    flight = Future()
+                    self._flight = flight
+                    self._flight_start = time.perf_counter()
+                    break
+                joinable = self._flight_start >= threshold
+                if joinable:
+                    stats.joined_count += 1
+            if joinable:
+                # 正在进行的刷新足够新，等它完成即可，异常也一并抛出
+                flight.result()
+                return
+            # 正在进行的刷新发出得太早，等它结束后再看
+            try:
+                flight.result()
+            except Exception:
+                pass
+
+        start_time = self._flight_start
+        change = None
         try:
-            is_requiring = self._refresh_lock.locked()
-            self._lock.acquire()
-            self._refresh_lock.acquire()
-            if is_requiring:    # 锁释放，说明已经是新data了
-                return            
-            cnt, max_retry = 0, 20
-            while cnt < max_retry:
-                cnt += 1
+            change = self._refresh_with_retry(logger, incremental)
+        except BaseException as e:
+            with self._flight_lock:
+                self._flight = None
+            flight.set_exception(e)
+            raise
+        with self._flight_lock:
+            self._flight = None
+            if change is not None:
+                self._fetched_time = start_time
+                stats.record_fetch(time.perf_counter() - start_time)
+        flight.set_result(change)
+        if change is not None:
+            for callback in list(self._listener_list):
                 try:
-                    self._refresh_repository(logger=logger)
-                    break
-                except RuntimeError as e:
-                    raise e
+                    callback(change)
                 except Exception as e:
-                    msg = "刷新仓库出现异常，异常类型：{}".format(type(e).__name__)
-                    if logger is not None:
-                        logger.log(msg)
-                    else:
-                        logging.warning(msg)
-                    continue
-        finally:
-            self._lock.release()
-            self._refresh_lock.release()
+                    logging.warning(
+                        "仓库变化回调出现异常，异常类型：{}".format(type(e).__name__)
+                    )
+
+    def _refresh_with_retry(self, logger=None, incremental=True):
+        # 同一时刻只有一个线程调用，由refresh_repository保证
+        cnt, max_retry = 0, 20
+        while cnt < max_retry:
+            cnt += 1
+            try:
+                return self._refresh_repository(logger=logger, incremental=incremental)
+            except RuntimeError as e:
+                raise e
+            except Exception as e:
+                msg = "刷新仓库出现异常，异常类型：{}".format(type(e).__name__)
+                if logger is not None:
+                    logger.log(msg)
+                else:
+                    logging.warning(msg)
+                continue
+        return None
 
-    def _refresh_repository(self, logger=None):
+    def _fetch_warehouse(
+        self, old: RepositorySnapshot, logger=None, incremental=True, verify=False
+    ):
         url = "/pvz/index.php/Warehouse/index/sig/0"
         cnt, max_retry = 0, 20
         while cnt < max_retry:
@@ -110,13 +708,11 @@ class Repository:
                 resp = self.wr.get_retry(
                     url, "刷新仓库", logger=logger, except_retry=True
                 )
-                resp_text = resp.decode("utf-8")
                 try:
-                    root = fromstring(resp_text)
-                    assert root.find("response").find("status").text == "success"
-                    break
+                    return self._parse_warehouse(resp, old, incremental, verify)
                 except:
-                    if resp_text.startswith("<html"):
+                    if resp.startswith(b"<html"):
+                        resp_text = resp.decode("utf-8", errors="replace")
                         logging.error(
                             f"{resp_text}\n刷新仓库出现问题。大概率是Cookie或者区服选择有误。上面是响应"
                         )
@@ -140,103 +736,304 @@ class Repository:
                 else:
                     logging.info(msg)
                 time.sleep(3)
-        warehouse = root.find("warehouse")
-        tools = warehouse.find("tools")
-        organisms = warehouse.find("organisms")
-        self.tools = [
-            {"id": int(item.get("id")), "amount": int(item.get("amount"))}
-            for item in tools
-        ]
-        self.plants = [Plant(item) for item in organisms if item.tag == 'item']
-        self.tools.sort(key=lambda x: x['id'])
-        self.plants.sort(key=lambda x: (-x.grade, x.pid, -x.quality_index, -x.fight))
-        self.id2plant = {plant.id: plant for plant in self.plants}
-        self.id2tool = {tool['id']: tool for tool in self.tools}
-        self.organism_grid_amount = int(warehouse.get("organism_grid_amount"))
-        self.organism_grid_rest_amount = self.organism_grid_amount - len(self.plants)
+        raise Exception("刷新仓库失败次数过多")
 
-    def hp_below(self, high, id_only=False):
-        with self._lock:
-            result = []
-            if isinstance(high, float):
-                for plant in self.plants:
-                    if plant.hp_now / plant.hp_max <= high:
-                        if id_only:
-                            result.append(plant.id)
-                        else:
-                            result.append(plant)
-            elif isinstance(high, int):
-                for plant in self.plants:
-                    if plant.hp_now <= high:
-                        if id_only:
-                            result.append(plant.id)
-                        else:
-                            result.append(plant)
+    def _parse_warehouse(
+        self, resp: bytes, old: RepositorySnapshot, incremental=True, verify=False
+    ):
+        '''
+        流式解析仓库xml，逐个处理道具和植物节点，处理完立即释放，不构造整棵树。
+        所有植物写入一张新的PlantTable，只解析节点属性有变化的植物，其余从上一张表复制。
+        解析结果先放在_WarehouseData里，确认响应成功后才替换仓库内容
+
+        Args:
+            resp: 仓库接口返回的xml
+            old: 发出请求时的快照，和它比较得出变化
+            incremental: 是否复用内容没有变化的植物
+            verify: 增量刷新时也解析属性没变的植物，和旧值比较，找出只有子节点变化的植物
+        '''
+        old_id2plant = old.id2plant
+        data = _WarehouseData()
+        stream = ChildElementStream(resp, ("warehouse/tools", "warehouse/organisms"))
+        for parent, item in stream:
+            if parent.tag == "tools":
+                data.tool_list.append(
+                    {"id": int(item.get("id")), "amount": int(item.get("amount"))}
+                )
+                continue
+            if item.tag != 'item':
+                continue
+            signature = element_signature(item)
+            plant_id = int(item.get("id"))
+            old_plant = old_id2plant.get(plant_id)
+            unchanged = (
+                incremental
+                and old_plant is not None
+                and old_plant._signature == signature
+            )
+            if unchanged and not verify:
+                plant = data.table.append_copy(old_plant._table, old_plant._row)
+                data.id2plant[plant_id] = plant
+                continue
+            plant = data.table.append_element(item, signature)
+            data.id2plant[plant_id] = plant
+            if unchanged and data.table.row_values(
+                plant._row
+            ) == old_plant._table.row_values(old_plant._row):
+                continue
+            data.new_plant_list.append(plant)
+            if old_plant is None:
+                data.change.added_plants.append(plant_id)
             else:
-                raise TypeError("high must be float or int")
-            return result
+                data.change.modified_plants.append(plant_id)
+        assert stream.root.find("response").find("status").text == "success"
+        warehouse = stream.root.find("warehouse")
+        data.organism_grid_amount = int(warehouse.get("organism_grid_amount"))
+        return data
 
-    def get_plant(self, id):
+    def _refresh_repository(self, logger=None, incremental=True):
+        # 下载和解析不持有self._lock，期间的本地修改记在self._edit_log里
+        verify = False
+        if incremental:
+            self._incremental_count += 1
+            if self._incremental_count >= self.verify_interval:
+                self._incremental_count = 0
+                verify = True
+        with self._lock:
+            old = self._snapshot
+            self._edit_log = []
+        try:
+            data = self._fetch_warehouse(
+                old, logger=logger, incremental=incremental, verify=verify
+            )
+            change = data.change
+            tools, id2tool = self._apply_tools(old, data.tool_list, change)
+            plants, plant_keys = self._apply_plants(
+                old, data.id2plant, data.new_plant_list, change, incremental
+            )
+        except BaseException:
+            with self._lock:
+                self._edit_log = None
+            raise
         with self._lock:
-            if isinstance(id, str):
-                id = int(id)
-            plant = self.id2plant.get(id, None)
-            return plant
+            edit_log, self._edit_log = self._edit_log, None
+            self._snapshot = RepositorySnapshot(
+                plants=plants,
+                plant_keys=plant_keys,
+                table=data.table,
+                id2plant=data.id2plant,
+                tools=tools,
+                id2tool=id2tool,
+                organism_grid_amount=data.organism_grid_amount,
+            )
+            # 下载期间的修改发生在旧快照上，在新快照上再做一遍
+            for edit in edit_log:
+                edit()
+            self.last_change = change
+        return change
+
+    @staticmethod
+    def _apply_tools(
+        old: RepositorySnapshot, tool_list: list[dict], change: RepositoryChange
+    ):
+        old_id2tool = old.id2tool
+        tool_list.sort(key=lambda x: x['id'])
+        id2tool = {tool['id']: tool for tool in tool_list}
+        for tool in tool_list:
+            old_tool = old_id2tool.get(tool['id'])
+            if old_tool is None:
+                change.added_tools.append(tool['id'])
+            elif old_tool['amount'] != tool['amount']:
+                change.modified_tools.append(tool['id'])
+        change.removed_tools = [id for id in old_id2tool if id not in id2tool]
+        return tool_list, id2tool
+
+    def _apply_plants(
+        self,
+        old: RepositorySnapshot,
+        id2plant: dict[int, Plant],
+        new_plant_list: list[Plant],
+        change: RepositoryChange,
+        incremental=True,
+    ):
+        change.removed_plants = [id for id in old.id2plant if id not in id2plant]
+
+        num_changed = len(new_plant_list) + len(change.removed_plants)
+        if (
+            not incremental
+            or len(old.plants) == 0
+            or num_changed > len(id2plant) * self.incremental_sort_ratio
+        ):
+            plants = sorted(id2plant.values(), key=lambda x: x.sort_key)
+            plant_keys = [plant.sort_key for plant in plants]
+        else:
+            # 在旧的有序列表上删去移除和变化的植物，再二分插入新的植物
+            drop_set = set(change.removed_plants)
+            drop_set.update(change.modified_plants)
+            plants, plant_keys = [], []
+            for plant, key in zip(old.plants, old.plant_keys):
+                if plant.id not in drop_set:
+                    plants.append(id2plant[plant.id])
+                    plant_keys.append(key)
+            for plant in new_plant_list:
+                key = plant.sort_key
+                index = bisect_right(plant_keys, key)
+                plant_keys.insert(index, key)
+                plants.insert(index, plant)
+        return plants, plant_keys
+
+    # 以下查询都只读取当前快照，不加锁，刷新仓库时也不会阻塞
+    @staticmethod
+    def _rows_to_result(table: PlantTable, rows, id_only):
+        if id_only:
+            id_column = table.columns["id"]
+            return [id_column[row] for row in rows]
+        return [table.row2plant[row] for row in rows]
+
+    def hp_below(self, high, id_only=False):
+        '''
+        血量(比例)不高于high的植物，与plants的顺序一致
+        '''
+        snapshot = self._snapshot
+        rows = snapshot.sort_rows(snapshot.table.hp_below(high))
+        return self._rows_to_result(snapshot.table, rows, id_only)
+
+    def plants_where(self, id_only=False, **values):
+        '''
+        按品质、pid、等级精确查找植物，如plants_where(pid=151, quality_index=12)，
+        与plants的顺序一致
+        '''
+        snapshot = self._snapshot
+        rows = snapshot.sort_rows(snapshot.table.where(**values))
+        return self._rows_to_result(snapshot.table, rows, id_only)
+
+    def plants_at_least(self, id_only=False, **min_values):
+        '''
+        所有给定字段都不小于对应值的植物，如plants_at_least(grade=100, fight=1e18)，
+        与plants的顺序一致
+        '''
+        snapshot = self._snapshot
+        rows = snapshot.sort_rows(snapshot.table.at_least(**min_values))
+        return self._rows_to_result(snapshot.table, rows, id_only)
+
+    def top_plants(self, attr_name, n, largest=True, id_only=False):
+        '''
+        按某个属性取前n名植物，按该属性排好序
+
+        Args:
+            attr_name: Plant的数值字段名，如fight、attack
+            n: 数量
+            largest: True取最大的n个，False取最小的n个
+            id_only: 是否只返回植物id
+        '''
+        table = self.table
+        return self._rows_to_result(
+            table, table.top(attr_name, n, largest=largest), id_only
+        )
+
+    def get_plant(self, id):
+        if isinstance(id, str):
+            id = int(id)
+        return self._snapshot.id2plant.get(id, None)
 
     def get_tool(self, id, return_amount=False):
-        with self._lock:
-            if isinstance(id, str):
-                id = int(id)
-            tool = self.id2tool.get(id, None)
-            if not return_amount:
-                return tool
-            else:
-                return tool['amount'] if tool is not None else 0
+        '''
+        返回的道具字典属于当前快照，不要直接修改，修改数量用add_tool、remove_tool或set_tool_amount
+        '''
+        if isinstance(id, str):
+            id = int(id)
+        tool = self._snapshot.id2tool.get(id, None)
+        if not return_amount:
+            return tool
+        else:
+            return tool['amount'] if tool is not None else 0
+
+    def _edit(self, edit):
+        # 调用时已持有self._lock。在当前快照上执行修改，刷新仓库正在下载时记下来供重放
+        result = edit()
+        if self._edit_log is not None:
+            self._edit_log.append(edit)
+        return result
 
     def remove_plant(self, id):
+        if isinstance(id, str):
+            id = int(id)
         with self._lock:
-            if isinstance(id, str):
-                id = int(id)
-            plant = self.id2plant.get(id, None)
-            if plant is None:
-                return False
-            self.plants.remove(plant)
-            self.id2plant.pop(id)
-            return True
+            return self._edit(lambda: self._remove_plant(id))
 
-    def remove_tool(self, id, amount: int = None):
-        with self._lock:
-            if isinstance(id, str):
-                id = int(id)
-            tool = self.id2tool.get(id, None)
+    def _remove_plant(self, id):
+        old = self._snapshot
+        plant = old.id2plant.get(id, None)
+        if plant is None:
+            return False
+        index = old.plants.index(plant)
+        id2plant = dict(old.id2plant)
+        id2plant.pop(id)
+        self._snapshot = old.replace(
+            plants=old.plants[:index] + old.plants[index + 1 :],
+            plant_keys=old.plant_keys[:index] + old.plant_keys[index + 1 :],
+            id2plant=id2plant,
+        )
+        plant._table.remove(plant._row)
+        return True
+
+    def _replace_tool(self, id, amount):
+        # 调用时已持有self._lock。amount为None时移除该道具，道具不存在时添加到末尾
+        old = self._snapshot
+        tools, id2tool = list(old.tools), dict(old.id2tool)
+        tool = id2tool.get(id, None)
+        if amount is None:
             if tool is None:
                 return
-            if amount is None:
-                self.tools.remove(tool)
-                self.id2tool.pop(id)
+            tools.remove(tool)
+            id2tool.pop(id)
+        else:
+            new_tool = {"id": id, "amount": amount}
+            if tool is None:
+                tools.append(new_tool)
             else:
-                assert isinstance(amount, int)
-                tool['amount'] -= amount
-                if tool['amount'] <= 0:
-                    self.tools.remove(tool)
-                    self.id2tool.pop(id)
+                tools[tools.index(tool)] = new_tool
+            id2tool[id] = new_tool
+        self._snapshot = old.replace(tools=tools, id2tool=id2tool)
+
+    def remove_tool(self, id, amount: int = None):
+        if isinstance(id, str):
+            id = int(id)
+        assert amount is None or isinstance(amount, int)
+        with self._lock:
+            self._edit(lambda: self._remove_tool(id, amount))
+
+    def _remove_tool(self, id, amount):
+        tool = self._snapshot.id2tool.get(id, None)
+        if tool is None:
+            return
+        if amount is None:
+            self._replace_tool(id, None)
+        else:
+            rest_amount = tool['amount'] - amount
+            self._replace_tool(id, rest_amount if rest_amount > 0 else None)
 
     def add_tool(self, id, amount):
+        if isinstance(id, str):
+            id = int(id)
+        if isinstance(amount, str):
+            amount = int(amount)
         with self._lock:
-            if isinstance(id, str):
-                id = int(id)
-            if isinstance(amount, str):
-                amount = int(amount)
-            tool = self.id2tool.get(id, None)
-            if tool is None:
-                tool = {
-                    "id": id,
-                    "amount": amount,
-                }
-                self.tools.append(tool)
-                self.id2tool[id] = tool
-            else:
-                tool['amount'] += amount
+            self._edit(lambda: self._add_tool(id, amount))
+
+    def _add_tool(self, id, amount):
+        tool = self._snapshot.id2tool.get(id, None)
+        if tool is not None:
+            amount += tool['amount']
+        self._replace_tool(id, amount)
+
+    def set_tool_amount(self, id, amount):
+        if isinstance(id, str):
+            id = int(id)
+        if isinstance(amount, str):
+            amount = int(amount)
+        with self._lock:
+            self._edit(lambda: self._replace_tool(id, amount))
 
     def use_item(self, tool_id, amount, lib: Library):
         if isinstance(amount, str):
@@ -75,6 +75,20 @@ class Task:
         self.wr.amf_post_retry(
             body, "api.duty.reward", "/pvz/amf/", "领取任务奖励", except_retry=True
         )
+        return self._format_reward(task_item, lib)
+
+    def claim_reward_batch(self, task_item_list: list[TaskItem], lib: Library):
+        # 一次请求领取多个任务奖励，返回值与claim_reward一一对应
+        call_list = [
+            ("api.duty.reward", [float(task_item.id), float(task_item.choice)])
+            for task_item in task_item_list
+        ]
+        self.wr.amf_batch_retry(
+            call_list, "/pvz/amf/", "领取任务奖励", except_retry=True
+        )
+        return [self._format_reward(task_item, lib) for task_item in task_item_list]
+
+    def _format_reward(self, task_item: TaskItem, lib: Library):
         result = "{}:{}领取成功。获得：".format(
             task_item.brief_title(), task_item.brief_description()
         )
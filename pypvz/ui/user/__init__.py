@@ -35,3 +35,4 @@ def save_data(data, save_dir, save_name):
 from .auto_challenge import SingleCave
 from .auto_pipeline import PipelineMan, PipelineScheme, Pipeline
 from .usersettings import UserSettings
+from .login import LoginOrchestrator, LoginTask
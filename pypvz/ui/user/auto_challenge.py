@@ -2,6 +2,10 @@ import pickle
 import os
 from copy import deepcopy
 import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from queue import Queue
 
 from ...cave import Cave
@@ -71,6 +75,36 @@ class SingleCave:
         return SingleCave(new_cave, self.difficulty, new_sc_garden_layer, self.use_sand)
 
 
+class _CaveInfoCache:
+    # 同一个好友同一层的洞口信息只请求一次，多个线程同时要时其余线程等第一个线程的结果
+    def __init__(self, caveMan: CaveMan, logger: Logger = None):
+        self.caveMan = caveMan
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._future_dict: dict[tuple, Future] = {}
+
+    def get(self, friend_id, sc: SingleCave) -> Cave:
+        key = (friend_id, sc.cave.type, sc.cave.layer)
+        with self._lock:
+            future = self._future_dict.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._future_dict[key] = Future()
+        if is_owner:
+            try:
+                future.set_result(
+                    self.caveMan.get_caves(
+                        friend_id, sc.cave.type, sc.cave.layer, logger=self.logger
+                    )
+                )
+            except Exception as e:
+                future.set_exception(e)
+        for cave in future.result():
+            if cave.id == sc.cave.id:
+                return cave
+        raise ValueError(f"can't find cave {sc.cave.id}")
+
+
 class Challenge4Level:
     def __init__(
         self,
@@ -103,6 +137,7 @@ class Challenge4Level:
         self.advanced_challenge_book_amount = 20
         self.enable_sand = False
         self.show_lottery = False
+        self.prefetch_cave_num = 2  # 挑战洞口时提前准备的后续洞口数
         self.enable_stone = True
         self.enable_large_plant_team = False
         self.exit_no_trash_plant = False
@@ -123,6 +158,7 @@ class Challenge4Level:
         self.has_challenged = False
         self.cooldown_cave_id_set = set()
         self.stone_book_per_use = 0
+        self._trash_plant_cache = None
 
     def switch_to_next_cave(self, sc: SingleCave):
         next_sc = sc.get_next_cave()
@@ -268,25 +304,54 @@ class Challenge4Level:
         if team_grid_amount == team_limit or grade is None:
             return team
 
-        trash_plant_list = [
-            self.repo.get_plant(plant_id) for plant_id in self.trash_plant_list
-        ]
-        trash_plant_list = list(filter(lambda x: x is not None, trash_plant_list))
-        sorted_grade_trash_plant_list = sorted(
-            trash_plant_list,
-            key=lambda x: (-x.grade, x.width(self.lib)),
-        )
-        for plant in sorted_grade_trash_plant_list:
-            width = plant.width(self.lib)
+        sorted_trash_plant_list, neg_grade_list = self._sorted_trash_plant_list()
+        # 只带比洞口等级低至少5级的炮灰，列表按等级从高到低排列，直接二分定位
+        start = bisect_left(neg_grade_list, 5 - grade)
+        for plant, width in sorted_trash_plant_list[start:]:
             if team_grid_amount + width > team_limit:
                 continue
-            if grade - plant.grade < 5:
-                continue
             team.append(plant.id)
             team_grid_amount += width
         return team
 
-    def _recover(self):
+    def _sorted_trash_plant_list(self):
+        # 按(-等级, 宽度)排好的炮灰及其宽度，仓库和炮灰列表都没变时复用上一次的结果
+        table = self.repo.table
+        key = (table, table.version, tuple(self.trash_plant_list))
+        if self._trash_plant_cache is not None and self._trash_plant_cache[0] == key:
+            return self._trash_plant_cache[1]
+        trash_plant_list = [
+            self.repo.get_plant(plant_id) for plant_id in self.trash_plant_list
+        ]
+        trash_plant_list = [
+            (plant, plant.width(self.lib))
+            for plant in trash_plant_list
+            if plant is not None
+        ]
+        trash_plant_list.sort(key=lambda x: (-x[0].grade, x[1]))
+        result = trash_plant_list, [-plant.grade for plant, _ in trash_plant_list]
+        self._trash_plant_cache = (key, result)
+        return result
+
+    def _team_need_recover(self, team):
+        for plant_id in team:
+            plant = self.repo.get_plant(plant_id)
+            if plant is None:
+                continue
+            if plant.hp_now <= 0:
+                return True
+            if (
+                self.main_plant_recover
+                and plant_id in self.main_plant_list
+                and plant.hp_now / plant.hp_max < self.main_plant_recover_rate
+            ):
+                return True
+        return False
+
+    def _recover(self, team=None):
+        # 给了team时只在出战植物需要回血时才回血，其余没血的植物攒到那时一起批量回复
+        if team is not None and not self._team_need_recover(team):
+            return True
         cnt, max_retry = 0, 20
         success_num_all = 0
         while cnt < max_retry:
@@ -318,7 +383,9 @@ class Challenge4Level:
             self.logger.log("成功给{}个植物回复血量".format(success_num_all))
         return True
 
-    def format_upgrade_message(self, team, response_body, cave_grade):
+    def format_upgrade_message(
+        self, team, response_body, cave_grade, with_lottery=True
+    ):
         message = ""
         plant_list = list(
             filter(
@@ -381,21 +448,24 @@ class Challenge4Level:
                 message = message + "\n\t预测升级植物: {}".format(
                     ' '.join(upgrade_msg_list)
                 )
-        if self.show_lottery:
-            lottery_result = self.caveMan.get_lottery(response_body)
-            if lottery_result["success"]:
-                lottery_list = []
-                for item in lottery_result["result"]:
-                    id, amount = item["id"], item["amount"]
-                    lib_tool = self.lib.get_tool_by_id(id)
-                    if lib_tool is None:
-                        continue
-                    lottery_list.append("{}({})".format(lib_tool.name, amount))
-                message = message + "\n\t战利品: {}".format(" ".join(lottery_list))
-            else:
-                message = message + "\n\t{}".format(lottery_result["result"])
+        if self.show_lottery and with_lottery:
+            message = message + self.format_lottery_message(
+                self.caveMan.get_lottery(response_body)
+            )
         return message
 
+    def format_lottery_message(self, lottery_result):
+        if not lottery_result["success"]:
+            return "\n\t{}".format(lottery_result["result"])
+        lottery_list = []
+        for item in lottery_result["result"]:
+            id, amount = item["id"], item["amount"]
+            lib_tool = self.lib.get_tool_by_id(id)
+            if lib_tool is None:
+                continue
+            lottery_list.append("{}({})".format(lib_tool.name, amount))
+        return "\n\t战利品: {}".format(" ".join(lottery_list))
+
     def pop_trash_plant(self):
         if not self.accelerate_repository_in_challenge_cave:
             trash_plant_list = [
@@ -425,26 +495,14 @@ class Challenge4Level:
             self.trash_plant_list = new_trash_plant_id_list
 
     def challenge_cave(self, stop_channel: Queue):
-        _cave_map = {}
-
-        def get_cave(friend_id, sc: SingleCave):
-            uid = "{}_{}_{}".format(friend_id, sc.cave.type, sc.cave.layer)
-            caves = _cave_map.get(uid, None)
-            if caves is None:
-                caves = self.caveMan.get_caves(
-                    friend_id, sc.cave.type, sc.cave.layer, logger=self.logger
-                )
-                _cave_map[uid] = caves
-            for cave in caves:
-                if cave.id == id:
-                    return cave
-            else:
-                raise ValueError(f"can't find cave {id}")
-
+        '''
+        按顺序挑战当前花园层的洞口。挑战是串行的，其余请求放到后台线程里和挑战重叠：
+        挑战当前洞口时提前获取后面prefetch_cave_num个洞口的信息并按需使用时之沙，
+        战利品在后台获取，日志仍按挑战顺序输出。后台并发数跟随限流器的拥塞窗口
+        '''
+        schedule = []
         for friend_id, caves in self.friend_id2cave.items():
             for id, name in caves:
-                if self.exit_no_trash_plant and len(self.trash_plant_list) == 0:
-                    return False
                 for sc in self.caves:
                     if sc.cave.id == id and sc.cave.name == name:
                         break
@@ -452,80 +510,64 @@ class Challenge4Level:
                     continue
                 if not sc.enabled or sc.cave.type not in [1, 2, 3]:
                     continue
-                if self.disable_cave_info_fetch:
-                    cave_id = sc.cave.quick_cave_id(friend_id, sc.garden_layer)
-                    if cave_id in self.cooldown_cave_id_set:
-                        continue
+                schedule.append((friend_id, sc))
 
-                    if self.enable_sand and sc.use_sand:
-                        cnt, max_retry = 0, 20
-                        while cnt < max_retry:
-                            cnt += 1
-                            try:
-                                sand_result = self.caveMan.use_sand(cave_id)
-                                break
-                            except Exception as e:
-                                self.logger.log(
-                                    "使用时之沙异常，暂停1秒，最多再尝试{}次。异常种类:{}".format(
-                                        max_retry - cnt, type(e).__name__
-                                    )
-                                )
-                                continue
-                        else:
-                            self.logger.log(
-                                "使用时之沙失败，终止刷洞。原因: 重试次数超过{}次.".format(
-                                    max_retry
-                                )
-                            )
-                            return False
-                        if sand_result["success"]:
-                            self.logger.log(
-                                "成功对{}使用时之沙".format(
-                                    sc.cave.format_name(sc.difficulty)
-                                )
-                            )
-                        else:
-                            self.logger.log(sand_result["result"])
-                            continue
-                else:
-                    cave = get_cave(
+        cave_info_cache = _CaveInfoCache(self.caveMan, self.logger)
+        prefetch_num = self.cfg.congestion_window(
+            "api.cave.challenge", self.prefetch_cave_num
+        )
+        # 多一个线程给战利品，避免被提前准备的洞口堵住
+        executor = ThreadPoolExecutor(max_workers=prefetch_num + 1)
+        prepare_list = deque()  # [(friend_id, sc, future)]，按挑战顺序排列
+        # [(message, future)]，挑战日志按顺序排队，等战利品获取完再一起输出
+        lottery_message_list = deque()
+        next_index = 0
+
+        def fill_prepare_list():
+            nonlocal next_index
+            # 当前洞口加上提前准备的洞口
+            while next_index < len(schedule) and len(prepare_list) <= prefetch_num:
+                friend_id, sc = schedule[next_index]
+                next_index += 1
+                prepare_list.append(
+                    (
                         friend_id,
                         sc,
+                        executor.submit(
+                            self._prepare_cave, cave_info_cache, friend_id, sc
+                        ),
                     )
-                    cave_id = cave.cave_id
-                    if not cave.is_ready:
-                        if self.enable_sand and sc.use_sand:
-                            cnt, max_retry = 0, 20
-                            while cnt < max_retry:
-                                cnt += 1
-                                try:
-                                    sand_result = self.caveMan.use_sand(cave_id)
-                                    break
-                                except Exception as e:
-                                    self.logger.log(
-                                        "使用时之沙异常，暂停1秒，最多再尝试{}次。异常种类:{}".format(
-                                            max_retry - cnt, type(e).__name__
-                                        )
-                                    )
-                                    continue
-                            else:
-                                self.logger.log(
-                                    "使用时之沙失败，终止刷洞。原因: 重试次数超过{}次.".format(
-                                        max_retry
-                                    )
-                                )
-                                return False
-                            if sand_result["success"]:
-                                self.logger.log(
-                                    "成功对{}使用时之沙".format(
-                                        sc.cave.format_name(sc.difficulty)
-                                    )
-                                )
-                            else:
-                                self.logger.log(sand_result["result"])
-                                continue
-                        else:
-                            continue
+                )
+
+        def flush_lottery_message(wait=False):
+            while len(lottery_message_list) > 0:
+                message, future = lottery_message_list[0]
+                if future is not None:
+                    if not wait and not future.done():
+                        break
+                    try:
+                        message = message + self.format_lottery_message(
+                            future.result()
+                        )
+                    except Exception as e:
+                        message = message + "\n\t获取战利品信息异常，异常类型：{}".format(
+                            type(e).__name__
+                        )
+                lottery_message_list.popleft()
+                self.logger.log(message)
+
+        try:
+            fill_prepare_list()
+            while len(prepare_list) > 0:
+                if self.exit_no_trash_plant and len(self.trash_plant_list) == 0:
+                    return False
+                friend_id, sc, future = prepare_list.popleft()
+                cave_id = future.result()
+                fill_prepare_list()
+                if cave_id is False:
+                    return False
+                if cave_id is None:
+                    continue
 
                 team = self._assemble_team(sc.cave.grade)
                 if team is None:
@@ -534,7 +576,7 @@ class Challenge4Level:
                     self.need_recover
                     and not self.accelerate_repository_in_challenge_cave
                 ):
-                    success = self._recover()
+                    success = self._recover(team)
                     if not success:
                         return True
                 difficulty = sc.difficulty
@@ -579,13 +621,13 @@ class Challenge4Level:
                                 message = (
                                     message + "失败，已跳过该洞口。原因: 洞口冷却中."
                                 )
-                                self.logger.log(message)
+                                lottery_message_list.append((message, None))
                                 need_skip = True
                                 if self.disable_cave_info_fetch:
                                     self.cooldown_cave_id_set.add(cave_id)
                                 break
                             message = message + "失败. 原因: {}.".format(result)
-                            self.logger.log(message)
+                            lottery_message_list.append((message, None))
                             return False
                         else:
                             message = message + "成功. "
@@ -609,7 +651,7 @@ class Challenge4Level:
                     message = message + "失败. 原因: 重试次数超过{}次.".format(
                         max_retry
                     )
-                    self.logger.log(message)
+                    lottery_message_list.append((message, None))
                     return False
 
                 if need_skip:
@@ -631,10 +673,17 @@ class Challenge4Level:
                         message = message + "，连胜次数：{}".format(
                             sc.series_success_count
                         )
+                # 战利品在后台获取，和刷新仓库、挑战下一个洞口同时进行
+                lottery_future = (
+                    executor.submit(self.caveMan.get_lottery, result)
+                    if self.show_lottery
+                    else None
+                )
                 message = message + self.format_upgrade_message(
-                    team, result, sc.cave.grade
+                    team, result, sc.cave.grade, with_lottery=False
                 )
-                self.logger.log(message)
+                lottery_message_list.append((message, lottery_future))
+                flush_lottery_message()
                 if self.pop_after_100:
                     self.pop_trash_plant()
                 if stop_channel.qsize() > 0:
@@ -660,7 +709,60 @@ class Challenge4Level:
                         else:
                             self.logger.log("识别到已经刷到最后一个洞口，终止刷洞")
                             return False
-        return True
+            return True
+        finally:
+            flush_lottery_message(wait=True)
+            # 没轮到的洞口不再准备，已经在请求的等它结束
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _prepare_cave(
+        self, cave_info_cache: _CaveInfoCache, friend_id, sc: SingleCave
+    ):
+        '''
+        获取洞口信息，洞口没准备好时按设置使用时之沙。在后台线程里提前执行
+
+        Returns:
+            int: 可以挑战的cave_id
+            None: 跳过该洞口
+            False: 使用时之沙失败，终止刷洞
+        '''
+        use_sand = self.enable_sand and sc.use_sand
+        if self.disable_cave_info_fetch:
+            cave_id = sc.cave.quick_cave_id(friend_id, sc.garden_layer)
+            if cave_id in self.cooldown_cave_id_set:
+                return None
+            if not use_sand:
+                return cave_id
+        else:
+            cave = cave_info_cache.get(friend_id, sc)
+            cave_id = cave.cave_id
+            if cave.is_ready:
+                return cave_id
+            if not use_sand:
+                return None
+        cnt, max_retry = 0, 20
+        while cnt < max_retry:
+            cnt += 1
+            try:
+                sand_result = self.caveMan.use_sand(cave_id)
+                break
+            except Exception as e:
+                self.logger.log(
+                    "使用时之沙异常，暂停1秒，最多再尝试{}次。异常种类:{}".format(
+                        max_retry - cnt, type(e).__name__
+                    )
+                )
+                continue
+        else:
+            self.logger.log(
+                "使用时之沙失败，终止刷洞。原因: 重试次数超过{}次.".format(max_retry)
+            )
+            return False
+        if not sand_result["success"]:
+            self.logger.log(sand_result["result"])
+            return None
+        self.logger.log("成功对{}使用时之沙".format(sc.cave.format_name(sc.difficulty)))
+        return cave_id
 
     def challenge_stone_fuben(self, stop_channel: Queue):
         _cave_map = {}
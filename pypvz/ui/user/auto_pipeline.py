@@ -119,7 +119,7 @@ class Purchase(Pipeline):
                     "success": False,
                     "info": "购买失败，原因：{}".format(result['result']),
                 }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         purchased_plant_list = []
         for purchase_item in self.shop_auto_buy_dict.values():
             if stop_channel.qsize() != 0:
@@ -131,8 +131,8 @@ class Purchase(Pipeline):
             if not good.is_plant:
                 continue
             pre_len = len(purchased_plant_list)
-            for plant in self.repo.plants:
-                if plant.pid == good.p_id and plant.id not in pre_id2plant:
+            for plant in self.repo.plants_where(pid=good.p_id):
+                if plant.id not in pre_id2plant:
                     purchased_plant_list.append(plant)
             if purchase_item.amount != len(purchased_plant_list) - pre_len:
                 return {
@@ -302,7 +302,7 @@ class OpenBox(Pipeline):
                 break
             except Exception as e:
                 pre_amount = tool['amount']
-                self.repo.refresh_repository()
+                self.repo.refresh_repository(max_age=self.repo.check_max_age)
                 current_tool = self.repo.get_tool(self.box_id)
                 if current_tool is None:
                     current_amount = 0
@@ -330,7 +330,7 @@ class OpenBox(Pipeline):
                 "success": False,
                 "info": "使用{}失败，原因：{}".format(self.box_name, result['result']),
             }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         plant_list = []
         for plant in self.repo.plants:
             if plant.id in pre_id2plant:
@@ -525,7 +525,7 @@ class UpgradeQuality(Pipeline):
                 "success": False,
                 "info": "用户终止",
             }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         for plant in upgrade_plant_list:
             repo_plant = self.repo.get_plant(plant.id)
             if repo_plant is None:
@@ -671,7 +671,7 @@ class AutoUpgradeQuality(Pipeline):  # 智能升品，仅适用于开魔神箱
                     "success": False,
                     "info": "用户终止",
                 }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
 
         in_plant_quality_dict = {}
         plant_id_list = [plant.id for plant in plant_list]
@@ -736,6 +736,7 @@ class AutoStone(Pipeline):
         self.pool_size = 3
         self.msg = "自动处理-宝石升级"
         self.interrupt_when_failed = False
+        self.batch_size = 20
 
     def check_requirements(self):  # 一个很弱的检查，检查有无对应宝石
         result = []
@@ -772,17 +773,54 @@ class AutoStone(Pipeline):
             self.logger.log(f"{self.msg}: {result['result']}")
         return True
 
+    def upgrade_stone_batch(self, *arg_list):
+        valid_arg_list = []
+        for plant_id, stone_index in arg_list:
+            if self.repo.get_plant(plant_id) is None:
+                if self.interrupt_when_failed:
+                    raise Exception("植物不存在")
+                self.logger.log(f"{self.msg}: 植物不存在")
+                continue
+            valid_arg_list.append((plant_id, stone_index))
+        if len(valid_arg_list) == 0:
+            return True
+        try:
+            result_list = self.stone_man.upgrade_stone_batch(valid_arg_list)
+        except (ConnectionError, ReadTimeout) as e:
+            self.logger.log(f"{self.msg}: {type(e).__name__}. 视作成功升级宝石")
+            return True
+        for (plant_id, stone_index), result in zip(valid_arg_list, result_list):
+            if result is None:
+                if self.interrupt_when_failed:
+                    raise Exception(
+                        "{}: {}不足".format(self.msg, stone_name_list[stone_index])
+                    )
+                self.logger.log(
+                    "{}: {}不足".format(self.msg, stone_name_list[stone_index])
+                )
+                continue
+            if not result["success"]:
+                if self.interrupt_when_failed:
+                    raise Exception(f"{self.msg}: {result['result']}")
+                self.logger.log(f"{self.msg}: {result['result']}")
+        return True
+
     def run(self, plant_list: list[Plant], stop_channel: Queue):
         run_args = []
         for plant in plant_list:
             for i in range(9):
                 for _ in range(plant.stone_level_list[i], self.target_stone_level[i]):
                     run_args.append((plant.id, i))
+        # 每batch_size次升级打包成一个amf请求
+        run_args = [
+            run_args[i : i + self.batch_size]
+            for i in range(0, len(run_args), self.batch_size)
+        ]
         self.rest_event.clear()
         self.interrupt_event.clear()
         error_channel = []
         self.run_thread = CommonAsyncThread(
-            self.upgrade_stone,
+            self.upgrade_stone_batch,
             run_args,
             "自动处理-宝石升级",
             self.repo,
@@ -807,7 +845,7 @@ class AutoStone(Pipeline):
                 "success": False,
                 "info": "升宝石失败，原因：{}".format(error_channel[0]),
             }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         return {
             "success": True,
             "info": "升宝石成功",
@@ -890,7 +928,7 @@ class AutoEvolution(Pipeline):
                 "success": False,
                 "info": "用户终止",
             }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         return {
             "success": True,
             "info": "进化成功",
@@ -1075,7 +1113,7 @@ class AutoSynthesis(Pipeline):
                 break
             except (ConnectionError, ReadTimeout) as e:
                 msg = f"{self.msg}: {type(e).__name__}. "
-                self.repo.refresh_repository()
+                self.repo.refresh_repository(max_age=self.repo.check_max_age)
                 main_plant, eaten_plant = self.repo.get_plant(
                     self.main_plant_id
                 ), self.repo.get_plant(plant_id)
@@ -1090,7 +1128,7 @@ class AutoSynthesis(Pipeline):
                 if "amf返回结果为空" in str(e):
                     msg = "可能由以下原因引起：参与合成的植物不见了、增强卷轴不够、合成书不够"
                     raise Exception("自动吃速度异常，已跳出合成。{}".format(msg))
-                self.repo.refresh_repository()
+                self.repo.refresh_repository(max_age=self.repo.check_max_age)
                 main_plant, eaten_plant = self.repo.get_plant(
                     self.main_plant_id
                 ), self.repo.get_plant(plant_id)
@@ -1136,7 +1174,7 @@ class AutoSynthesis(Pipeline):
                 "success": False,
                 "info": "自动吃速度失败，原因：{}".format(error_channel[0]),
             }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         rest_plant_list = [
             plant for plant in plant_list if self.repo.get_plant(plant.id) is not None
         ]
@@ -1227,7 +1265,7 @@ class AutoComponent(Pipeline):
                 "success": False,
                 "info": "用户终止",
             }
-        self.repo.refresh_repository()
+        self.repo.refresh_repository(max_age=self.repo.check_max_age)
         rest_plant_list = []
         for plant in plant_list:
             if self.repo.get_plant(plant.id) is not None:
@@ -1350,7 +1388,7 @@ class PipelineScheme:
         return self.pipeline4[self.pipeline4_choice_index]
 
     def check_requirements(self):
-        self.repo.refresh_repository(self.logger)
+        self.repo.refresh_repository(self.logger, max_age=self.repo.check_max_age)
         result = []
         result.extend(self.p1.check_requirements())
         result.extend(self.p2.check_requirements())
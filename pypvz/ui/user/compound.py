@@ -103,7 +103,7 @@ class CompoundScheme:
 
     def check_data(self, refresh_repo=True):
         if refresh_repo:
-            self.repo.refresh_repository()
+            self.repo.refresh_repository(max_age=self.repo.check_max_age)
         self.auto_synthesis_man.check_data(False)
         if self.source_plant_id is not None:
             if self.repo.get_plant(self.source_plant_id) is None:
@@ -156,11 +156,11 @@ class CompoundScheme:
             self.auto_compound_pool_id.add(plant_id)
 
     def export_deputy_plant_to_synthesis(self, num, quality_index):
-        auto_compound_pool_id = list(self.auto_compound_pool_id)
         cnt = 0
-        for plant_id in auto_compound_pool_id:
-            plant = self.repo.get_plant(plant_id)
-            if plant.quality_index != quality_index:
+        for plant_id in self.repo.plants_where(
+            id_only=True, quality_index=quality_index
+        ):
+            if plant_id not in self.auto_compound_pool_id:
                 continue
             self.auto_compound_pool_id.remove(plant_id)
             self.auto_synthesis_man.auto_synthesis_pool_id.add(plant_id)
@@ -170,12 +170,10 @@ class CompoundScheme:
         return False
 
     def get_deputy_plant(self):
-        auto_compound_pool_id = list(self.auto_compound_pool_id)
-        for plant_id in auto_compound_pool_id:
-            plant = self.repo.get_plant(plant_id)
-            if plant is None:
-                continue
-            if plant.quality_index != self.need_quality_index:
+        for plant_id in self.repo.plants_where(
+            id_only=True, quality_index=self.need_quality_index
+        ):
+            if plant_id not in self.auto_compound_pool_id:
                 continue
             self.auto_compound_pool_id.remove(plant_id)
             return plant_id
@@ -376,6 +374,78 @@ class AutoCompoundMan:
     def remove_scheme(self, scheme: CompoundScheme):
         self.scheme_list.remove(scheme)
 
+    def optimize_scheme_list(self, cost_weight=None, max_plant_per_cycle=None):
+        '''
+        按主力当前数值和各方案的复合终点，为启用的方案搜索消耗最少的k、n1、n2、m。
+        只计算不修改方案，确认后用apply_scheme_plan_list写回
+
+        Args:
+            cost_weight: 各项消耗的权重，见compound_optimizer.default_cost_weight
+            max_plant_per_cycle: 每个循环最多使用的植物数，None为不限制
+
+        Returns:
+            list: [(方案, CompoundPlan)]，没有可行参数的方案不在其中
+        '''
+        from ...utils.compound_optimizer import (
+            CompoundModel,
+            optimize_compound_scheme,
+            get_quality_coef,
+            get_soul_coef,
+        )
+
+        if self.receiver_plant_id is None:
+            self.logger.log("未设置主力")
+            return []
+        plant = self.repo.get_plant(self.receiver_plant_id)
+        if plant is None:
+            self.logger.log("主力植物不存在")
+            return []
+        result = []
+        for scheme in self.scheme_list:
+            if not scheme.enabled:
+                continue
+            attribute = scheme.chosen_attribute
+            target_attr = scheme.end_mantissa * (10 ** (scheme.end_exponent + 8))
+            need_value = target_attr - getattr(
+                plant, attribute2plant_attribute[attribute]
+            )
+            if need_value <= 0:
+                self.logger.log(f'对于方案"{scheme.name}"而言，主力数值已达到设定值')
+                continue
+            model = CompoundModel(
+                attribute,
+                quality_index=scheme.need_quality_index,
+                receiver_coef=get_quality_coef(plant.quality_index)
+                * get_soul_coef(attribute, plant.soul_level),
+            )
+            # 搜索范围与复合方案界面中的可选值一致
+            plan = optimize_compound_scheme(
+                model,
+                need_value,
+                cost_weight=cost_weight,
+                n1_range=range(0, 11),
+                n2_range=range(0, 31),
+                k_range=range(1, 11),
+                m_range=range(1, 11),
+                max_plant_per_cycle=max_plant_per_cycle,
+            )
+            if plan is None:
+                self.logger.log(f'方案"{scheme.name}"没有可行的参数')
+                continue
+            result.append((scheme, plan))
+        return result
+
+    def apply_scheme_plan_list(self, plan_list):
+        '''
+        把optimize_scheme_list的结果写回方案，只修改k、n1、n2、m，保留后续品质序列
+
+        Args:
+            plan_list: [(方案, CompoundPlan)]
+        '''
+        for scheme, plan in plan_list:
+            scheme.n1, scheme.n2, scheme.k, scheme.m = plan.n1, plan.n2, plan.k, plan.m
+            self.logger.log(f'方案"{scheme.name}"已使用优化参数：{plan}')
+
     def need_compound(self):
         if self.receiver_plant_id is None:
             self.logger.log("未设置主力")
@@ -393,7 +463,7 @@ class AutoCompoundMan:
 
     def check_data(self, refresh_repo=True):
         if refresh_repo:
-            self.repo.refresh_repository()
+            self.repo.refresh_repository(max_age=self.repo.check_max_age)
         if self.liezhi_plant_id is not None:
             if self.repo.get_plant(self.liezhi_plant_id) is None:
                 self.liezhi_plant_id = None
@@ -696,11 +766,11 @@ class AutoCompoundMan:
     def auto_set_source_plant(self):
         self.check_data(False)
         attr_plant_dict = {}
-        for plant in self.repo.plants:
-            if plant.quality_index < quality_name_list.index("魔神"):
-                continue
-            if plant.grade < 100 or plant.fight < 1e18:
-                continue
+        candidate_list = self.repo.plants_at_least(
+            quality_index=quality_name_list.index("魔神"), grade=100, fight=1e18
+        )
+        candidate_list.sort(key=lambda x: x.sort_key)
+        for plant in candidate_list:
             large_attr_cnt, larget_attr_name = 0, None
             for attr_name in list(attribute2plant_attribute.values())[:6]:
                 if getattr(plant, attr_name) >= 1e18:
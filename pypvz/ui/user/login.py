@@ -0,0 +1,266 @@
+import os
+import heapq
+import logging
+import itertools
+import threading
+import concurrent.futures
+from time import perf_counter
+
+from ... import Config, Repository, Library, User
+from ...library import library_registry
+from ..message import IOLogger
+from .usersettings import UserSettings
+
+
+class LoginTiming:
+    '''
+    一次登录各阶段的耗时(秒)。
+    wait为排队等待并发名额的时间，user、library、repository三者是并行的
+    '''
+
+    phase_list = ("wait", "user", "library", "repository", "settings")
+    phase_name = {
+        "wait": "排队",
+        "user": "用户信息",
+        "library": "图鉴",
+        "repository": "仓库",
+        "settings": "载入设置",
+    }
+
+    def __init__(self):
+        for phase in self.phase_list:
+            setattr(self, phase, 0.0)
+        self.total = 0.0
+
+    def __str__(self):
+        return "，".join(
+            "{}{:.2f}s".format(self.phase_name[phase], getattr(self, phase))
+            for phase in self.phase_list
+        ) + "，总计{:.2f}s".format(self.total)
+
+
+class LoginTask:
+    '''
+    Args:
+        cfg: 用户配置
+        callback: 登录成功后调用callback(task)，在登录线程中执行
+        args: 原样保存在task.args中，供callback使用
+        priority: 越大越先登录，相同优先级按提交顺序
+    '''
+
+    def __init__(self, cfg: Config, callback, args=(), priority=0):
+        self.cfg = cfg
+        self.callback = callback
+        self.args = args
+        self.priority = priority
+        self.timing = LoginTiming()
+        self.usersettings: UserSettings = None
+        self.cache_dir = None
+        self.error: Exception = None
+        self.submit_time = perf_counter()
+        # 登录结束(成功时callback已返回)后set
+        self.done = threading.Event()
+
+    @property
+    def user_info(self):
+        return "{}_{}{}区".format(self.cfg.username, self.cfg.server, self.cfg.region)
+
+
+class LoginProgress:
+    def __init__(self):
+        self.total = 0
+        self.success = 0
+        self.failed = 0
+        self.running = 0
+        self.timing_sum = LoginTiming()
+
+    @property
+    def finished(self):
+        return self.success + self.failed
+
+    @property
+    def pending(self):
+        return self.total - self.finished - self.running
+
+    def average_timing(self):
+        timing = LoginTiming()
+        if self.success == 0:
+            return timing
+        for phase in LoginTiming.phase_list + ("total",):
+            setattr(timing, phase, getattr(self.timing_sum, phase) / self.success)
+        return timing
+
+    def __str__(self):
+        return "登录进度：{}/{}，成功{}，失败{}，进行中{}，排队{}".format(
+            self.finished,
+            self.total,
+            self.success,
+            self.failed,
+            self.running,
+            self.pending,
+        )
+
+
+class LoginOrchestrator:
+    '''
+    多账号登录调度。
+    同时登录的账号数不超过max_concurrency，排队的账号按优先级登录；
+    同一区服的图鉴通过library_registry共用，只下载一次，
+    每个账号的用户信息和仓库在共用的线程池里并行获取
+
+    Args:
+        root_dir: 助手根目录，用户数据放在root_dir/data/user下
+        max_concurrency: 同时登录的最大账号数
+        on_progress: 每个账号开始或结束登录时调用on_progress(progress)
+        max_info_capacity: 每个账号IOLogger保留的最大信息条数
+    '''
+
+    def __init__(
+        self, root_dir, max_concurrency=4, on_progress=None, max_info_capacity=500
+    ):
+        self.root_dir = root_dir
+        self.max_concurrency = max_concurrency
+        self.on_progress = on_progress
+        self.max_info_capacity = max_info_capacity
+        self._lock = threading.Lock()
+        self._queue: list[tuple[int, int, LoginTask]] = []
+        self._counter = itertools.count()
+        self._worker_num = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency * 2, thread_name_prefix="login"
+        )
+        self.progress = LoginProgress()
+
+    def submit(self, cfg: Config, callback, *args, priority=0) -> LoginTask:
+        task = LoginTask(cfg, callback, args, priority)
+        with self._lock:
+            heapq.heappush(self._queue, (-priority, next(self._counter), task))
+            self.progress.total += 1
+            start_worker = self._worker_num < self.max_concurrency
+            if start_worker:
+                self._worker_num += 1
+        if start_worker:
+            threading.Thread(target=self._worker, daemon=True).start()
+        return task
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if len(self._queue) == 0:
+                    self._worker_num -= 1
+                    if self._worker_num == 0:
+                        # 这一批账号全部登录结束
+                        self._log_summary()
+                        self.progress = LoginProgress()
+                    return
+                _, _, task = heapq.heappop(self._queue)
+                self.progress.running += 1
+            self._notify_progress()
+            task.timing.wait = perf_counter() - task.submit_time
+            try:
+                self.login(task)
+            except Exception as e:
+                task.error = e
+                logging.error(
+                    "{}登录失败，异常类型：{}，异常信息：{}".format(
+                        task.user_info, type(e).__name__, str(e)
+                    )
+                )
+            task.timing.total = perf_counter() - task.submit_time
+            with self._lock:
+                self.progress.running -= 1
+                if task.error is None:
+                    self.progress.success += 1
+                    for phase in LoginTiming.phase_list + ("total",):
+                        setattr(
+                            self.progress.timing_sum,
+                            phase,
+                            getattr(self.progress.timing_sum, phase)
+                            + getattr(task.timing, phase),
+                        )
+                else:
+                    self.progress.failed += 1
+            self._notify_progress()
+            if task.error is None:
+                logging.info("{}登录完成：{}".format(task.user_info, task.timing))
+                try:
+                    task.callback(task)
+                except Exception as e:
+                    logging.error(
+                        "{}登录后处理失败，异常类型：{}".format(
+                            task.user_info, type(e).__name__
+                        )
+                    )
+            task.done.set()
+
+    def _notify_progress(self):
+        if self.on_progress is not None:
+            self.on_progress(self.progress)
+
+    def _log_summary(self):
+        # 调用时已持有锁
+        logging.info(
+            "{}。平均耗时：{}".format(self.progress, self.progress.average_timing())
+        )
+
+    @staticmethod
+    def _timed(timing: LoginTiming, phase, func, *args):
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            setattr(timing, phase, perf_counter() - start)
+
+    def login(self, task: LoginTask):
+        cfg = task.cfg
+        data_dir = os.path.join(
+            self.root_dir,
+            f"data/user/{cfg.username}/{cfg.region}/{cfg.host}",
+        )
+        os.makedirs(data_dir, exist_ok=True)
+        cache_dir = os.path.join(data_dir, "cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        log_dir = os.path.join(data_dir, "log")
+        os.makedirs(log_dir, exist_ok=True)
+        setting_dir = os.path.join(data_dir, "usersettings")
+        os.makedirs(setting_dir, exist_ok=True)
+
+        timing = task.timing
+        user_future = self._executor.submit(self._timed, timing, "user", User, cfg)
+        repo_future = self._executor.submit(
+            self._timed, timing, "repository", Repository, cfg
+        )
+        try:
+            lib: Library = self._timed(
+                timing, "library", library_registry.acquire, cfg
+            )
+        finally:
+            concurrent.futures.wait([user_future, repo_future])
+        try:
+            user: User = user_future.result()
+            repo: Repository = repo_future.result()
+        except Exception:
+            library_registry.release(lib)
+            raise
+
+        logger = IOLogger(log_dir, max_info_capacity=self.max_info_capacity)
+        start = perf_counter()
+        try:
+            usersettings = UserSettings(
+                cfg,
+                repo,
+                lib,
+                user,
+                logger,
+                setting_dir,
+            )
+            usersettings.load()
+        except Exception:
+            logger.close()
+            library_registry.release(lib)
+            raise
+        timing.settings = perf_counter() - start
+
+        task.usersettings = usersettings
+        task.cache_dir = cache_dir
+        return usersettings
@@ -13,12 +13,14 @@ from ... import (
     Library,
     SynthesisMan,
     WebRequest,
+    AsyncWebRequest,
 )
 from ..message import Logger
 from ... import WorldFubenRequest, Serverbattle, Arena, Command, Shop
 from ...fuben import FubenCave
 from ...utils.recover import RecoverMan
 from ...utils.common import signal_block_emit
+from ...async_web import submit_coroutine
 from ...library import attribute2plant_attribute
 from . import load_data, save_data
 from ...utils.common import format_number
@@ -155,12 +157,8 @@ class AutoSynthesisMan:
             deputy_plant.speed += int(body['speed'])
             self.repo.remove_plant(self.main_plant_id)
             self.main_plant_id = deputy_plant_id
-            reinforce['amount'] = max(reinforce['amount'] - self.reinforce_number, 0)
-            if reinforce['amount'] == 0:
-                self.repo.remove_tool(reinforce['id'])
-            book['amount'] = max(book['amount'] - 1, 0)
-            if book['amount'] == 0:
-                self.repo.remove_tool(book['id'])
+            self.repo.remove_tool(reinforce['id'], self.reinforce_number)
+            self.repo.remove_tool(book['id'], 1)
         return result
 
     def synthesis_all(
@@ -525,7 +523,9 @@ class FubenMan:
                 futures = []
                 need_exit = False
                 with concurrent.futures.ThreadPoolExecutor(
-                    max_workers=self.pool_size
+                    max_workers=self.cfg.congestion_window(
+                        "api.fuben.challenge", self.pool_size
+                    )
                 ) as executor:
                     for _ in range(challenge_count):
                         futures.append(executor.submit(run))
@@ -629,6 +629,7 @@ class TerritoryMan:
         self.repo = repo
         self.logger = logger
         self.wr = WebRequest(cfg)
+        self.awr = AsyncWebRequest(cfg)
         self.difficulty_choice = 3
         self.team = []
         self.smart_enabled = False
@@ -804,12 +805,27 @@ class TerritoryMan:
         )
         return response
 
+    async def challenge_async(self, difficulty_choice=None):
+        if difficulty_choice is None:
+            difficulty_choice = self.difficulty_choice
+        body = [float(2000 + difficulty_choice), [], float(1), float(0)]
+        response = await self.awr.amf_post_retry(
+            body,
+            "api.territory.challenge",
+            "/pvz/amf/",
+            "挑战领地",
+            logger=self.logger,
+            except_retry=True,
+        )
+        return response
+
     def auto_challenge_concurrent(
         self, territory_user: TerritoryUser, stop_channel: Queue
     ):
-        def run():
+        # 并发的挑战在后台事件循环中以协程运行，不再为每个在途请求占用一个线程
+        async def run():
             message = f"挑战领地难度{self.difficulty_choice}"
-            response = self.challenge()
+            response = await self.challenge_async()
             if response.status == 1:
                 message = message + "失败. 原因: {}.".format(response.body.description)
                 if "匹配对手中" in response.body.description:
@@ -841,7 +857,7 @@ class TerritoryMan:
                 future_list.pop(index)
                 return result
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+        try:
             while stop_channel.qsize() == 0:
                 if self.territory_mutex_enabled:
                     if not self.acquire_permission_retry(territory_user, stop_channel):
@@ -862,19 +878,25 @@ class TerritoryMan:
                                     self.release(territory_user)
                                     return False
                             break
-                    while len(future_list) >= pool_size:
+                    # 在途请求数跟随限流器的拥塞窗口，被限流时自动收缩
+                    while len(future_list) >= self.cfg.congestion_window(
+                        "api.territory.challenge", pool_size
+                    ):
                         result = pop_future()
                         if not result:
                             if self.territory_mutex_enabled:
                                 self.release(territory_user)
                             return False
-                    future_list.append(executor.submit(run))
+                    future_list.append(submit_coroutine(run()))
                 if stop_channel.qsize() > 0:
                     if self.territory_mutex_enabled:
                         self.release(territory_user)
                     return False
                 if not self.territory_mutex_enabled:
                     break
+        finally:
+            # 和原来退出线程池时一样，等在途的挑战结束再返回
+            concurrent.futures.wait(future_list)
         if self.territory_mutex_enabled:
             self.release(territory_user)
         if stop_channel.qsize() > 0:
@@ -1,4 +1,5 @@
 import pickle
+import inspect
 import concurrent.futures
 from queue import Queue
 import os
@@ -9,12 +10,14 @@ from ... import (
     Repository,
     Library,
     WebRequest,
+    AsyncWebRequest,
 )
 from ..message import Logger
 from ...shop import Shop
 from ...fuben import FubenCave
 from ...utils.recover import RecoverMan
 from ...utils.common import signal_block_emit
+from ...async_web import submit_gather
 
 
 class OpenFubenMan:
@@ -26,6 +29,7 @@ class OpenFubenMan:
         self.team = []
         self.ignored_cave_list = []
         self.wr = WebRequest(cfg)
+        self.awr = AsyncWebRequest(cfg)
         self.shop_req = Shop(cfg)
         self.recover_man = RecoverMan(cfg)
         self.fuben_layer_info_list: list[list[FubenCave]] = [None for _ in range(5)]
@@ -125,13 +129,7 @@ class OpenFubenMan:
                     )
                     return False
                 assert buy_result['tool_id'] == good.p_id
-                if repo_tool is None:
-                    self.repo.add_tool(
-                        good.p_id,
-                        0,
-                    )
-                    repo_tool = self.repo.get_tool(good.p_id)
-                repo_tool['amount'] = buy_result['amount']
+                self.repo.set_tool_amount(good.p_id, buy_result['amount'])
                 continue
 
             source_cave = None
@@ -157,7 +155,7 @@ class OpenFubenMan:
                         source_cave, max(need_amount, self.min_challenge_amount)
                     ):
                         return False
-                    self.repo.refresh_repository()
+                    self.repo.refresh_repository(max_age=self.repo.check_max_age)
                     repo_tool = self.repo.get_tool(open_tool['id'])
                 continue
             return False
@@ -192,7 +190,7 @@ class OpenFubenMan:
                         target_cave.name, e
                     )
                 )
-                self.repo.refresh_repository()
+                self.repo.refresh_repository(max_age=self.repo.check_max_age)
                 now_amount = self.repo.get_tool(self.watch_id, return_amount=True)
                 if now_amount != watch_amount:
                     self.logger.log("仓库怀表量发生变化，判定使用怀表成功")
@@ -251,7 +249,7 @@ class OpenFubenMan:
                             use_amount, type(e).__name__
                         )
                     )
-                    self.repo.refresh_repository()
+                    self.repo.refresh_repository(max_age=self.repo.check_max_age)
                     if (
                         self.repo.get_tool(self.fuben_book_id, return_amount=True)
                         != repo_tool['amount']
@@ -281,12 +279,12 @@ class OpenFubenMan:
                 return False
             self.add_cave_rest_count(target_cave, use_amount)
 
-        def run():
+        async def run():
             body = [
                 float(target_cave.cave_id),
                 [int(plant_id) for plant_id in self.team],
             ]
-            response = self.wr.amf_post_retry(
+            response = await self.awr.amf_post_retry(
                 body,
                 "api.fuben.challenge",
                 '/pvz/amf/',
@@ -340,12 +338,20 @@ class OpenFubenMan:
         return True
 
     def _async_request(self, func_list, return_future=False):
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=min(self.max_pool_size, len(func_list))
-        ) as executor:
-            futures = []
-            for func in func_list:
-                futures.append(executor.submit(func))
+        # 都是协程函数时在后台事件循环中运行，不为每个请求占用一个线程
+        max_workers = min(self.max_pool_size, len(func_list))
+        if all(inspect.iscoroutinefunction(func) for func in func_list):
+            futures = submit_gather(
+                [func() for func in func_list], max_concurrency=max_workers
+            )
+            concurrent.futures.wait(futures)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers
+            ) as executor:
+                futures = []
+                for func in func_list:
+                    futures.append(executor.submit(func))
         if not return_future:
             for future in futures:
                 try:
@@ -457,7 +463,9 @@ class OpenFubenMan:
                                     cave.name
                                 )
                             )
-                            self.repo.refresh_repository()
+                            self.repo.refresh_repository(
+                                max_age=self.repo.check_max_age
+                            )
                         break
                     except Exception as e:
                         cnt += 1
@@ -496,7 +504,7 @@ class OpenFubenMan:
                     )
                 self.logger.log("。".join(msg_list))
             self.refresh_fuben_info()
-            self.repo.refresh_repository()
+            self.repo.refresh_repository(max_age=self.repo.check_max_age)
             if not challenged and len(skip_fuben_list) == 0:
                 self.logger.log(
                     "没有挑战或跳过任何副本，视为世界副本开图完毕。退出世界副本自动开图"
@@ -97,7 +97,7 @@ class UserSettings:
         self.open_stone_fuben_recover_threshold = 0.1
 
     def _start(self, stop_channel: Queue, close_signal, finish_signal):
-        self.repo.refresh_repository(self.logger)
+        self.repo.refresh_repository(self.logger, max_age=self.repo.check_max_age)
         while stop_channel.qsize() == 0:
             need_continue = False
             enter_time = perf_counter()
@@ -131,14 +131,19 @@ class UserSettings:
             if self.task_enabled:
                 try:
                     self.task.refresh_task()
+                    claim_task_list = []
                     for i, enable in enumerate(self.enable_list):
                         if not enable:
                             continue
                         tasks = self.task.task_list[i]
                         for task in tasks:
                             if task.state == 1:
-                                result = self.task.claim_reward(task, self.lib)
-                                self.logger.log(result['result'])
+                                claim_task_list.append(task)
+                    if len(claim_task_list) > 0:
+                        for result in self.task.claim_reward_batch(
+                            claim_task_list, self.lib
+                        ):
+                            self.logger.log(result['result'])
                 except Exception as e:
                     self.logger.log(
                         f"领取任务奖励失败，异常种类:{type(e).__name__}。跳过领取任务奖励"
@@ -274,6 +279,10 @@ class UserSettings:
                     "task_enabled": self.task_enabled,
                     "timeout": self.cfg.timeout,
                     "millsecond_delay": self.cfg.millsecond_delay,
+                    "pool_size": self.cfg.pool_size,
+                    "burst": self.cfg.burst,
+                    "congestion_control": self.cfg.congestion_control,
+                    "cache_ttl": self.cfg.cache_ttl,
                     "serverbattle_enabled": self.serverbattle_enabled,
                     "record_repository_tool_dict": self.record_repository_tool_dict,
                     "record_ignore_tool_id_set": self.record_ignore_tool_id_set,
@@ -371,6 +380,14 @@ class UserSettings:
                 self.cfg.timeout = d["timeout"]
             if "millsecond_delay" in d:
                 self.cfg.millsecond_delay = d["millsecond_delay"]
+            if "pool_size" in d:
+                self.cfg.pool_size = d["pool_size"]
+            if "burst" in d:
+                self.cfg.burst = d["burst"]
+            if "congestion_control" in d:
+                self.cfg.congestion_control = d["congestion_control"]
+            if "cache_ttl" in d:
+                self.cfg.cache_ttl = d["cache_ttl"]
         self.challenge4Level.load(self.save_dir)
         self.plant_evolution.load(self.save_dir)
         self.auto_synthesis_man.load(self.save_dir)
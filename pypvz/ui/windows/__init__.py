@@ -1,18 +1,68 @@
-from .evolution import EvolutionPanelThread, EvolutionPanelWindow, EvolutionPathSetting
-from .quality import UpgradeQualityWindow, UpgradeQualityThread
-from .synthesis import AutoSynthesisWindow, SynthesisThread
-from .compound import AutoCompoundWindow
-from .record import RepositoryRecordWindow
-from .fuben import FubenSettingWindow
-from .garden import GardenChallengeSettingWindow
-from .territory import TerritorySettingWindow
-from .auto_pipeline import PipelineSettingWindow
-from .shop import ShopAutoBuySetting
-from .auto_challenge import Challenge4levelSettingWindow
-from .daily import DailySettingWindow
-from .simulate import SimulateWindow
-from .repository import AutoUseItemSettingWindow
-from .command import CommandSettingWindow
-from .open_fuben import OpenFubenWindow
-from .plant_relative import PlantRelativeWindow
-# from .flash_web import GameWindow, run_game_window
\ No newline at end of file
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+# 窗口在第一次用到时才导入，登录窗口启动时不需要加载所有功能窗口
+_lazy_attr_module = {
+    "EvolutionPanelThread": ".evolution",
+    "EvolutionPanelWindow": ".evolution",
+    "EvolutionPathSetting": ".evolution",
+    "UpgradeQualityWindow": ".quality",
+    "UpgradeQualityThread": ".quality",
+    "AutoSynthesisWindow": ".synthesis",
+    "SynthesisThread": ".synthesis",
+    "AutoCompoundWindow": ".compound",
+    "RepositoryRecordWindow": ".record",
+    "FubenSettingWindow": ".fuben",
+    "GardenChallengeSettingWindow": ".garden",
+    "TerritorySettingWindow": ".territory",
+    "PipelineSettingWindow": ".auto_pipeline",
+    "ShopAutoBuySetting": ".shop",
+    "Challenge4levelSettingWindow": ".auto_challenge",
+    "DailySettingWindow": ".daily",
+    "SimulateWindow": ".simulate",
+    "AutoUseItemSettingWindow": ".repository",
+    "CommandSettingWindow": ".command",
+    "OpenFubenWindow": ".open_fuben",
+    "PlantRelativeWindow": ".plant_relative",
+    "HeritageWindow": ".common",
+    "RequestStatsWindow": ".request_stats",
+}
+
+__all__ = list(_lazy_attr_module.keys())
+
+
+def __getattr__(name):
+    module_name = _lazy_attr_module.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
+
+
+# 不会执行，供IDE补全和pyinstaller分析依赖
+if TYPE_CHECKING:
+    from .evolution import EvolutionPanelThread, EvolutionPanelWindow, EvolutionPathSetting
+    from .quality import UpgradeQualityWindow, UpgradeQualityThread
+    from .synthesis import AutoSynthesisWindow, SynthesisThread
+    from .compound import AutoCompoundWindow
+    from .record import RepositoryRecordWindow
+    from .fuben import FubenSettingWindow
+    from .garden import GardenChallengeSettingWindow
+    from .territory import TerritorySettingWindow
+    from .auto_pipeline import PipelineSettingWindow
+    from .shop import ShopAutoBuySetting
+    from .auto_challenge import Challenge4levelSettingWindow
+    from .daily import DailySettingWindow
+    from .simulate import SimulateWindow
+    from .repository import AutoUseItemSettingWindow
+    from .command import CommandSettingWindow
+    from .open_fuben import OpenFubenWindow
+    from .plant_relative import PlantRelativeWindow
+    from .common import HeritageWindow
+    from .request_stats import RequestStatsWindow
+    # from .flash_web import GameWindow, run_game_window
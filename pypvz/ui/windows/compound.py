@@ -31,6 +31,7 @@ class AutoCompoundWindow(QMainWindow):
     compound_finish_signal = pyqtSignal()
     refresh_all_signal = pyqtSignal(Event)
     compound_stoped_signal = pyqtSignal()
+    optimize_scheme_finish_signal = pyqtSignal(list)
 
     def __init__(
         self,
@@ -54,6 +55,7 @@ class AutoCompoundWindow(QMainWindow):
         self.refresh_all_signal.connect(self.refresh_all)
         self.compound_finish_signal.connect(self.compound_finish)
         self.compound_stoped_signal.connect(self.compound_stoped)
+        self.optimize_scheme_finish_signal.connect(self.optimize_scheme_finish)
         self.chosen_attribute = "HP特"
         self.scheme_widget = CompoundSchemeWidget(
             self.repo,
@@ -221,6 +223,9 @@ class AutoCompoundWindow(QMainWindow):
         parameter_recommend_btn = QPushButton("参数推荐")
         parameter_recommend_btn.clicked.connect(self.parameter_recommend_btn_clicked)
         widget6_layout.addWidget(parameter_recommend_btn)
+        self.optimize_scheme_btn = QPushButton("优化方案参数")
+        self.optimize_scheme_btn.clicked.connect(self.optimize_scheme_btn_clicked)
+        widget6_layout.addWidget(self.optimize_scheme_btn)
 
         widget6_layout.addWidget(QLabel("以下是部分合成信息"))
         self.information_text_box = QPlainTextEdit()
@@ -241,6 +246,32 @@ class AutoCompoundWindow(QMainWindow):
     def parameter_recommend_btn_clicked(self):
         ImageWindow("data/image/参数推荐.png", self).show()
 
+    def optimize_scheme_btn_clicked(self):
+        self.optimize_scheme_btn.setDisabled(True)
+        OptimizeSchemeThread(
+            self.auto_compound_man, self.optimize_scheme_finish_signal
+        ).start()
+
+    def optimize_scheme_finish(self, plan_list):
+        try:
+            if len(plan_list) == 0:
+                return
+            msg = "\n".join(
+                '方案"{}"：{}'.format(scheme.name, plan) for scheme, plan in plan_list
+            )
+            if not require_permission(
+                "优化结果如下，确认后修改方案的k、n1、n2、m(后续品质不变)：\n" + msg
+            ):
+                self.logger.log("未使用优化参数")
+                return
+            self.auto_compound_man.apply_scheme_plan_list(plan_list)
+            # 重建方案面板，让k、n1、n2、m的选择框显示优化后的值
+            self.scheme_widget.switch_scheme(self.scheme_widget.scheme)
+            self.refresh_scheme_list()
+            self.refresh_all()
+        finally:
+            self.optimize_scheme_btn.setEnabled(True)
+
     def set_chosen_attribute(self, chosen_attribute):
         self.chosen_attribute = chosen_attribute
 
@@ -722,6 +753,20 @@ class CompoundThread(Thread):
             self.rest_event.set()
 
 
+class OptimizeSchemeThread(Thread):
+    def __init__(self, auto_compound_man: AutoCompoundMan, finish_signal):
+        super().__init__()
+        self.auto_compound_man = auto_compound_man
+        self.finish_signal = finish_signal
+
+    def run(self):
+        plan_list = []
+        try:
+            plan_list = self.auto_compound_man.optimize_scheme_list()
+        finally:
+            self.finish_signal.emit(plan_list)
+
+
 class CompoundSchemeWidget(QWidget):
     def __init__(
         self,
@@ -0,0 +1,193 @@
+import os
+
+from PyQt6.QtWidgets import (
+    QMainWindow,
+    QWidget,
+    QVBoxLayout,
+    QHBoxLayout,
+    QPushButton,
+    QPlainTextEdit,
+    QCheckBox,
+    QFileDialog,
+)
+from PyQt6 import QtGui
+from PyQt6.QtCore import Qt, QTimer
+
+from ..wrapped import QLabel
+from ...utils.trace import request_tracer
+
+
+def _format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1:
+        return "{:.0f}ms".format(value * 1000)
+    return "{:.2f}s".format(value)
+
+
+def _format_bytes(value):
+    for unit in ("B", "KB", "MB"):
+        if value < 1024:
+            return "{:.0f}{}".format(value, unit)
+        value /= 1024
+    return "{:.1f}GB".format(value)
+
+
+class RequestStatsWindow(QMainWindow):
+    '''
+    按endpoint显示所有账号请求的耗时分布，按总耗时排序，用来找出占用时间最多的请求
+    '''
+
+    refresh_interval = 2000
+    recent_num = 50
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.init_ui()
+        self.refresh()
+
+    def init_ui(self):
+        self.setWindowTitle("请求统计面板")
+
+        screen_size = QtGui.QGuiApplication.primaryScreen().size()
+        self.resize(int(screen_size.width() * 0.7), int(screen_size.height() * 0.7))
+        self.move(int(screen_size.width() * 0.15), int(screen_size.height() * 0.15))
+
+        main_widget = QWidget()
+        main_layout = QVBoxLayout()
+        main_widget.setLayout(main_layout)
+        self.setCentralWidget(main_widget)
+
+        layout = QHBoxLayout()
+        self.enabled_checkbox = QCheckBox("记录请求")
+        self.enabled_checkbox.setChecked(request_tracer.enabled)
+        self.enabled_checkbox.stateChanged.connect(self.enabled_checkbox_changed)
+        layout.addWidget(self.enabled_checkbox)
+        self.auto_refresh_checkbox = QCheckBox("自动刷新")
+        self.auto_refresh_checkbox.stateChanged.connect(
+            self.auto_refresh_checkbox_changed
+        )
+        layout.addWidget(self.auto_refresh_checkbox)
+        refresh_btn = QPushButton("刷新")
+        refresh_btn.clicked.connect(self.refresh)
+        layout.addWidget(refresh_btn)
+        reset_btn = QPushButton("清空统计")
+        reset_btn.clicked.connect(self.reset_btn_clicked)
+        layout.addWidget(reset_btn)
+        export_json_btn = QPushButton("导出JSON")
+        export_json_btn.clicked.connect(lambda: self.export("json"))
+        layout.addWidget(export_json_btn)
+        export_prometheus_btn = QPushButton("导出Prometheus")
+        export_prometheus_btn.clicked.connect(lambda: self.export("prom"))
+        layout.addWidget(export_prometheus_btn)
+        layout.addStretch(1)
+        main_layout.addLayout(layout)
+
+        self.summary_label = QLabel()
+        main_layout.addWidget(self.summary_label)
+
+        font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.SystemFont.FixedFont)
+        main_layout.addWidget(QLabel("各请求耗时(按总耗时排序)"))
+        self.endpoint_textbox = QPlainTextEdit()
+        self.endpoint_textbox.setReadOnly(True)
+        self.endpoint_textbox.setFont(font)
+        self.endpoint_textbox.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.endpoint_textbox.setTextInteractionFlags(
+            Qt.TextInteractionFlag.TextSelectableByMouse
+        )
+        main_layout.addWidget(self.endpoint_textbox, 3)
+
+        main_layout.addWidget(QLabel("最近{}条请求".format(self.recent_num)))
+        self.recent_textbox = QPlainTextEdit()
+        self.recent_textbox.setReadOnly(True)
+        self.recent_textbox.setFont(font)
+        self.recent_textbox.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.recent_textbox.setTextInteractionFlags(
+            Qt.TextInteractionFlag.TextSelectableByMouse
+        )
+        main_layout.addWidget(self.recent_textbox, 2)
+
+    def refresh(self):
+        stats_list = request_tracer.endpoint_stats()
+        total_time = sum(stats["total_time"]["sum"] for _, stats in stats_list)
+        total_count = sum(stats["count"] for _, stats in stats_list)
+        self.summary_label.setText(
+            "共{}次请求，累计耗时{}".format(total_count, _format_seconds(total_time))
+        )
+        line_list = [
+            "{:<40} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9} {:>7} {:>6} {:>6} {:>9} {:>9}".format(
+                "请求",
+                "次数",
+                "占比",
+                "p50",
+                "p90",
+                "p99",
+                "最长",
+                "网络p50",
+                "排队",
+                "重试",
+                "失败",
+                "发送",
+                "接收",
+            )
+        ]
+        for endpoint, stats in stats_list:
+            total, network = stats["total_time"], stats["network_time"]
+            line_list.append(
+                "{:<40} {:>7} {:>5.1f}% {:>8} {:>8} {:>8} {:>8} {:>9} {:>7} {:>6} {:>6} {:>9} {:>9}".format(
+                    endpoint,
+                    stats["count"],
+                    total["sum"] / total_time * 100 if total_time > 0 else 0,
+                    _format_seconds(total["p50"]),
+                    _format_seconds(total["p90"]),
+                    _format_seconds(total["p99"]),
+                    _format_seconds(total["max"]),
+                    _format_seconds(network["p50"]),
+                    _format_seconds(stats["queue_time"]),
+                    stats["retry_count"],
+                    stats["count"] - stats["outcome_count"].get("ok", 0),
+                    _format_bytes(stats["bytes_out"]),
+                    _format_bytes(stats["bytes_in"]),
+                )
+            )
+        self.endpoint_textbox.setPlainText("\n".join(line_list))
+        recent = request_tracer.recent_traces(self.recent_num)
+        self.recent_textbox.setPlainText(
+            "\n".join(str(trace) for trace in reversed(recent))
+        )
+
+    def enabled_checkbox_changed(self):
+        request_tracer.enabled = self.enabled_checkbox.isChecked()
+
+    def auto_refresh_checkbox_changed(self):
+        if self.auto_refresh_checkbox.isChecked():
+            self.timer.start(self.refresh_interval)
+        else:
+            self.timer.stop()
+
+    def reset_btn_clicked(self):
+        request_tracer.reset()
+        self.refresh()
+
+    def export(self, file_type):
+        if file_type == "json":
+            file_filter = "JSON (*.json)"
+            default_name = "request_stats.json"
+        else:
+            file_filter = "Prometheus (*.prom)"
+            default_name = "request_stats.prom"
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "导出请求统计",
+            os.path.join(os.path.expanduser("~"), "Desktop", default_name),
+            file_filter,
+        )
+        if file_path is None or len(file_path) == 0:
+            return
+        request_tracer.export(file_path)
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        return super().closeEvent(event)
@@ -1,3 +1,6 @@
+import math
+from threading import Thread
+
 from PyQt6.QtWidgets import (
     QMainWindow,
     QWidget,
@@ -7,18 +10,118 @@ from PyQt6.QtWidgets import (
     QTabWidget,
     QComboBox,
     QPlainTextEdit,
+    QCheckBox,
 )
 from PyQt6 import QtGui
-from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QPainter, QPen, QColor
+from PyQt6.QtCore import Qt, QPointF, pyqtSignal
 
 from ..wrapped import QLabel
-from ...utils.calc import simulate_imprisonment
+from ...utils.calc import (
+    simulate_imprisonment,
+    simulate_imprisonment_grid,
+    monte_carlo_imprisonment,
+    monte_carlo_trial_num,
+)
+
+
+class CurvePlotWidget(QWidget):
+    '''
+    对数纵轴的折线图，每条曲线是(x, y)点列，y必须大于0
+    '''
+
+    margin = 50
+
+    def __init__(self, x_label="", y_label="", parent=None):
+        super().__init__(parent=parent)
+        self.x_label = x_label
+        self.y_label = y_label
+        self.curve_list: list[tuple[str, list, list]] = []
+        self.highlight_index = None
+        self.highlight_point = None
+        self.setMinimumSize(400, 300)
+
+    def set_curves(self, curve_list, highlight_index=None, highlight_point=None):
+        '''
+        Args:
+            curve_list: [(名称, x列表, y列表), ...]
+            highlight_index: 需要加粗显示的曲线下标
+            highlight_point: 需要标出的点(x, y)
+        '''
+        self.curve_list = curve_list
+        self.highlight_index = highlight_index
+        self.highlight_point = highlight_point
+        self.update()
+
+    def paintEvent(self, event):
+        if len(self.curve_list) == 0:
+            return
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        x_min = min(min(x_list) for _, x_list, _ in self.curve_list)
+        x_max = max(max(x_list) for _, x_list, _ in self.curve_list)
+        y_min = math.floor(
+            math.log10(min(min(y_list) for _, _, y_list in self.curve_list))
+        )
+        y_max = math.ceil(
+            math.log10(max(max(y_list) for _, _, y_list in self.curve_list))
+        )
+        y_max = max(y_max, y_min + 1)
+        left, top = self.margin, self.margin // 2
+        width = self.width() - self.margin * 2
+        height = self.height() - self.margin - top
+
+        def to_point(x, y):
+            return QPointF(
+                left + (x - x_min) / max(x_max - x_min, 1) * width,
+                top + (y_max - math.log10(y)) / (y_max - y_min) * height,
+            )
+
+        painter.setPen(QPen(QColor(200, 200, 200), 1))
+        for exp in range(y_min, y_max + 1):
+            point = to_point(x_min, 10**exp)
+            painter.drawLine(point, QPointF(left + width, point.y()))
+            painter.drawText(QPointF(4, point.y() + 4), str(10**exp))
+        for x in range(int(x_min), int(x_max) + 1):
+            point = to_point(x, 10**y_min)
+            painter.drawText(QPointF(point.x() - 4, point.y() + 16), str(x))
+        painter.setPen(QPen(QColor(0, 0, 0), 1))
+        painter.drawRect(left, top, width, height)
+        painter.drawText(QPointF(left + width / 2, self.height() - 6), self.x_label)
+        painter.drawText(QPointF(left, top - 6), self.y_label)
+
+        for i, (name, x_list, y_list) in enumerate(self.curve_list):
+            color = QColor.fromHsv(int(240 * i / len(self.curve_list)), 200, 200)
+            highlight = i == self.highlight_index
+            painter.setPen(QPen(color, 3 if highlight else 1))
+            point_list = [to_point(x, y) for x, y in zip(x_list, y_list)]
+            for start, end in zip(point_list[:-1], point_list[1:]):
+                painter.drawLine(start, end)
+            if highlight or len(self.curve_list) <= 8:
+                painter.drawText(point_list[-1] + QPointF(4, 4), name)
+        if self.highlight_point is not None:
+            painter.setPen(QPen(QColor(0, 0, 0), 2))
+            painter.drawEllipse(to_point(*self.highlight_point), 4, 4)
+        painter.end()
 
 
 class SimulateWindow(QMainWindow):
+    monte_carlo_finish_signal = pyqtSignal(str)
+    max_book_num = 15
+    max_riguang_level = 15
+    monte_carlo_trial_num = 100000
+    monte_carlo_seed = 0
+
     def __init__(self, parent=None):
         super().__init__(parent=parent)
+        self.monte_carlo_finish_signal.connect(self.monte_carlo_finish)
+        # 所有禁锢数量和日光等级的结果一次算好，切换选项时直接画图
+        riguang_level_list = list(range(self.max_riguang_level + 1))
+        self.imprisonment_grid = simulate_imprisonment_grid(
+            self.max_book_num, riguang_level_list
+        )
         self.init_ui()
+        self.refresh_imprisonment_plot()
 
     def init_ui(self):
         self.setWindowTitle("模拟面板")
@@ -30,29 +133,45 @@ class SimulateWindow(QMainWindow):
         main_tab_widget = QTabWidget()
         self.setCentralWidget(main_tab_widget)
 
+        imprisonment_tab = QWidget()
+        imprisonment_tab_layout = QHBoxLayout()
+        imprisonment_tab.setLayout(imprisonment_tab_layout)
+        main_tab_widget.addTab(imprisonment_tab, "禁锢模拟")
+
         self.simulate_imprisonment_widget = QWidget()
         self.simulate_imprisonment_widget.setFixedWidth(int(self.width() * 0.3))
-        self.simulate_imprisonment_widget.setFixedHeight(int(self.height() * 0.3))
         self.simulate_imprisonment_layout = QVBoxLayout()
         self.simulate_imprisonment_widget.setLayout(self.simulate_imprisonment_layout)
-        main_tab_widget.addTab(self.simulate_imprisonment_widget, "禁锢模拟")
+        imprisonment_tab_layout.addWidget(self.simulate_imprisonment_widget)
         layout = QHBoxLayout()
         layout.addWidget(QLabel("满级禁锢数量:"))
         self.simulate_imprisonment_book_choice = QComboBox()
-        self.simulate_imprisonment_book_choice.addItems([str(i) for i in range(0, 16)])
+        self.simulate_imprisonment_book_choice.addItems(
+            [str(i) for i in range(0, self.max_book_num + 1)]
+        )
         self.simulate_imprisonment_book_choice.setCurrentIndex(0)
+        self.simulate_imprisonment_book_choice.currentIndexChanged.connect(
+            self.refresh_imprisonment_plot
+        )
         layout.addWidget(self.simulate_imprisonment_book_choice)
         layout.addWidget(QLabel("炮灰日光等级:"))
         self.simulate_imprisonment_riguang_choice = QComboBox()
         self.simulate_imprisonment_riguang_choice.addItems(
-            [str(i) for i in range(0, 16)]
+            [str(i) for i in range(0, self.max_riguang_level + 1)]
         )
         self.simulate_imprisonment_riguang_choice.setCurrentIndex(0)
+        self.simulate_imprisonment_riguang_choice.currentIndexChanged.connect(
+            self.refresh_imprisonment_plot
+        )
         layout.addWidget(self.simulate_imprisonment_riguang_choice)
         self.simulate_imprisonment_layout.addLayout(layout)
-        start_simulate_btn = QPushButton("开始模拟")
-        start_simulate_btn.clicked.connect(self.start_simulate_imprisonment)
-        self.simulate_imprisonment_layout.addWidget(start_simulate_btn)
+        self.monte_carlo_checkbox = QCheckBox(
+            "蒙特卡洛校验({}次)".format(self.monte_carlo_trial_num)
+        )
+        self.simulate_imprisonment_layout.addWidget(self.monte_carlo_checkbox)
+        self.start_simulate_btn = QPushButton("开始模拟")
+        self.start_simulate_btn.clicked.connect(self.start_simulate_imprisonment)
+        self.simulate_imprisonment_layout.addWidget(self.start_simulate_btn)
         self.simulate_imprisonment_layout.addWidget(QLabel("模拟结果"))
         self.simulate_imprisonment_result_textbox = QPlainTextEdit()
         self.simulate_imprisonment_result_textbox.setReadOnly(True)
@@ -64,6 +183,27 @@ class SimulateWindow(QMainWindow):
             self.simulate_imprisonment_result_textbox
         )
 
+        self.imprisonment_plot = CurvePlotWidget("满级禁锢数量", "平均回合数")
+        imprisonment_tab_layout.addWidget(self.imprisonment_plot)
+
+    def refresh_imprisonment_plot(self):
+        n = int(self.simulate_imprisonment_book_choice.currentText())
+        riguang_level = int(self.simulate_imprisonment_riguang_choice.currentText())
+        book_num_list = list(range(self.max_book_num + 1))
+        curve_list = [
+            (
+                "日光{}".format(level),
+                book_num_list,
+                [float(self.imprisonment_grid[i][level]) for i in book_num_list],
+            )
+            for level in range(self.max_riguang_level + 1)
+        ]
+        self.imprisonment_plot.set_curves(
+            curve_list,
+            highlight_index=riguang_level,
+            highlight_point=(n, float(self.imprisonment_grid[n][riguang_level])),
+        )
+
     def start_simulate_imprisonment(self):
         n = int(self.simulate_imprisonment_book_choice.currentText())
         riguang_level = int(self.simulate_imprisonment_riguang_choice.currentText())
@@ -72,3 +212,45 @@ class SimulateWindow(QMainWindow):
         self.simulate_imprisonment_result_textbox.appendPlainText(
             f"前提：金龙攻击能够一刀死，场上有n个植物有满级禁锢\n1回合=5箱子\n平均回合数: {int(result)}"
         )
+        if self.monte_carlo_checkbox.isChecked():
+            exact_result = simulate_imprisonment(n, riguang_level, exact=True)
+            self.simulate_imprisonment_result_textbox.appendPlainText(
+                "精确平均回合数: {:.2f}\n蒙特卡洛模拟中...".format(exact_result)
+            )
+            self.start_simulate_btn.setDisabled(True)
+            MonteCarloThread(
+                n,
+                riguang_level,
+                monte_carlo_trial_num(n, riguang_level, self.monte_carlo_trial_num),
+                self.monte_carlo_seed,
+                self.monte_carlo_finish_signal,
+            ).start()
+
+    def monte_carlo_finish(self, msg):
+        self.simulate_imprisonment_result_textbox.appendPlainText(msg)
+        self.start_simulate_btn.setEnabled(True)
+
+
+class MonteCarloThread(Thread):
+    def __init__(self, book_num, riguang_level, trial_num, seed, finish_signal):
+        super().__init__()
+        self.book_num = book_num
+        self.riguang_level = riguang_level
+        self.trial_num = trial_num
+        self.seed = seed
+        self.finish_signal = finish_signal
+
+    def run(self):
+        msg = "蒙特卡洛模拟失败"
+        try:
+            mean, stderr = monte_carlo_imprisonment(
+                self.book_num,
+                self.riguang_level,
+                trial_num=self.trial_num,
+                seed=self.seed,
+            )
+            msg = "蒙特卡洛平均回合数: {:.2f} ± {:.2f}({}次，种子{})".format(
+                mean, stderr, self.trial_num, self.seed
+            )
+        finally:
+            self.finish_signal.emit(msg)
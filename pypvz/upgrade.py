@@ -257,6 +257,33 @@ class StoneMan:
             "升级宝石",
             allow_empty=True,
         )
+        return self._parse_upgrade_stone_response(response)
+
+    def upgrade_stone_batch(self, arg_list, batch_size=20):
+        '''
+        arg_list: [(plant_id, stone_index), ...]，打包成amf批量请求
+
+        return: 与arg_list一一对应的upgrade_stone结果
+        '''
+        call_list = [
+            (
+                'api.apiorganism.upgradeTalent',
+                [float(plant_id), "talent_" + str(stone_index + 1)],
+            )
+            for plant_id, stone_index in arg_list
+        ]
+        response_list = self.wr.amf_batch_retry(
+            call_list,
+            "/pvz/amf/",
+            "升级宝石",
+            batch_size=batch_size,
+            allow_empty=True,
+        )
+        return [
+            self._parse_upgrade_stone_response(response) for response in response_list
+        ]
+
+    def _parse_upgrade_stone_response(self, response):
         if response is None:
             return response
         if response.status == 1:
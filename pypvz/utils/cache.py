@@ -0,0 +1,309 @@
+import os
+import atexit
+import pickle
+import logging
+from collections import OrderedDict
+from threading import Lock, Timer
+from time import time
+
+
+class MemoryLRU:
+    '''
+    按字节数限制大小的LRU，非线程安全，由调用方加锁
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, key):
+        content = self._data.get(key)
+        if content is not None:
+            self._data.move_to_end(key)
+        return content
+
+    def put(self, key, content: bytes):
+        self.pop(key)
+        if len(content) > self.max_size:
+            return
+        self._data[key] = content
+        self.size += len(content)
+        while self.size > self.max_size:
+            _, old = self._data.popitem(last=False)
+            self.size -= len(old)
+
+    def pop(self, key):
+        content = self._data.pop(key, None)
+        if content is not None:
+            self.size -= len(content)
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+
+class PrivateCache:
+    '''
+    随程序分发在data/cache下的静态文件(php_xml等)。
+    第一次使用时扫描一次目录建立索引，之后不在索引里的路径直接返回None，
+    不再对每个请求做文件系统调用；读到的内容放在内存LRU里
+    '''
+
+    def __init__(self, root_dir="./data/cache", max_memory_size=64 * 1024 * 1024):
+        self.root_dir = root_dir
+        self._lock = Lock()
+        self._index = None
+        self._memory = MemoryLRU(max_memory_size)
+
+    def refresh(self):
+        index = set()
+        if os.path.isdir(self.root_dir):
+            for dirpath, _, filenames in os.walk(self.root_dir):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    index.add(os.path.normpath(os.path.relpath(path, self.root_dir)))
+        with self._lock:
+            self._index = index
+            self._memory.clear()
+
+    def get(self, rel_path):
+        if self._index is None:
+            self.refresh()
+        rel_path = os.path.normpath(rel_path)
+        if rel_path not in self._index:
+            return None
+        with self._lock:
+            content = self._memory.get(rel_path)
+        if content is not None:
+            return content
+        try:
+            with open(os.path.join(self.root_dir, rel_path), "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            self._memory.put(rel_path, content)
+        return content
+
+
+# 默认缓存一天，过期后向服务器验证
+DEFAULT_RESPONSE_TTL = 24 * 3600
+
+
+class _CacheEntry:
+    __slots__ = ("size", "stored_time", "etag", "last_modified")
+
+    def __init__(self, size, stored_time, etag=None, last_modified=None):
+        self.size = size
+        self.stored_time = stored_time
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache:
+    '''
+    WebRequest的use_cache缓存，按url的hash存放在cache_dir下，文件名与原来一致。
+
+    打开时扫描一次目录建立索引，命中时先查内存LRU，再读磁盘；
+    超过ttl的缓存用ETag/Last-Modified向服务器验证，ttl为None时永不过期；
+    磁盘总大小超过max_disk_size时按最久未使用淘汰。
+    索引修改后不立即写盘，flush_delay秒内的修改合并成一次写入，程序退出时再写一次
+
+    Args:
+        cache_dir: 缓存目录
+        ttl: 缓存有效秒数，None表示永不过期
+        max_disk_size: 磁盘缓存总大小上限(字节)
+        max_memory_size: 内存LRU大小上限(字节)
+    '''
+
+    index_name = "index.pickle"
+    flush_delay = 5
+
+    def __init__(
+        self,
+        cache_dir,
+        ttl=DEFAULT_RESPONSE_TTL,
+        max_disk_size=256 * 1024 * 1024,
+        max_memory_size=32 * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_disk_size = max_disk_size
+        self._lock = Lock()
+        self._memory = MemoryLRU(max_memory_size)
+        # 按最近使用排序，最久未使用的在最前面
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self.disk_size = 0
+        # 索引有未写盘的修改时置位，由定时器或退出时的flush写盘
+        self._dirty = False
+        self._flush_timer: Timer = None
+        self._flush_lock = Lock()
+        self._load_index()
+        atexit.register(self.flush)
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.index_name)
+
+    def _load_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        saved = {}
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, "rb") as f:
+                    saved = pickle.load(f)
+            except Exception as e:
+                logging.warning(
+                    "缓存索引读取失败，将重新建立。异常类型：{}".format(type(e).__name__)
+                )
+        dir_entries = [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file()
+            and entry.name not in (self.index_name, self.index_name + ".tmp")
+        ]
+        dir_entries.sort(key=lambda entry: entry.stat().st_atime)
+        for dir_entry in dir_entries:
+            stat = dir_entry.stat()
+            entry = None
+            if dir_entry.name in saved:
+                entry = _CacheEntry(*saved[dir_entry.name])
+            if entry is None or entry.size != stat.st_size:
+                entry = _CacheEntry(stat.st_size, stat.st_mtime)
+            self._entries[dir_entry.name] = entry
+            self.disk_size += entry.size
+
+    def _mark_dirty(self):
+        # 调用时已持有锁。安排一次延迟写盘，已经安排过则合并
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        '''
+        把索引写盘。锁内只复制索引，序列化和写文件在锁外进行
+        '''
+        with self._flush_lock:
+            with self._lock:
+                self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # 只保存基本类型，不依赖类定义
+                data = {
+                    key: (entry.size, entry.stored_time, entry.etag, entry.last_modified)
+                    for key, entry in self._entries.items()
+                }
+            tmp_path = self._index_path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(data, f)
+                os.replace(tmp_path, self._index_path)
+            except OSError as e:
+                logging.warning("缓存索引写入失败：{}".format(e))
+
+    def _is_fresh(self, entry: _CacheEntry, ttl):
+        return ttl is None or time() - entry.stored_time < ttl
+
+    def lookup(self, key, ttl=...):
+        '''
+        Args:
+            ttl: 本次查询使用的有效秒数，不传时使用self.ttl
+
+        Returns:
+            tuple: (content, fresh, validators)。
+                content为None表示没有缓存；fresh为False时需要带上validators重新验证
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False, {}
+            self._entries.move_to_end(key)
+            content = self._memory.get(key)
+        if content is None:
+            try:
+                with open(os.path.join(self.cache_dir, key), "rb") as f:
+                    content = f.read()
+            except OSError:
+                with self._lock:
+                    self._remove(key)
+                return None, False, {}
+            with self._lock:
+                self._memory.put(key, content)
+        validators = {}
+        if entry.etag is not None:
+            validators["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            validators["If-Modified-Since"] = entry.last_modified
+        if ttl is ...:
+            ttl = self.ttl
+        return content, self._is_fresh(entry, ttl), validators
+
+    def store(self, key, content: bytes, headers=None):
+        etag, last_modified = None, None
+        if headers is not None:
+            etag = headers.get("ETag")
+            last_modified = headers.get("Last-Modified")
+        with open(os.path.join(self.cache_dir, key), "wb") as f:
+            f.write(content)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.disk_size -= old.size
+            self._entries[key] = _CacheEntry(len(content), time(), etag, last_modified)
+            self.disk_size += len(content)
+            self._memory.put(key, content)
+            self._evict()
+            self._mark_dirty()
+
+    def revalidated(self, key):
+        # 服务器返回304，缓存续期
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.stored_time = time()
+            self._mark_dirty()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.disk_size -= entry.size
+        self._memory.pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.disk_size > self.max_disk_size and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._remove(key)
+            self._mark_dirty()
+
+
+private_cache = PrivateCache()
+
+_response_cache_dict: dict[str, ResponseCache] = {}
+_response_cache_lock = Lock()
+
+
+def get_response_cache(cache_dir, ttl=DEFAULT_RESPONSE_TTL) -> ResponseCache:
+    # 同一个目录只打开一个ResponseCache，多个WebRequest共用索引和内存LRU。
+    # ttl只在第一次打开时生效，各账号不同的ttl在lookup时传入
+    cache_dir = os.path.abspath(cache_dir)
+    with _response_cache_lock:
+        cache = _response_cache_dict.get(cache_dir)
+        if cache is None:
+            cache = ResponseCache(cache_dir, ttl=ttl)
+            _response_cache_dict[cache_dir] = cache
+        return cache
@@ -1,4 +1,7 @@
 import math
+import random
+
+from .optional import optional_import, is_installed
 
 '''
     感谢伟大的舍友，为小数点后第10位的精度计算做出了卓越的贡献。
@@ -21,10 +24,12 @@ import math
 '''
 
 
-def simulate_imprisonment(book_num, riguang_level):
+def simulate_imprisonment(book_num, riguang_level, exact=False):
     r'''
     n: 满级禁锢数量
     riguang_level: 10个炮灰的日光等级
+    exact: 为False时金龙攻击没有打死禁锢植物的情况只按一阶近似计入，与旧版结果一致；
+        为True时按马尔可夫链精确求期望
     '''
     plant_riguang_possible = 0.03 * riguang_level
     no_hit_round_count_list = [1]
@@ -72,9 +77,170 @@ def simulate_imprisonment(book_num, riguang_level):
         loss_round_count = 0
         for i in range(1, 5 + 1):
             loss_round_count += calc_loss_round_count(n - i) * hit_num_possible_list[i]
-        loss_round_count += no_hit_round_count_list[n] * (1 + hit_num_possible_list[0])
+        if exact:
+            loss_round_count = (loss_round_count + no_hit_round_count_list[n]) / (
+                1 - hit_num_possible_list[0]
+            )
+        else:
+            loss_round_count += no_hit_round_count_list[n] * (
+                1 + hit_num_possible_list[0]
+            )
         loss_round_count_list[n] = loss_round_count
         return loss_round_count
 
     calc_loss_round_count(book_num)
     return loss_round_count_list[book_num]
+
+
+def _imprison_possible(book_num):
+    # n个满级禁锢在一回合内至少有一个禁锢成功的概率
+    return 1 - (1 - 0.25) ** book_num
+
+
+def _hit_num_possible(plant_riguang_possible):
+    '''
+    金龙一次攻击打死k个禁锢植物的概率，k=0..5。
+    plant_riguang_possible可以是数也可以是numpy数组，结果与之同形
+    '''
+    hit_num_possible_list = [0 for _ in range(6)]
+    for i in range(1, 6):
+        for j in range(0, i + 1):
+            hit_num_possible_list[i - j] = hit_num_possible_list[i - j] + (
+                0.2
+                * math.comb(i, j)
+                * (1 - plant_riguang_possible) ** (i - j)
+                * plant_riguang_possible**j
+            )
+    return hit_num_possible_list
+
+
+def simulate_imprisonment_grid(max_book_num, riguang_level_list, exact=False):
+    '''
+    一次算出0..max_book_num个满级禁锢与各个日光等级组合的平均回合数。
+    按禁锢数量递推，每一步对所有日光等级同时计算
+
+    Args:
+        max_book_num: 最大满级禁锢数量
+        riguang_level_list: 日光等级列表
+        exact: 同simulate_imprisonment
+
+    Returns:
+        第n行第i列为n个满级禁锢、日光等级riguang_level_list[i]时的平均回合数。
+        有numpy时为ndarray，否则为二维list
+    '''
+    np = optional_import("numpy")
+    if np is None:
+        return [
+            [
+                simulate_imprisonment(book_num, riguang_level, exact=exact)
+                for riguang_level in riguang_level_list
+            ]
+            for book_num in range(max_book_num + 1)
+        ]
+    hit_num_possible_list = _hit_num_possible(
+        0.03 * np.asarray(riguang_level_list, dtype=np.float64)
+    )
+
+    p = _imprison_possible(np.arange(1, max_book_num + 1, dtype=np.float64))
+    tem = (-3 * p**2 + 4 * p) ** 0.5
+    m = p / 2 + tem / 2
+    n = p / 2 - tem / 2
+    no_hit_round_count = np.empty(max_book_num + 1)
+    no_hit_round_count[0] = 1
+    no_hit_round_count[1:] = (2 * p - p**2) / tem * (m / (1 - m) - n / (1 - n)) + 1
+
+    result = np.zeros((max_book_num + 1, len(riguang_level_list)))
+    for book_num in range(max_book_num + 1):
+        loss_round_count = np.zeros(len(riguang_level_list))
+        for i in range(1, min(5, book_num) + 1):
+            loss_round_count += result[book_num - i] * hit_num_possible_list[i]
+        if exact:
+            loss_round_count = (loss_round_count + no_hit_round_count[book_num]) / (
+                1 - hit_num_possible_list[0]
+            )
+        else:
+            loss_round_count += no_hit_round_count[book_num] * (
+                1 + hit_num_possible_list[0]
+            )
+        result[book_num] = loss_round_count
+    return result
+
+
+def monte_carlo_trial_num(
+    book_num, riguang_level, trial_num=100000, round_budget=4000000
+):
+    '''
+    实际使用的蒙特卡洛模拟次数。有numpy时直接返回trial_num；
+    没有numpy时逐回合模拟，耗时与总回合数成正比，按精确平均回合数缩减模拟次数，
+    使总回合数不超过round_budget(约几秒)
+
+    Args:
+        trial_num: 有numpy时的模拟次数
+        round_budget: 没有numpy时总模拟回合数的上限
+    '''
+    if is_installed("numpy"):
+        return trial_num
+    expected_round = simulate_imprisonment(book_num, riguang_level, exact=True)
+    return max(100, min(trial_num, int(round_budget / expected_round)))
+
+
+def monte_carlo_imprisonment(book_num, riguang_level, trial_num=100000, seed=0):
+    '''
+    按回合模拟禁锢过程，用来校验simulate_imprisonment(exact=True)的结果。
+    每回合每个禁锢植物以0.25的概率禁锢金龙；连续两回合都没有禁锢成功时金龙攻击1~5个植物，
+    每个被攻击的植物以日光概率免死，打死的禁锢植物数超过剩余数量时结束
+
+    Args:
+        trial_num: 模拟次数
+        seed: 随机种子，相同参数和种子的结果相同
+
+    Returns:
+        tuple: (平均回合数, 平均值的标准误差)
+    '''
+    plant_riguang_possible = 0.03 * riguang_level
+    np = optional_import("numpy")
+    if np is None:
+        rnd = random.Random(seed)
+        round_count_list = []
+        for _ in range(trial_num):
+            rest_num, round_count, imprisoned = book_num, 0, False
+            while rest_num >= 0:
+                round_count += 1
+                if rnd.random() < _imprison_possible(rest_num):
+                    imprisoned = True
+                    continue
+                if imprisoned:
+                    imprisoned = False
+                    continue
+                hit_num = rnd.randint(1, 5)
+                for _ in range(hit_num):
+                    if rnd.random() < plant_riguang_possible:
+                        hit_num -= 1
+                rest_num -= hit_num
+            round_count_list.append(round_count)
+        mean = sum(round_count_list) / trial_num
+        variance = sum((x - mean) ** 2 for x in round_count_list) / max(
+            trial_num - 1, 1
+        )
+        return mean, (variance / trial_num) ** 0.5
+
+    # 一段没有被攻击的回合数：每次禁锢成功后持续禁锢若干回合再失效一回合，
+    # 直到在未被禁锢时禁锢失败，金龙攻击。
+    # 设成功进入禁锢的次数为k，回合数为1 + 2k + 持续禁锢的回合数(负二项分布)
+    rng = np.random.default_rng(seed)
+    imprison_possible = _imprison_possible(np.arange(book_num + 1, dtype=np.float64))
+    rest_num = np.full(trial_num, book_num)
+    round_count = np.zeros(trial_num, dtype=np.int64)
+    alive = np.arange(trial_num)
+    while len(alive) > 0:
+        p = imprison_possible[rest_num[alive]]
+        k = rng.geometric(1 - p) - 1
+        stay = rng.negative_binomial(np.maximum(k, 1), 1 - p)
+        round_count[alive] += 1 + 2 * k + np.where(k > 0, stay, 0)
+        hit_num = rng.integers(1, 6, size=len(alive))
+        hit_num -= rng.binomial(hit_num, plant_riguang_possible)
+        rest_num[alive] -= hit_num
+        alive = alive[rest_num[alive] >= 0]
+    return float(round_count.mean()), float(
+        round_count.std(ddof=1) / trial_num**0.5
+    )
@@ -112,6 +112,19 @@ def format_plant_info(
     return msg
 
 
+class CallbackSignal:
+    '''
+    接口与pyqtSignal的emit一致的普通回调，无界面运行时用来代替Qt信号
+    '''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+
+    def emit(self, *args):
+        if self.callback is not None:
+            self.callback(*args)
+
+
 def signal_block_emit(refresh_signal, *args):
     if refresh_signal is None:
         return
@@ -0,0 +1,324 @@
+'''
+自动复合参数(n1, n2, k, m)的优化。
+
+模型中的数值都是合成值(属性值除去品质系数和灵魂系数)，参见docs/植物宝典.txt：
+1. 合成：合成值为v、品质系数为q的植物被吃后，吃它的植物合成值增加v*q*b*减益。
+   b为合成书系数(10增强)，大数值减益只和被吃植物的数值x=v*q有关，这里取1/(1+x/cap)，
+   cap越大越不容易满，不同属性的cap不同
+2. 单属性传承：k个传承增强卷轴传出底座合成值的min(1, 基础比例+k*每个卷轴增加的比例)
+3. 复合一个循环复制m次，每次底座传承给一个副植物，之后底座吃n1个、副植物吃n2个植物，
+   副植物再给劣质吃，一个循环结束后劣质全传给主力。
+   底座的合成值会收敛(推荐方案里的“底座有偏差不要紧，会收敛的”)，按收敛后的值计算每个循环的收益
+
+所有系数都可以通过CompoundModel的参数修改。docs里没有直接给出的系数(无极的品质系数、
+传承比例、各属性的cap)按docs/复合参数推荐.txt中四个方案的底座和每批增加值拟合，
+主力系数取1.55时模型与文档数值的误差在1%以内
+'''
+import math
+import itertools
+
+from .optional import optional_import
+from ..upgrade import quality_name_list
+
+# 魔神的系数见docs/植物宝典.txt，无极的系数是拟合值，没有给出的品质使用default_quality_coef
+quality_coef_dict = {
+    quality_name_list.index("魔神"): 1.55,
+    quality_name_list.index("无极"): 2.077,
+}
+default_quality_coef = 1.55
+
+# 各属性的大数值减益系数，按docs/复合参数推荐.txt中的推荐方案拟合
+attribute_cap_dict = {
+    "HP": 6.70e25,
+    "HP特": 6.70e25,
+    "攻击": 4.13e20,
+    "攻击特": 4.13e20,
+    "命中": 3.13e21,
+    "闪避": 3.13e21,
+    "穿透": 3.13e21,
+    "护甲": 3.13e21,
+}
+
+# 不吃灵魂加成的属性
+no_soul_attribute_set = {"命中", "闪避"}
+
+# 一个循环的消耗，与CompoundScheme.one_cycle_consume一致，另外每个循环要1本全属性传承书
+consume_name_list = ["植物", "合成书", "增强卷轴", "传承书", "传承增强卷轴", "全属性传承书"]
+default_cost_weight = {
+    "植物": 1.0,
+    "合成书": 1.0,
+    "增强卷轴": 0.1,
+    "传承书": 1.0,
+    "传承增强卷轴": 1.0,
+    "全属性传承书": 1.0,
+}
+
+
+def get_quality_coef(quality_index):
+    return quality_coef_dict.get(quality_index, default_quality_coef)
+
+
+def get_soul_coef(attribute, soul_level):
+    # 每一级灵魂增加3%
+    if attribute in no_soul_attribute_set:
+        return 1.0
+    return 1 + 0.03 * soul_level
+
+
+class CompoundModel:
+    '''
+    Args:
+        attribute: 复合的属性，同CompoundScheme.chosen_attribute
+        quality_index: 合成池(底座和副植物)的品质
+        receiver_coef: 主力的品质系数*灵魂系数，用来把合成值换算成主力的属性值
+        book_coef: 合成书系数
+        cap: 大数值减益系数，None时按attribute取attribute_cap_dict中的值
+        heritage_ratio_base: 单属性传承不用传承增强卷轴时传出的比例
+        heritage_ratio_per_reinforce: 每个传承增强卷轴增加的传出比例
+        fixed_point_iteration: 计算底座收敛值的迭代次数
+    '''
+
+    def __init__(
+        self,
+        attribute,
+        quality_index=quality_name_list.index("魔神"),
+        receiver_coef=1.0,
+        book_coef=0.88,
+        cap=None,
+        heritage_ratio_base=0.196,
+        heritage_ratio_per_reinforce=0.0812,
+        fixed_point_iteration=200,
+    ):
+        self.attribute = attribute
+        self.quality_coef = get_quality_coef(quality_index)
+        self.receiver_coef = receiver_coef
+        self.book_coef = book_coef
+        self.cap = cap if cap is not None else attribute_cap_dict[attribute]
+        self.heritage_ratio_base = heritage_ratio_base
+        self.heritage_ratio_per_reinforce = heritage_ratio_per_reinforce
+        self.fixed_point_iteration = fixed_point_iteration
+
+    def eaten_gain(self, v):
+        # 合成值为v的植物被吃后，吃它的植物增加的合成值
+        x = v * self.quality_coef
+        return x * self.book_coef / (1 + x / self.cap)
+
+    def synthesis(self, v, n):
+        '''
+        小吃大滚n次后的合成值，v、n可以是同形的numpy数组
+        '''
+        np = optional_import("numpy")
+        if np is not None and isinstance(n, np.ndarray):
+            for step in range(int(n.max(initial=0))):
+                v = np.where(step < n, self.eaten_gain(v), v)
+            return v
+        for _ in range(n):
+            v = self.eaten_gain(v)
+        return v
+
+    def heritage_ratio(self, k):
+        ratio = self.heritage_ratio_base + k * self.heritage_ratio_per_reinforce
+        np = optional_import("numpy")
+        if np is not None and isinstance(k, np.ndarray):
+            return np.minimum(1.0, ratio)
+        return min(1.0, ratio)
+
+    def source_value(self, n1, k):
+        '''
+        底座收敛后的合成值：每次传出一部分后再吃n1个植物回到原值
+        '''
+        ratio = self.heritage_ratio(k)
+        # 从单纯滚包能达到的最大值开始迭代
+        v = (self.quality_coef * self.book_coef - 1) * self.cap / self.quality_coef
+        np = optional_import("numpy")
+        if np is not None and isinstance(ratio, np.ndarray):
+            v = np.full(ratio.shape, v)
+        for _ in range(self.fixed_point_iteration):
+            v = self.synthesis(v * (1 - ratio), n1)
+        return v
+
+    def source_attribute(self, n1, k):
+        '''
+        底座收敛后的属性值，即推荐方案中的“底座”
+        '''
+        return self.source_value(n1, k) * self.quality_coef
+
+    def copy_gain(self, copy):
+        # 吃过n2个植物的副植物给劣质吃，再全部传给主力，主力增加的属性值
+        return self.eaten_gain(copy) * self.receiver_coef
+
+    def cycle_gain(self, n1, n2, k, m):
+        '''
+        底座收敛后，一个循环主力增加的属性值
+        '''
+        source = self.source_value(n1, k)
+        copy = self.synthesis(source * self.heritage_ratio(k), n2)
+        return m * self.copy_gain(copy)
+
+
+class CompoundPlan:
+    def __init__(
+        self, attribute, n1, n2, k, m, source, cycle_gain, cycle_num, consume, cost
+    ):
+        self.attribute = attribute
+        self.n1, self.n2, self.k, self.m = n1, n2, k, m
+        self.source = source
+        self.cycle_gain = cycle_gain
+        self.cycle_num = cycle_num
+        self.consume = consume
+        self.cost = cost
+
+    def __str__(self):
+        return "{}: k={}, n1={}, n2={}, m={}，底座{:.3g}，每个循环增加{:.3g}，需要{}个循环，共消耗{}".format(
+            self.attribute,
+            self.k,
+            self.n1,
+            self.n2,
+            self.m,
+            self.source,
+            self.cycle_gain,
+            self.cycle_num,
+            "，".join(
+                "{}{}".format(name, int(amount))
+                for name, amount in self.consume.items()
+            ),
+        )
+
+
+def cycle_consume(n1, n2, k, m):
+    # n1, n2, k, m可以是数也可以是numpy数组
+    np = optional_import("numpy")
+    plant_num = (n1 + n2 + 1) * m
+    return {
+        "植物": plant_num,
+        "合成书": plant_num,
+        "增强卷轴": plant_num * 10,
+        "传承书": m,
+        "传承增强卷轴": k * m,
+        "全属性传承书": (
+            np.ones_like(m) if np is not None and isinstance(m, np.ndarray) else 1
+        ),
+    }
+
+
+def optimize_compound_scheme(
+    model: CompoundModel,
+    need_value,
+    cost_weight=None,
+    n1_range=range(0, 11),
+    n2_range=range(0, 21),
+    k_range=range(1, 11),
+    m_range=range(1, 7),
+    max_plant_per_cycle=None,
+):
+    '''
+    搜索使总消耗最少的复合参数。总消耗=循环数*每个循环各项消耗按cost_weight加权之和，
+    总消耗相同时取循环数少的(服务器请求少)
+
+    Args:
+        model: 复合模型
+        need_value: 主力还需要增加的属性值
+        cost_weight: 各项消耗的权重，见default_cost_weight
+        max_plant_per_cycle: 每个循环最多使用的植物数，None为不限制
+
+    Returns:
+        CompoundPlan，没有可行的参数时返回None
+    '''
+    weight = dict(default_cost_weight)
+    if cost_weight is not None:
+        weight.update(cost_weight)
+    np = optional_import("numpy")
+    if np is None:
+        return _optimize_loop(
+            model,
+            need_value,
+            weight,
+            n1_range,
+            n2_range,
+            k_range,
+            m_range,
+            max_plant_per_cycle,
+        )
+    # 按n1, n2, k, m四个轴广播，底座收敛值只在(n1, k)上迭代
+    axes = np.ix_(
+        np.asarray(n1_range),
+        np.asarray(n2_range),
+        np.asarray(k_range),
+        np.asarray(m_range),
+    )
+    gain = model.cycle_gain(*axes)
+    n1, n2, k, m = (np.broadcast_to(axis, gain.shape).ravel() for axis in axes)
+    gain = gain.ravel()
+    consume = cycle_consume(n1, n2, k, m)
+    cycle_cost = sum(weight[name] * consume[name] for name in consume_name_list)
+    feasible = gain > 0
+    if max_plant_per_cycle is not None:
+        feasible &= consume["植物"] <= max_plant_per_cycle
+    if not feasible.any():
+        return None
+    cycle_num = np.full(len(gain), np.inf)
+    cycle_num[feasible] = np.maximum(1, np.ceil(need_value / gain[feasible]))
+    total_cost = cycle_num * cycle_cost
+    best = np.lexsort((cycle_num, total_cost))[0]
+    return CompoundPlan(
+        model.attribute,
+        int(n1[best]),
+        int(n2[best]),
+        int(k[best]),
+        int(m[best]),
+        float(model.source_attribute(int(n1[best]), int(k[best]))),
+        float(gain[best]),
+        int(cycle_num[best]),
+        {
+            name: float(consume[name][best] * cycle_num[best])
+            for name in consume_name_list
+        },
+        float(total_cost[best]),
+    )
+
+
+def _optimize_loop(
+    model, need_value, weight, n1_range, n2_range, k_range, m_range, max_plant_per_cycle
+):
+    # 底座收敛值只和n1、k有关，副植物按n2从小到大接着滚，不用每组参数都重新迭代
+    n2_list = sorted(n2_range)
+    best_key, best_plan = None, None
+    for n1, k in itertools.product(n1_range, k_range):
+        source = model.source_value(n1, k)
+        copy = source * model.heritage_ratio(k)
+        step = 0
+        for n2 in n2_list:
+            copy = model.synthesis(copy, n2 - step)
+            step = n2
+            copy_gain = model.copy_gain(copy)
+            for m in m_range:
+                consume = cycle_consume(n1, n2, k, m)
+                if (
+                    max_plant_per_cycle is not None
+                    and consume["植物"] > max_plant_per_cycle
+                ):
+                    continue
+                gain = m * copy_gain
+                if gain <= 0:
+                    continue
+                cycle_num = max(1, math.ceil(need_value / gain))
+                total_cost = cycle_num * sum(
+                    weight[name] * consume[name] for name in consume_name_list
+                )
+                # 与numpy版本一致，消耗和循环数都相同时取n1, n2, k, m最小的
+                key = (total_cost, cycle_num, n1, n2, k, m)
+                if best_key is None or key < best_key:
+                    best_key = key
+                    best_plan = CompoundPlan(
+                        model.attribute,
+                        n1,
+                        n2,
+                        k,
+                        m,
+                        source * model.quality_coef,
+                        gain,
+                        cycle_num,
+                        {name: consume[name] * cycle_num for name in consume_name_list},
+                        total_cost,
+                    )
+    return best_plan
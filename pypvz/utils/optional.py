@@ -0,0 +1,33 @@
+import importlib
+import importlib.util
+
+_module_dict = {}
+
+
+def optional_import(name):
+    '''
+    第一次用到时才导入可选依赖，没有安装时返回None。
+    numpy、aiohttp导入较慢，放在模块顶层会拖慢只用到其中一部分功能的进程(如pypvz.daemon)
+
+    Args:
+        name: 模块名
+    '''
+    try:
+        return _module_dict[name]
+    except KeyError:
+        pass
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        module = None
+    _module_dict[name] = module
+    return module
+
+
+def is_installed(name):
+    '''
+    只查找不导入，判断可选依赖是否安装
+    '''
+    if name in _module_dict:
+        return _module_dict[name] is not None
+    return importlib.util.find_spec(name) is not None
@@ -1,10 +1,9 @@
 import time
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-from pyamf import remoting, AMF0, DecodeError
+from concurrent.futures import ThreadPoolExecutor
 
 from .. import Config, WebRequest, Repository
+from ..async_web import AsyncWebRequest, run_gather
 
 # from ..config import Config
 # from ..web import WebRequest
@@ -14,18 +13,23 @@ from .. import Config, WebRequest, Repository
 class RecoverMan:
     def __init__(self, cfg: Config):
         self.wr = WebRequest(cfg)
+        self.awr = AsyncWebRequest(cfg)
         self.cfg = cfg
         self.heal_dict = {
             "低级血瓶": 13,
             "中级血瓶": 14,
             "高级血瓶": 15,
         }
+        self.batch_size = 20  # 单个amf envelope里最多打包的回血请求数
 
     def recover(self, target_id, choice='中级血瓶'):
         body = [float(target_id), float(self.heal_dict[choice])]
         response = self.wr.amf_post_retry(
             body, "api.apiorganism.refreshHp", "/pvz/amf/", "回复植物血量"
         )
+        return self._parse_recover_response(response)
+
+    def _parse_recover_response(self, response):
         if response.status == 0:
             return {"success": True, "result": int(response.body)}
         else:
@@ -36,19 +40,69 @@ class RecoverMan:
                 return {"success": False, "result": "该植物血量已满"}
             return {"success": False, "result": response.body.description}
 
-    def recover_list(self, target_id_list, choice='中级血瓶', pool_size=3):
+    def recover_list(
+        self, target_id_list, choice='中级血瓶', pool_size=3, batch_size=None
+    ):
         success_num = 0
         fail_num = 0
         if len(target_id_list) == 0:
             return success_num, fail_num
-        with ThreadPoolExecutor(max_workers=pool_size) as executor:
-            futures = [
-                executor.submit(self.recover, id, choice) for id in target_id_list
-            ]
+        if batch_size is None:
+            batch_size = self.batch_size
+        # 每个植物一个refreshHp调用，按batch_size打包进同一个amf envelope
+        call_list = [
+            (
+                "api.apiorganism.refreshHp",
+                [float(target_id), float(self.heal_dict[choice])],
+            )
+            for target_id in target_id_list
+        ]
+        chunk_list = [
+            call_list[i : i + batch_size] for i in range(0, len(call_list), batch_size)
+        ]
+        pool_size = self.cfg.congestion_window("api.apiorganism.refreshHp", pool_size)
+        if self.awr.use_aiohttp:
+            chunk_result_list = run_gather(
+                [
+                    self.awr.amf_batch_retry(
+                        chunk, "/pvz/amf/", "回复植物血量", batch_size=batch_size
+                    )
+                    for chunk in chunk_list
+                ],
+                max_concurrency=pool_size,
+            )
+        else:
+            with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                futures = [
+                    executor.submit(
+                        self.wr.amf_batch_retry,
+                        chunk,
+                        "/pvz/amf/",
+                        "回复植物血量",
+                        batch_size=batch_size,
+                    )
+                    for chunk in chunk_list
+                ]
+            chunk_result_list = []
+            for future in futures:
+                try:
+                    chunk_result_list.append(future.result())
+                except Exception as e:
+                    chunk_result_list.append(e)
+
+        results = []
+        for chunk, chunk_result in zip(chunk_list, chunk_result_list):
+            if isinstance(chunk_result, Exception):
+                results.extend([chunk_result for _ in range(len(chunk))])
+                continue
+            results.extend(
+                [self._parse_recover_response(response) for response in chunk_result]
+            )
 
-        for future in as_completed(futures):
+        for result in results:
             try:
-                result = future.result()
+                if isinstance(result, Exception):
+                    raise result
                 if result["success"] or "该植物血量已满" in result["result"]:
                     success_num += 1
                 elif "该生物不存在" in result["result"]:
@@ -0,0 +1,465 @@
+import json
+import logging
+import threading
+from collections import deque
+from time import perf_counter, time
+
+
+class LatencyHistogram:
+    '''
+    HDR风格的对数-线性直方图：小于2**significant_bits微秒的值精确计数，
+    更大的值在每个2的幂区间内再均分2**(significant_bits-1)个桶，相对误差不超过2**(1-significant_bits)。
+    桶按需创建，非线程安全，由调用方加锁
+
+    Args:
+        significant_bits: 精度位数，7位时相对误差约1.6%
+    '''
+
+    def __init__(self, significant_bits=7):
+        self.significant_bits = significant_bits
+        self._half = 1 << (significant_bits - 1)
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value_us):
+        shift = max(0, value_us.bit_length() - self.significant_bits)
+        return shift * self._half + (value_us >> shift)
+
+    def _bucket_range(self, bucket):
+        # 桶内的最小值和最大值(微秒)
+        shift = max(0, bucket // self._half - 1)
+        mantissa = bucket - shift * self._half
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        value_us = max(0, int(seconds * 1e6))
+        bucket = self._bucket(value_us)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram"):
+        assert other.significant_bits == self.significant_bits
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is None:
+                continue
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, q):
+        '''
+        Args:
+            q: 0~100
+
+        Returns:
+            第q百分位数(秒)，取所在桶的中点，没有数据时返回None
+        '''
+        if self.count == 0:
+            return None
+        rank = max(1, int(self.count * q / 100 + 0.5))
+        cumulative = 0
+        for bucket in sorted(self.counts):
+            cumulative += self.counts[bucket]
+            if cumulative >= rank:
+                low, high = self._bucket_range(bucket)
+                value = (low + high) / 2 / 1e6
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+def exception_outcome(e: Exception):
+    # 与WebRequest各个重试函数的判断一致
+    text = str(e)
+    if "429" in text or "频繁" in text:
+        return "throttled"
+    if "服务器更新" in text:
+        return "updating"
+    if "amf返回结果为空" in text:
+        return "empty"
+    if isinstance(e, RuntimeError) and "Error:" in text:
+        return "http_error"
+    return type(e).__name__
+
+
+def amf_outcome(response):
+    if response is None:
+        return "empty"
+    if response.status == 0:
+        return "ok"
+    description = response.body.description
+    if "频繁" in description:
+        return "throttled"
+    if "更新" in description:
+        return "updating"
+    return "amf_error"
+
+
+class RequestTrace:
+    '''
+    一次请求(一次尝试)的记录。作为with块使用，可以嵌套：
+    amf_post、post等各层都进入同一个trace，最外层退出时结束并交给tracer。
+    最外层退出时outcome还没有设置的话，正常退出记为ok，抛出异常时按exception_outcome记
+
+    Args:
+        tracer: 结束后交给的RequestTracer
+        account: 账号，格式同LoginTask.user_info
+        endpoint: amf的target或者url的路径
+        url: 请求地址
+        method: GET或POST
+        attempt: 重试函数中的第几次尝试
+        call_num: 一次请求中打包的amf调用数
+    '''
+
+    def __init__(self, tracer, account, endpoint, url, method, attempt=1, call_num=1):
+        self.tracer = tracer
+        self.account = account
+        self.endpoint = endpoint
+        self.url = url
+        self.method = method
+        self.attempt = attempt
+        self.call_num = call_num
+        self.proxy_id = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.queue_time = 0.0  # 等待限速和代理的时间
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+        self.network_time = 0.0
+        self.total_time = None
+        self.outcome = None
+        self.start_time = time()
+        self._start = perf_counter()
+        self._depth = 0
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        if exc_value is not None:
+            self.outcome = exception_outcome(exc_value)
+        elif self.outcome is None:
+            self.outcome = "ok"
+        self.total_time = perf_counter() - self._start
+        self.tracer.record(self)
+
+    def to_dict(self):
+        return {
+            "start_time": self.start_time,
+            "account": self.account,
+            "endpoint": self.endpoint,
+            "url": self.url,
+            "method": self.method,
+            "attempt": self.attempt,
+            "call_num": self.call_num,
+            "proxy_id": self.proxy_id,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "queue_time": self.queue_time,
+            "encode_time": self.encode_time,
+            "decode_time": self.decode_time,
+            "network_time": self.network_time,
+            "total_time": self.total_time,
+            "outcome": self.outcome,
+        }
+
+    def __str__(self):
+        return (
+            "{} {} 账号:{} 代理:{} 第{}次 结果:{} 总耗时{:.3f}s(排队{:.3f}s 网络{:.3f}s "
+            "编码{:.3f}s 解码{:.3f}s) 发送{}B 接收{}B".format(
+                self.method,
+                self.endpoint,
+                self.account,
+                self.proxy_id,
+                self.attempt,
+                self.outcome,
+                self.total_time,
+                self.queue_time,
+                self.network_time,
+                self.encode_time,
+                self.decode_time,
+                self.bytes_out,
+                self.bytes_in,
+            )
+        )
+
+
+class EndpointStats:
+    # 一个endpoint的累计统计，由RequestTracer加锁
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.total_histogram = LatencyHistogram()
+        self.network_histogram = LatencyHistogram()
+        self.outcome_count: dict[str, int] = {}
+        self.retry_count = 0
+        self.call_count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.queue_time = 0.0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+
+    def add(self, trace: RequestTrace):
+        self.total_histogram.record(trace.total_time)
+        self.network_histogram.record(trace.network_time)
+        self.outcome_count[trace.outcome] = self.outcome_count.get(trace.outcome, 0) + 1
+        if trace.attempt > 1:
+            self.retry_count += 1
+        self.call_count += trace.call_num
+        self.bytes_out += trace.bytes_out
+        self.bytes_in += trace.bytes_in
+        self.queue_time += trace.queue_time
+        self.encode_time += trace.encode_time
+        self.decode_time += trace.decode_time
+
+    @property
+    def count(self):
+        return self.total_histogram.count
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "call_count": self.call_count,
+            "retry_count": self.retry_count,
+            "outcome_count": dict(self.outcome_count),
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "queue_time": self.queue_time,
+            "encode_time": self.encode_time,
+            "decode_time": self.decode_time,
+            "total_time": self.total_histogram.to_dict(),
+            "network_time": self.network_histogram.to_dict(),
+        }
+
+
+def _prometheus_label(value):
+    return (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+
+class RequestTracer:
+    '''
+    收集所有WebRequest的RequestTrace，按endpoint汇总成直方图，并保留最近的若干条记录。
+    endpoint由WebRequest用ratelimit.endpoint_name去掉了url中的id，
+    数量仍超过max_endpoint_num时，之后新出现的endpoint都汇总到overflow_endpoint
+
+    Args:
+        recent_capacity: 保留的最近记录条数
+        log_level: 每条记录写日志的级别，None为不写
+        max_endpoint_num: 单独统计的endpoint数上限
+    '''
+
+    prometheus_prefix = "pypvz_request"
+    quantile_list = [0.5, 0.9, 0.99]
+    overflow_endpoint = "[other]"
+
+    def __init__(
+        self, recent_capacity=1000, log_level=logging.INFO, max_endpoint_num=200
+    ):
+        self.enabled = True
+        self.log_level = log_level
+        self.max_endpoint_num = max_endpoint_num
+        self._lock = threading.Lock()
+        self._stats: dict[str, EndpointStats] = {}
+        self.recent: deque[RequestTrace] = deque(maxlen=recent_capacity)
+        self._sink_list = []
+        self.since = time()
+
+    def trace(self, account, endpoint, url, method, attempt=1, call_num=1):
+        return RequestTrace(
+            self, account, endpoint, url, method, attempt=attempt, call_num=call_num
+        )
+
+    def add_sink(self, callback):
+        # 每条记录结束后以RequestTrace为参数调用callback，在发请求的线程里执行
+        self._sink_list.append(callback)
+
+    def remove_sink(self, callback):
+        if callback in self._sink_list:
+            self._sink_list.remove(callback)
+
+    def record(self, trace: RequestTrace):
+        if not self.enabled:
+            return
+        with self._lock:
+            endpoint = trace.endpoint
+            if (
+                endpoint not in self._stats
+                and len(self._stats) >= self.max_endpoint_num
+            ):
+                endpoint = self.overflow_endpoint
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = EndpointStats(endpoint)
+            stats.add(trace)
+            self.recent.append(trace)
+        if self.log_level is not None:
+            logging.log(self.log_level, str(trace))
+        for callback in list(self._sink_list):
+            try:
+                callback(trace)
+            except Exception as e:
+                logging.warning(
+                    "请求记录回调出现异常，异常类型：{}".format(type(e).__name__)
+                )
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self.recent.clear()
+            self.since = time()
+
+    def endpoint_stats(self):
+        '''
+        Returns:
+            list: [(endpoint, EndpointStats.to_dict())]，按总耗时从大到小排序
+        '''
+        with self._lock:
+            result = [(endpoint, stats.to_dict()) for endpoint, stats in self._stats.items()]
+        result.sort(key=lambda item: item[1]["total_time"]["sum"], reverse=True)
+        return result
+
+    def recent_traces(self, num=100):
+        with self._lock:
+            return list(self.recent)[-num:]
+
+    def to_json(self, recent_num=100):
+        recent = [trace.to_dict() for trace in self.recent_traces(recent_num)]
+        return json.dumps(
+            {
+                "since": self.since,
+                "now": time(),
+                "endpoints": dict(self.endpoint_stats()),
+                "recent": recent,
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+
+    def to_prometheus(self):
+        # Prometheus文本格式，耗时用summary，其余用counter
+        prefix = self.prometheus_prefix
+        with self._lock:
+            summary_dict = {"duration": [], "network": []}
+            for endpoint, stats in sorted(self._stats.items()):
+                for name, histogram in (
+                    ("duration", stats.total_histogram),
+                    ("network", stats.network_histogram),
+                ):
+                    summary_dict[name].append(
+                        (
+                            endpoint,
+                            [histogram.percentile(q * 100) for q in self.quantile_list],
+                            histogram.total,
+                            histogram.count,
+                        )
+                    )
+            counter_list = [
+                (endpoint, stats.to_dict()) for endpoint, stats in sorted(self._stats.items())
+            ]
+
+        lines = []
+        for name, help_text in (
+            ("duration", "请求总耗时(秒)"),
+            ("network", "请求网络耗时(秒)"),
+        ):
+            metric = "{}_{}_seconds".format(prefix, name)
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} summary".format(metric))
+            for endpoint, value_list, total, count in summary_dict[name]:
+                label = 'endpoint="{}"'.format(_prometheus_label(endpoint))
+                for q, value in zip(self.quantile_list, value_list):
+                    if value is not None:
+                        lines.append(
+                            '{}{{{},quantile="{}"}} {}'.format(metric, label, q, value)
+                        )
+                lines.append("{}_sum{{{}}} {}".format(metric, label, total))
+                lines.append("{}_count{{{}}} {}".format(metric, label, count))
+
+        def add_counter(name, help_text, value_list):
+            metric = "{}_{}".format(prefix, name)
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} counter".format(metric))
+            for label_dict, value in value_list:
+                label = ",".join(
+                    '{}="{}"'.format(k, _prometheus_label(v))
+                    for k, v in label_dict.items()
+                )
+                lines.append("{}{{{}}} {}".format(metric, label, value))
+
+        add_counter(
+            "total",
+            "请求次数",
+            [
+                ({"endpoint": endpoint, "outcome": outcome}, count)
+                for endpoint, stats in counter_list
+                for outcome, count in sorted(stats["outcome_count"].items())
+            ],
+        )
+        add_counter(
+            "retry_total",
+            "重试的请求次数",
+            [
+                ({"endpoint": endpoint}, stats["retry_count"])
+                for endpoint, stats in counter_list
+            ],
+        )
+        add_counter(
+            "bytes_total",
+            "请求字节数",
+            [
+                ({"endpoint": endpoint, "direction": direction}, stats["bytes_" + direction])
+                for endpoint, stats in counter_list
+                for direction in ("out", "in")
+            ],
+        )
+        add_counter(
+            "phase_seconds_total",
+            "排队、编码、解码的累计耗时(秒)",
+            [
+                ({"endpoint": endpoint, "phase": phase}, stats[phase + "_time"])
+                for endpoint, stats in counter_list
+                for phase in ("queue", "encode", "decode")
+            ],
+        )
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        # 按扩展名导出，.json为json，其余为Prometheus文本格式
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+request_tracer = RequestTracer()
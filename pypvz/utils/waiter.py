@@ -0,0 +1,39 @@
+import asyncio
+from threading import Lock
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncWaiters:
+    '''
+    让协程等待由任意线程触发的条件，相当于协程版本的Condition.wait/notify_all。
+    协程先用wait()登记拿到future，再检查条件，条件不满足才await这个future，
+    检查和等待之间其它线程的notify_all不会丢失。
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def wait(self) -> asyncio.Future:
+        # 只能在事件循环中调用。条件已满足而没有await的future会在下一次notify_all时丢弃
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.append((loop, future))
+        return future
+
+    def notify_all(self):
+        with self._lock:
+            if len(self._waiters) == 0:
+                return
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
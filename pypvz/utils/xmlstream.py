@@ -0,0 +1,66 @@
+from xml.etree.ElementTree import Element, XMLPullParser
+
+
+class ChildElementStream:
+    '''
+    分块流式解析xml，依次产出(parent, child)，
+    child是parent_paths中某个节点的一个完整的直接子节点。
+    产出之后child会从树上摘掉，调用方处理完就可以释放，不要在之后继续使用它的子节点。
+    parent只保证带有属性，不保证带有子节点。
+
+    parent_paths是相对根节点的路径(同Element.find，如"warehouse/tools")，
+    只匹配该层级上的节点，其它层级上的同名节点不会当作parent。
+    parent_paths中的节点之间不能互相嵌套。
+
+    流式解析的收益是峰值内存(整棵树不会同时存在)，耗时与一次性fromstring基本持平：
+    只订阅start事件，每喂一块数据后把已经解析完的子节点批量产出，
+    避免逐个节点处理end事件的开销。
+
+    Args:
+        data: xml的bytes
+        parent_paths: 需要逐个产出子节点的父节点相对根节点的路径
+    '''
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, data: bytes, parent_paths):
+        self.data = data
+        self.parent_paths = tuple(parent_paths)
+        self.root: Element = None
+
+    def __iter__(self):
+        parser = XMLPullParser(events=("start",))
+        parent_list = []
+        data = self.data
+        for offset in range(0, len(data), self.chunk_size):
+            parser.feed(data[offset : offset + self.chunk_size])
+            self._collect_parents(parser, parent_list)
+            for parent in parent_list:
+                # 最后一个子节点可能还没解析完，其余的都已经完整
+                num = len(parent) - 1
+                if num <= 0:
+                    continue
+                child_list = parent[:num]
+                del parent[:num]
+                for child in child_list:
+                    yield parent, child
+        parser.close()
+        self._collect_parents(parser, parent_list)
+        for parent in parent_list:
+            child_list = list(parent)
+            del parent[:]
+            for child in child_list:
+                yield parent, child
+
+    def _collect_parents(self, parser: XMLPullParser, parent_list: list):
+        # 只订阅了start事件，不逐个节点记录深度，而是按路径从根节点往下找。
+        # 路径上的节点都是根节点附近的少数节点，每块数据找一次的开销可以忽略
+        for _, elem in parser.read_events():
+            if self.root is None:
+                self.root = elem
+        if self.root is None:
+            return
+        for path in self.parent_paths:
+            for elem in self.root.iterfind(path):
+                if not any(elem is parent for parent in parent_list):
+                    parent_list.append(elem)
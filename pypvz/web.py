@@ -1,23 +1,26 @@
+import asyncio
 import requests
 from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 import concurrent.futures
-from threading import Lock
+import itertools
+from threading import Lock, Condition
 import pickle
 import os
 from random import sample
 from hashlib import sha256
-import shutil
 from time import perf_counter, sleep
 import logging
 import threading
+import weakref
 from queue import Queue
 
-from pyamf import remoting, AMF3
-import dns.resolver
 
 from .config import Config
-from .utils.log import LogTimeDecorator
+from .ratelimit import endpoint_name
+from .utils.trace import request_tracer, amf_outcome, RequestTrace
+from .utils.cache import private_cache, get_response_cache
+from .utils.waiter import AsyncWaiters
 
 proxies = {"http": None, "https": None}
 proxies = None
@@ -30,24 +33,33 @@ class ProxyItem:
         self.use_count = 0
         self.max_use_count = max_use_count
         self.test_info = test_info
+        # 以下健康状态只在持有ProxyManager的锁时修改
+        self.ewma_latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0  # 熔断结束时间
+        self.open_count = 0  # 连续熔断次数，大于0且未熔断时为半开状态
+        self.probe_failures = 0  # 健康检测连续失败次数
 
     def _form_proxy(self):
         if self.proxy is None:
             return None
         return {"http": self.proxy, "https": self.proxy}
 
+    def health_info(self):
+        info = []
+        if self.ewma_latency is not None:
+            info.append("延迟{}ms".format(int(self.ewma_latency * 1000)))
+        if self.error_rate >= 0.01:
+            info.append("错误率{:.0%}".format(self.error_rate))
+        if self.open_until > perf_counter():
+            info.append("熔断中")
+        return " ".join(info)
+
     def __str__(self):
         if self.proxy is None:
-            return f"本地直连({self.max_use_count}并发)"
-        return f"代理地址: {str(self.proxy)}({self.max_use_count}并发) {self.test_info}"
-
-    def __enter__(self, *args, **kwargs):
-        self.use_count += 1
-        return self._form_proxy()
-
-    def __exit__(self, *args, **kwargs):
-        self.use_count -= 1
-        pass
+            return f"本地直连({self.max_use_count}并发) {self.health_info()}"
+        return f"代理地址: {str(self.proxy)}({self.max_use_count}并发) {self.test_info} {self.health_info()}"
 
     @staticmethod
     def get_local_proxy():
@@ -66,62 +78,126 @@ class ProxyItem:
         return item
 
 
-class DNSResolveThread(threading.Thread):
-    def __init__(self, hostname, dns_cache):
-        super().__init__()
-        self.hostname = hostname
-        self.dns_cache = dns_cache
+class _DNSEntry:
+    __slots__ = ("ip_list", "expire_time", "error", "counter", "refreshing")
 
-    def run(self):
-        try:
-            answers = self.dns_cache.resolver.resolve(self.hostname)
-            ip_list = [i.address for i in answers]
-            # 将结果添加到缓存中
-            current_time = perf_counter()
-            self.dns_cache.cache[self.hostname] = (ip_list, current_time)
-        except Exception as e:
-            logging.error(f"Failed to resolve {self.hostname}. Exception: {str(e)}")
-            raise e
+    def __init__(self, ip_list, expire_time, error=None):
+        self.ip_list = ip_list
+        self.expire_time = expire_time
+        self.error = error
+        self.counter = itertools.count()
+        self.refreshing = False
 
 
 class DNSCache:
-    def __init__(self, ttl=30):
-        self.resolver = dns.resolver.Resolver()
-        self.resolver.nameservers = [
+    '''
+    线程安全的DNS缓存。
+
+    命中缓存时不加锁，只读字典并在ip_list中轮询；同一个主机的并发未命中只解析一次，
+    其余线程等待这次解析的结果；解析失败的结果缓存negative_ttl秒；
+    缓存过期后仍返回旧结果，同时每个主机只在后台刷新一次
+    '''
+
+    def __init__(self, ttl=30, negative_ttl=5):
+        self.nameservers = [
             "180.76.76.76",
             "223.5.5.5",
             "223.6.6.6",
             "119.29.29.29",
         ]
         self.ttl = ttl
-        self.cache = {}
+        self.negative_ttl = negative_ttl
+        self.cache: dict[str, _DNSEntry] = {}
+        self._resolver = None
+        self._lock = Lock()
+        self._inflight: dict[str, concurrent.futures.Future] = {}
+        self._refresh_executor = None
 
-    def resolve(self, hostname):
-        current_time = perf_counter()
-        # 检查缓存是否存在并且没有过期
-        if hostname in self.cache:
-            ip_list, timestamp = self.cache[hostname]
-            try:
-                ip = ip_list[0]
-            except Exception as e:
-                logging.error(
-                    f"Failed to resolve {hostname} with ip_list{ip_list}. Exception: {str(e)}"
+    @property
+    def resolver(self):
+        # 第一次用到时才导入dnspython并创建，避免导入模块时就读取系统DNS配置
+        if self._resolver is None:
+            import dns.resolver
+
+            with self._lock:
+                if self._resolver is None:
+                    resolver = dns.resolver.Resolver()
+                    resolver.nameservers = self.nameservers
+                    self._resolver = resolver
+        return self._resolver
+
+    def _lookup(self, hostname):
+        try:
+            answers = self.resolver.resolve(hostname)
+            ip_list = [i.address for i in answers]
+            if len(ip_list) == 0:
+                raise RuntimeError(f"{hostname}没有解析结果")
+            return _DNSEntry(ip_list, perf_counter() + self.ttl)
+        except Exception as e:
+            logging.error(f"Failed to resolve {hostname}. Exception: {str(e)}")
+            return _DNSEntry(None, perf_counter() + self.negative_ttl, error=e)
+
+    @staticmethod
+    def _pick(entry: _DNSEntry):
+        if entry.error is not None:
+            raise entry.error
+        return entry.ip_list[next(entry.counter) % len(entry.ip_list)]
+
+    def _refresh(self, hostname, old_entry: _DNSEntry):
+        entry = self._lookup(hostname)
+        if entry.error is not None and old_entry.error is None:
+            # 刷新失败时继续使用旧结果，negative_ttl秒后再刷新
+            entry = _DNSEntry(
+                old_entry.ip_list, perf_counter() + self.negative_ttl
+            )
+        self.cache[hostname] = entry
+
+    def _schedule_refresh(self, hostname, entry: _DNSEntry):
+        with self._lock:
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+            if self._refresh_executor is None:
+                self._refresh_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=2
                 )
-                raise e
-            if current_time - timestamp >= self.ttl:
-                DNSResolveThread(hostname, self).start()
-            return ip
-        else:
-            try:
-                answers = self.resolver.resolve(hostname)
-                ip_list = [i.address for i in answers]
-                # 将结果添加到缓存中
-                current_time = perf_counter()
-                self.cache[hostname] = (ip_list, current_time)
-                return self.resolve(hostname)
-            except Exception as e:
-                logging.error(f"Failed to resolve {hostname}. Exception: {str(e)}")
-                raise e
+        self._refresh_executor.submit(self._refresh, hostname, entry)
+
+    def resolve(self, hostname):
+        entry = self.cache.get(hostname)
+        if entry is not None:
+            if perf_counter() >= entry.expire_time:
+                if entry.error is not None:
+                    # 失败结果过期后重新同步解析
+                    entry = self._resolve_miss(hostname, entry)
+                else:
+                    self._schedule_refresh(hostname, entry)
+            return self._pick(entry)
+        return self._pick(self._resolve_miss(hostname, None))
+
+    def _resolve_miss(self, hostname, expired_entry):
+        with self._lock:
+            entry = self.cache.get(hostname)
+            if entry is not None and entry is not expired_entry:
+                return entry
+            future = self._inflight.get(hostname)
+            is_leader = future is None
+            if is_leader:
+                future = concurrent.futures.Future()
+                self._inflight[hostname] = future
+        if not is_leader:
+            return future.result()
+        try:
+            entry = self._lookup(hostname)
+            self.cache[hostname] = entry
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(hostname, None)
 
 
 try:
@@ -129,7 +205,6 @@ try:
 except Exception as e:
     logging.warning("DNS缓存初始化失败，将不使用DNS缓存。报错信息: {}".format(str(e)))
     dns_cache = None
-dns_cache_lock = Lock()
 
 
 class DNSCacheAdapter(HTTPAdapter):
@@ -138,11 +213,10 @@ class DNSCacheAdapter(HTTPAdapter):
         super().__init__(*args, **kwargs)
 
     def get_connection(self, url, proxies=None):
-        # 解析主机名并使用缓存的IP地址
+        # 解析主机名并使用缓存的IP地址，DNSCache内部保证线程安全
         host = self.get_host(url)
         try:
-            with dns_cache_lock:
-                ip = dns_cache.resolve(host)
+            ip = dns_cache.resolve(host)
             url = url.replace(host, ip)
         except Exception as e:
             if not self.already_logged:
@@ -155,6 +229,30 @@ class DNSCacheAdapter(HTTPAdapter):
         return urlparse(url).hostname
 
 
+class ProxyLease:
+    '''
+    一次代理的使用权，由ProxyManager.lease分配。
+    with块结束时归还，并把本次请求的耗时和是否抛出异常记录到代理的健康状态中
+    '''
+
+    def __init__(self, manager: "ProxyManager", item: ProxyItem, tracked=True):
+        self.manager = manager
+        self.item = item
+        self.tracked = tracked
+        self.start_time = None
+
+    @property
+    def proxy(self):
+        return self.item.proxy
+
+    def __enter__(self):
+        self.start_time = perf_counter()
+        return self.item._form_proxy()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.manager._release(self, perf_counter() - self.start_time, exc_type is None)
+
+
 class ProxyManager:
     def __init__(self):
         self.proxy_item_list = [ProxyItem.get_local_proxy()]
@@ -162,44 +260,166 @@ class ProxyManager:
             False  # 没有可用代理后是否阻塞，不阻塞则不使用代理直接直连
         )
         self._lock = Lock()
+        self._cond = Condition(self._lock)
+        self._async_waiters = AsyncWaiters()
         self.id_set = set()
         self.use_dns_cache = False
-
-    def get_adapter(self):
+        self.ewma_alpha = 0.2
+        self.default_latency = 0.5  # 没有测过延迟的代理按这个延迟估计
+        self.failure_threshold = 3  # 连续失败多少次后熔断
+        self.base_open_time = 5
+        self.max_open_time = 120
+        self.health_checker = ProxyHealthChecker(self)
+
+    def get_adapter(self, pool_size=10):
         if self.use_dns_cache and dns_cache is not None:
-            return DNSCacheAdapter()
+            return DNSCacheAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
         else:
-            return HTTPAdapter()
+            return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
 
     def reset_proxy_list(self):
-        with self._lock:
+        with self._cond:
             self.proxy_item_list = [ProxyItem.get_local_proxy()]
-
-    def get_proxy_item(self):
-        min_use_count = 99999
-        min_index = -1
-        if len(self.proxy_item_list) == 0:
-            raise RuntimeError("没有可用代理")
+            self._notify()
+
+    def _is_available(self, item: ProxyItem, now):
+        if item.max_use_count is not None and item.use_count >= item.max_use_count:
+            return False
+        if item.open_until > now:
+            return False
+        if item.open_count > 0 and item.use_count > 0:
+            # 半开状态只放行一个探测请求
+            return False
+        return True
+
+    def _expected_time(self, item: ProxyItem):
+        # 排在已有请求之后的预计完成时间，错误率越高越需要重试，预计时间越长
+        latency = item.ewma_latency
+        if latency is None:
+            latency = self.default_latency
+        return latency * (item.use_count + 1) / max(0.05, 1 - item.error_rate)
+
+    def _pick(self, now):
+        best_item, best_time = None, None
+        for item in self.proxy_item_list:
+            if not self._is_available(item, now):
+                continue
+            expected_time = self._expected_time(item)
+            if best_item is None or expected_time < best_time:
+                best_item, best_time = item, expected_time
+        return best_item
+
+    def _next_wakeup(self, now):
+        # 距离最早一个代理结束熔断的秒数
+        wait_list = [
+            item.open_until - now
+            for item in self.proxy_item_list
+            if item.open_until > now
+        ]
+        if len(wait_list) == 0:
+            return None
+        return min(wait_list)
+
+    def lease(self, blocking=True, timeout=None):
+        '''
+        选出预计完成时间最短的可用代理并占用它，返回ProxyLease。
+        没有可用代理时，block_when_no_proxy为False则返回本地直连，
+        否则阻塞等待代理归还或者结束熔断。blocking为False时不等待，直接返回None
+
+        Raises:
+            RuntimeError: 代理列表为空
+            TimeoutError: 超过timeout秒仍没有可用代理
+        '''
+        deadline = None if timeout is None else perf_counter() + timeout
+        with self._cond:
+            while True:
+                if len(self.proxy_item_list) == 0:
+                    raise RuntimeError("没有可用代理")
+                now = perf_counter()
+                item = self._pick(now)
+                if item is not None:
+                    item.use_count += 1
+                    return ProxyLease(self, item)
+                if not self.block_when_no_proxy:
+                    break
+                if not blocking:
+                    return None
+                wait_time = self._next_wakeup(now)
+                if deadline is not None:
+                    if deadline <= now:
+                        raise TimeoutError("等待可用代理超时")
+                    wait_time = (
+                        deadline - now
+                        if wait_time is None
+                        else min(wait_time, deadline - now)
+                    )
+                self._cond.wait(wait_time)
+        item = ProxyItem.get_local_proxy()
+        item.use_count += 1
+        return ProxyLease(self, item, tracked=False)
+
+    async def lease_async(self, timeout=None):
+        '''
+        lease的协程版本，没有可用代理时等待代理归还或者结束熔断，不占用线程
+
+        Raises:
+            RuntimeError: 代理列表为空
+            TimeoutError: 超过timeout秒仍没有可用代理
+        '''
+        deadline = None if timeout is None else perf_counter() + timeout
         while True:
+            waiter = self._async_waiters.wait()
+            lease = self.lease(blocking=False)
+            if lease is not None:
+                return lease
             with self._lock:
-                for item in self.proxy_item_list:
-                    if (
-                        item.max_use_count is not None
-                        and item.use_count >= item.max_use_count
-                    ):
-                        continue
-                    if item.use_count < min_use_count:
-                        min_use_count = item.use_count
-                        min_index = self.proxy_item_list.index(item)
-            if min_index == -1:
-                if self.block_when_no_proxy:
-                    sleep(0.05)
-                    continue
-                # logging.info("没有可用代理，使用本地直连")
-                return ProxyItem.get_local_proxy()
-            break
-        # logging.info(f"使用代理: {self.proxy_item_list[min_index]}")
-        return self.proxy_item_list[min_index]
+                now = perf_counter()
+                wait_time = self._next_wakeup(now)
+            if deadline is not None:
+                if deadline <= now:
+                    raise TimeoutError("等待可用代理超时")
+                wait_time = (
+                    deadline - now if wait_time is None else min(wait_time, deadline - now)
+                )
+            await asyncio.wait((waiter,), timeout=wait_time)
+
+    def _notify(self):
+        # 调用时已持有self._cond
+        self._cond.notify_all()
+        self._async_waiters.notify_all()
+
+    def _release(self, lease: ProxyLease, latency, success):
+        with self._cond:
+            lease.item.use_count -= 1
+            if lease.tracked:
+                self._record(lease.item, latency, success)
+            self._notify()
+
+    def record(self, item: ProxyItem, latency, success):
+        # 记录一次不经过lease的请求结果，例如代理测试
+        with self._cond:
+            self._record(item, latency, success)
+            self._notify()
+
+    def _record(self, item: ProxyItem, latency, success):
+        alpha = self.ewma_alpha
+        item.error_rate = (1 - alpha) * item.error_rate + alpha * (0 if success else 1)
+        if success:
+            if item.ewma_latency is None:
+                item.ewma_latency = latency
+            else:
+                item.ewma_latency = (1 - alpha) * item.ewma_latency + alpha * latency
+            item.consecutive_failures = 0
+            item.open_count = 0
+            item.open_until = 0
+            return
+        item.consecutive_failures += 1
+        if item.open_count > 0 or item.consecutive_failures >= self.failure_threshold:
+            # 连续失败或者半开探测失败则熔断，熔断时长随连续熔断次数翻倍
+            item.open_until = perf_counter() + min(
+                self.max_open_time, self.base_open_time * 2**item.open_count
+            )
+            item.open_count += 1
 
     def _get_unique_item_id(self):
         with self._lock:
@@ -231,15 +451,17 @@ class ProxyManager:
         item = self.get_item(item_id)
         if item is None:
             return
-        with self._lock:
+        with self._cond:
             item.max_use_count = max_use_count
+            self._notify()
 
     def add_proxy_item(self, proxy, max_use_count=3):
         item_id = self._get_unique_item_id()
-        with self._lock:
+        with self._cond:
             self.proxy_item_list.append(
                 ProxyItem(item_id, proxy, max_use_count=max_use_count)
             )
+            self._notify()
         return item_id
 
     def delete_proxy_item(self, item_id):
@@ -279,6 +501,7 @@ class ProxyManager:
             "block_when_no_proxy": self.block_when_no_proxy,
             "proxy_item_list": [item.serialize() for item in self.proxy_item_list],
             "use_dns_cache": self.use_dns_cache,
+            "health_checker": self.health_checker.serialize(),
         }
         with open(save_path, "wb") as f:
             f.write(pickle.dumps(data))
@@ -288,7 +511,7 @@ class ProxyManager:
             return
         with open(load_path, "rb") as f:
             data = pickle.loads(f.read())
-        with self._lock:
+        with self._cond:
             if "block_when_no_proxy" in data:
                 self.block_when_no_proxy = data["block_when_no_proxy"]
             if "proxy_item_list" in data:
@@ -297,34 +520,657 @@ class ProxyManager:
                 ]
             if "use_dns_cache" in data:
                 self.use_dns_cache = data["use_dns_cache"]
+            self._notify()
+        if "health_checker" in data:
+            self.health_checker.deserialize(data["health_checker"])
+
+
+class ProxyHealthChecker:
+    '''
+    代理健康检测。用有限大小的线程池并发探测proxy_man中的代理，
+    结果通过ProxyManager.record反馈给代理调度，连续探测失败的代理会被移除。
+    可以开启后台定时检测，测试地址可配置，方便指向本地的HTTP服务
+
+    Args:
+        proxy_manager: 被检测的ProxyManager
+    '''
+
+    def __init__(self, proxy_manager: ProxyManager):
+        self.proxy_manager = proxy_manager
+        self.url = "http://httpbin.org/ip"
+        self.timeout = 3
+        self.max_workers = 8
+        self.interval = 300  # 后台检测间隔(秒)
+        self.evict_threshold = 5  # 连续探测失败多少次后移除代理，0表示不移除
+        self.enabled = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._check_lock = Lock()
+
+    @staticmethod
+    def _form_probe_proxy(proxy):
+        if "://" in proxy:
+            return {"http": proxy, "https": proxy}
+        return {"http": f"http://{proxy}", "https": f"https://{proxy}"}
+
+    def probe(self, item: ProxyItem):
+        # 探测一次，返回是否成功，并把耗时和结果记录到代理的健康状态中
+        start_time = perf_counter()
+        try:
+            resp = requests.get(
+                self.url,
+                proxies=self._form_probe_proxy(item.proxy),
+                timeout=self.timeout,
+            )
+            success = resp.status_code == 200
+        except Exception:
+            success = False
+        self.proxy_manager.record(item, perf_counter() - start_time, success)
+        return success
+
+    def check_item(self, item: ProxyItem, test_times=1):
+        s_num = 0
+        f_num = 0
+        for _ in range(test_times):
+            if self.probe(item):
+                s_num += 1
+            else:
+                f_num += 1
+        if s_num > 0:
+            item.probe_failures = 0
+        else:
+            item.probe_failures += 1
+        item.test_info = f"成功 {s_num}  失败 {f_num}"
+        return s_num, f_num
+
+    def check_all(self, test_times=1):
+        '''
+        并发检测所有代理(不包括本地直连)，并移除连续失败次数达到evict_threshold的代理
+
+        Returns:
+            dict: item_id -> (成功次数, 失败次数)
+        '''
+        with self._check_lock:
+            item_list = [
+                item
+                for item in list(self.proxy_manager.proxy_item_list)
+                if item.proxy is not None
+            ]
+            result = {}
+            if len(item_list) == 0:
+                return result
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(item_list))
+            ) as executor:
+                futures = {
+                    executor.submit(self.check_item, item, test_times): item
+                    for item in item_list
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    result[futures[future].item_id] = future.result()
+            if self.evict_threshold > 0:
+                for item in item_list:
+                    if item.probe_failures >= self.evict_threshold:
+                        logging.warning(
+                            "代理{}连续{}次检测失败，已移除".format(
+                                item.proxy, item.probe_failures
+                            )
+                        )
+                        self.proxy_manager.delete_proxy_item(item.item_id)
+            return result
+
+    def check_async(self, test_times=1, callback=None):
+        # 在后台线程中检测，不阻塞调用方。检测完成后调用callback(result)
+        def run():
+            try:
+                result = self.check_all(test_times)
+            except Exception as e:
+                logging.warning(
+                    "代理检测异常，异常类型：{}".format(type(e).__name__)
+                )
+                result = {}
+            if callback is not None:
+                callback(result)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _loop(self, stop_event: threading.Event):
+        while not stop_event.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logging.warning(
+                    "后台代理检测异常，异常类型：{}".format(type(e).__name__)
+                )
+
+    def start(self):
+        self.enabled = True
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # 每个后台线程用自己的停止事件，避免stop后立刻start时旧线程继续运行
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._loop, args=(self._stop_event,), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self.enabled = False
+        self._stop_event.set()
+        self._thread = None
+
+    def serialize(self):
+        return {
+            "url": self.url,
+            "interval": self.interval,
+            "evict_threshold": self.evict_threshold,
+            "enabled": self.enabled,
+        }
+
+    def deserialize(self, data):
+        if "url" in data:
+            self.url = data["url"]
+        if "interval" in data:
+            self.interval = data["interval"]
+        if "evict_threshold" in data:
+            self.evict_threshold = data["evict_threshold"]
+        if data.get("enabled", False):
+            self.start()
 
 
 proxy_man = ProxyManager()
 
 
 def test_proxy_alive(proxy, item_id, test_times):
-    s_num = 0
-    f_num = 0
-    for i in range(test_times):
+    item = proxy_man.get_item(item_id)
+    if item is None:
+        return "代理不存在"
+    s_num, f_num = proxy_man.health_checker.check_item(item, test_times)
+    return f"成功次数 {s_num}  失败次数 {f_num}"
+
+
+class PooledTransport:
+    '''
+    一个账号(Config)共用的连接池，所有manager的WebRequest都从这里拿session，
+    这样同一账号的请求可以复用keep-alive连接，而不是每个manager各建一套连接池
+    '''
+
+    def __init__(self, pool_size=10, use_dns_cache=False):
+        self.pool_size = pool_size
+        self.use_dns_cache = use_dns_cache
+        self.session = requests.Session()
+        self.adapter = proxy_man.get_adapter(pool_size)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self._lock = Lock()
+        self._async_sessions = {}
+        self.async_opened = 0
+        self.async_reused = 0
+
+    def _iter_pools(self):
+        pool_managers = [self.adapter.poolmanager] + list(
+            self.adapter.proxy_manager.values()
+        )
+        for pool_manager in pool_managers:
+            pools = pool_manager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def stats(self):
+        opened, requested = 0, 0
+        for pool in self._iter_pools():
+            opened += pool.num_connections
+            requested += pool.num_requests
+        opened += self.async_opened
+        reused = max(requested - opened, 0) + self.async_reused
+        return {
+            "pool_size": self.pool_size,
+            "opened": opened,
+            "reused": reused,
+            "requests": requested + self.async_reused + self.async_opened,
+        }
+
+    def get_async_session(self, loop):
+        import aiohttp
+
+        with self._lock:
+            session = self._async_sessions.get(loop)
+            if session is not None and not session.closed:
+                return session
+
+            async def on_create(*args):
+                self.async_opened += 1
+
+            async def on_reuse(*args):
+                self.async_reused += 1
+
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(on_create)
+            trace_config.on_connection_reuseconn.append(on_reuse)
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=0, limit_per_host=0, ttl_dns_cache=30
+                ),
+                trace_configs=[trace_config],
+            )
+            self._async_sessions[loop] = session
+            return session
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            session_dict, self._async_sessions = self._async_sessions, {}
+        for loop, session in session_dict.items():
+            # aiohttp的session只能在创建它的事件循环里关闭
+            if session.closed or loop.is_closed():
+                continue
+            try:
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+
+
+_transport_dict = weakref.WeakKeyDictionary()
+_transport_lock = Lock()
+
+
+def get_transport(cfg: Config) -> PooledTransport:
+    with _transport_lock:
+        transport = _transport_dict.get(cfg)
+        if (
+            transport is None
+            or transport.pool_size != cfg.pool_size
+            or transport.use_dns_cache != proxy_man.use_dns_cache
+        ):
+            # 连接池配置变了就换一个新的，关闭旧的连接池和aiohttp session
+            if transport is not None:
+                transport.close()
+            transport = PooledTransport(cfg.pool_size, proxy_man.use_dns_cache)
+            _transport_dict[cfg] = transport
+        return transport
+
+
+def transport_stats():
+    result = {"accounts": 0, "opened": 0, "reused": 0, "requests": 0}
+    with _transport_lock:
+        transport_list = list(_transport_dict.values())
+    for transport in transport_list:
+        stats = transport.stats()
+        result["accounts"] += 1
+        result["opened"] += stats["opened"]
+        result["reused"] += stats["reused"]
+        result["requests"] += stats["requests"]
+    return result
+
+
+def encode_amf_batch(call_list):
+    # call_list: [(target, body), ...]，依次编码为/1../N
+    from pyamf import remoting, AMF3
+
+    ev = remoting.Envelope(AMF3)
+    for i, (target, body) in enumerate(call_list):
+        ev[f"/{i + 1}"] = remoting.Request(target=target, body=body)
+    return remoting.encode(ev, strict=True).getvalue()
+
+
+def decode_amf_batch(resp, num):
+    # 服务器没有返回的调用对应位置为None
+    from pyamf import remoting
+
+    if len(resp) == 0:
+        raise RuntimeError("amf返回结果为空")
+    resp_ev = remoting.decode(resp)
+    result = []
+    for i in range(num):
+        try:
+            result.append(resp_ev[f"/{i + 1}"])
+        except KeyError:
+            result.append(None)
+    return result
+
+
+def batch_endpoint(call_list):
+    # 打包请求单独统计，不和单个调用混在一起
+    return "{}[batch]".format(call_list[0][0])
+
+
+def batch_outcome(response_list):
+    # 打包请求中最需要关注的结果
+    outcome_set = set(amf_outcome(response) for response in response_list)
+    for outcome in ("throttled", "updating", "empty", "amf_error"):
+        if outcome in outcome_set:
+            return outcome
+    return "ok"
+
+
+def amf_throttle_reason(response):
+    # 返回需要等待重试的原因: "频繁"、"更新"或None
+    if response.status == 0:
+        return None
+    description = response.body.description
+    if "频繁" in description:
+        return "频繁"
+    if "更新" in description:
+        return "更新"
+    return None
+
+
+def encode_amf(target, body):
+    from pyamf import remoting, AMF3
+
+    ev = remoting.Envelope(AMF3)
+    ev['/1'] = remoting.Request(target=target, body=body)
+    return remoting.encode(ev, strict=True).getvalue()
+
+
+def _log_warning(msg, logger=None):
+    if logger is not None:
+        logger.log(msg)
+    else:
+        logging.warning(msg)
+
+
+# 以下*_retry_steps是get_retry、amf_post_retry、amf_batch_retry的重试状态机，
+# WebRequest和AsyncWebRequest共用。状态机只产出要执行的动作，由调用方的_run_retry执行：
+#   ("call", 方法名, args, kwargs): 调用WebRequest/AsyncWebRequest上的请求方法，结果或异常送回状态机
+#   ("wait_free",): 等待服务器更新的等待结束
+#   ("sleep_freq", 秒数): 服务器更新或ip限流(429)，该账号的所有请求一起等待
+#   ("sleep", 秒数): 只有当前请求等待
+
+
+def get_retry_steps(
+    cfg: Config, url, msg, max_retry=50, logger=None, except_retry=False, **kwargs
+):
+    endpoint = endpoint_name(url)
+    cnt, attempt = 0, 0
+    while cnt < max_retry:
+        cnt += 1
+        attempt += 1
         try:
-            r = requests.get(
-                "http://httpbin.org/ip",
-                proxies={
-                    "http": f"http://{proxy}",
-                    "https": f"https://{proxy}",
-                },
-                timeout=3,
+            yield ("wait_free",)
+            response = yield (
+                "call",
+                "get",
+                (url,),
+                dict(endpoint=endpoint, attempt=attempt, **kwargs),
             )
-            if r.status_code == 200:
-                s_num += 1
-            else:
-                f_num += 1
-        except:
-            f_num += 1
 
-    proxy_man.get_item(item_id).test_info = f"成功 {s_num}  失败 {f_num}"
+            # import random
+            # if random.random() < 0.2:
 
-    return f"成功次数 {s_num}  失败次数 {f_num}"
+            #     raise requests.ConnectionError("test")
+
+            if len(response) == 0:
+                return None
+            try:
+                text = response.decode("utf-8")
+            except UnicodeDecodeError:
+                text = ""
+            if "请求过于频繁" in text:
+                cnt -= 1
+                _log_warning("请求{}过于频繁，降低该请求的并发后重试".format(msg), logger)
+                cfg.feedback(endpoint, throttled=True)
+                continue
+            if "服务器更新" in text:
+                cnt -= 1
+                _log_warning(
+                    "请求{}的时候服务器更新，选择等待10秒后重试".format(msg), logger
+                )
+                yield ("sleep_freq", 10)
+                continue
+            cfg.feedback(endpoint)
+            break
+        except Exception as e:
+            if "429" in str(e):
+                cnt -= 1
+                _log_warning(
+                    "请求{}过于频繁，触发ip限流，降低该请求的并发并等待10秒后重试".format(
+                        msg
+                    ),
+                    logger,
+                )
+                # 429针对整个ip，除了降低该请求的并发，整个账号也要暂停
+                cfg.feedback(endpoint, throttled=True)
+                yield ("sleep_freq", 10)
+                continue
+            if "服务器更新" in str(e):
+                cnt -= 1
+                _log_warning(
+                    "请求{}的时候服务器更新，选择等待10秒后重试".format(msg), logger
+                )
+                yield ("sleep_freq", 10)
+                continue
+            if except_retry:
+                _log_warning(
+                    "重新尝试请求{}，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
+                        msg, max_retry - cnt, type(e).__name__
+                    ),
+                    logger,
+                )
+                yield ("sleep", 1)
+                continue
+            raise e
+    else:
+        warning_msg = "尝试请求{}失败，超过最大尝试次数{}次".format(msg, max_retry)
+        _log_warning(warning_msg, logger)
+        raise Exception(warning_msg)
+    return response
+
+
+def amf_post_retry_steps(
+    cfg: Config,
+    body,
+    target,
+    url,
+    msg,
+    max_retry=50,
+    logger=None,
+    exit_response=False,
+    allow_empty=False,
+    except_retry=False,
+    **kwargs,
+):
+    if exit_response:
+        # 只有WebRequest.amf_post支持exit_response
+        kwargs["exit_response"] = True
+    cnt, attempt = 0, 0
+    while cnt < max_retry:
+        cnt += 1
+        attempt += 1
+        try:
+            yield ("wait_free",)
+            response = yield (
+                "call",
+                "amf_post",
+                (body, target, url),
+                dict(attempt=attempt, **kwargs),
+            )
+
+            # import random
+
+            # if random.random() < 0.2:
+            #     raise requests.ConnectionError("test")
+
+            if exit_response:
+                return
+            if response.status != 0:
+                if "频繁" in response.body.description:
+                    cnt -= 1
+                    _log_warning("{}过于频繁，降低该请求的并发后重试".format(msg), logger)
+                    cfg.feedback(target, throttled=True)
+                    continue
+                if "更新" in response.body.description:
+                    cnt -= 1
+                    _log_warning(
+                        "{}的时候服务器更新，选择等待10秒后重试".format(msg), logger
+                    )
+                    yield ("sleep_freq", 10)
+                    continue
+            cfg.feedback(target)
+            break
+        except RuntimeError as e:
+            if "429" in str(e):
+                cnt -= 1
+                _log_warning(
+                    "请求{}过于频繁，触发ip限流，降低该请求的并发并等待10秒后重试".format(
+                        msg
+                    ),
+                    logger,
+                )
+                # 429针对整个ip，除了降低该请求的并发，整个账号也要暂停
+                cfg.feedback(target, throttled=True)
+                yield ("sleep_freq", 10)
+                continue
+            if "服务器更新" in str(e):
+                cnt -= 1
+                _log_warning(
+                    "请求{}的时候服务器更新，选择等待10秒后重试".format(msg), logger
+                )
+                yield ("sleep_freq", 10)
+                continue
+            if "amf返回结果为空" in str(e) and allow_empty:
+                return None
+            if except_retry:
+                _log_warning(
+                    "{}失败，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
+                        msg, max_retry - cnt, type(e).__name__
+                    ),
+                    logger,
+                )
+                yield ("sleep", 1)
+                continue
+            raise e
+        except Exception as e:
+            if except_retry:
+                _log_warning(
+                    "{}失败，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
+                        msg, max_retry - cnt, type(e).__name__
+                    ),
+                    logger,
+                )
+                yield ("sleep", 1)
+                continue
+            raise e
+    else:
+        warning_msg = "{}失败，超过最大尝试次数{}次".format(msg, max_retry)
+        _log_warning(warning_msg, logger)
+        raise RuntimeError(warning_msg)
+    return response
+
+
+def amf_batch_retry_steps(
+    cfg: Config,
+    call_list,
+    url,
+    msg,
+    batch_size=20,
+    max_retry=50,
+    logger=None,
+    allow_empty=False,
+    except_retry=False,
+    **kwargs,
+):
+    results = [None for _ in range(len(call_list))]
+    pending = list(range(len(call_list)))
+    missing = []
+    cnt, attempt = 0, 0
+    while len(pending) > 0:
+        if cnt >= max_retry:
+            warning_msg = "{}失败，超过最大尝试次数{}次".format(msg, max_retry)
+            _log_warning(warning_msg, logger)
+            raise RuntimeError(warning_msg)
+        cnt += 1
+        attempt += 1
+        batch = pending[:batch_size]
+        try:
+            yield ("wait_free",)
+            response_list = yield (
+                "call",
+                "amf_batch",
+                ([call_list[i] for i in batch], url),
+                dict(attempt=attempt, **kwargs),
+            )
+        except Exception as e:
+            if isinstance(e, RuntimeError):
+                if "429" in str(e):
+                    cnt -= 1
+                    _log_warning(
+                        "批量{}触发ip限流，降低该请求的并发并等待10秒后重试".format(
+                            msg
+                        ),
+                        logger,
+                    )
+                    # 429针对整个ip，除了降低该请求的并发，整个账号也要暂停
+                    cfg.feedback(call_list[batch[0]][0], throttled=True)
+                    yield ("sleep_freq", 10)
+                    continue
+                if "服务器更新" in str(e):
+                    cnt -= 1
+                    _log_warning(
+                        "批量{}的时候服务器更新，选择等待10秒后重试".format(msg), logger
+                    )
+                    yield ("sleep_freq", 10)
+                    continue
+                if "amf返回结果为空" in str(e) and allow_empty:
+                    pending = pending[len(batch) :]
+                    cnt = 0
+                    continue
+            if except_retry:
+                _log_warning(
+                    "批量{}失败，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
+                        msg, max_retry - cnt, type(e).__name__
+                    ),
+                    logger,
+                )
+                yield ("sleep", 1)
+                continue
+            raise e
+        retry_list = []
+        reason_set = set()
+        for i, response in zip(batch, response_list):
+            if response is None:
+                missing.append(i)
+                continue
+            target = call_list[i][0]
+            reason = amf_throttle_reason(response)
+            if reason is not None:
+                if reason == "频繁":
+                    cfg.feedback(target, throttled=True)
+                reason_set.add(reason)
+                retry_list.append(i)
+                continue
+            cfg.feedback(target)
+            results[i] = response
+        pending = retry_list + pending[len(batch) :]
+        if len(reason_set) == 0:
+            cnt = 0
+            continue
+        cnt -= 1
+        if "更新" in reason_set:
+            _log_warning("{}的时候服务器更新，选择等待10秒后重试".format(msg), logger)
+            yield ("sleep_freq", 10)
+        else:
+            _log_warning("{}过于频繁，降低该请求的并发后重试".format(msg), logger)
+    for i in missing:
+        target, body = call_list[i]
+        results[i] = yield from amf_post_retry_steps(
+            cfg,
+            body,
+            target,
+            url,
+            msg,
+            max_retry=max_retry,
+            logger=logger,
+            allow_empty=allow_empty,
+            except_retry=except_retry,
+            **kwargs,
+        )
+    return results
 
 
 class WebRequest:
@@ -332,9 +1178,33 @@ class WebRequest:
         self.cfg = cfg
         self.user_agent = ""
         self.cache_dir = cache_dir
-        self.session = requests.Session()
-        if proxy_man.use_dns_cache:
-            self.session.mount("http://", proxy_man.get_adapter())
+
+    @property
+    def transport(self):
+        return get_transport(self.cfg)
+
+    @property
+    def session(self):
+        return self.transport.session
+
+    @property
+    def account(self):
+        return "{}_{}{}区".format(self.cfg.username, self.cfg.server, self.cfg.region)
+
+    def _send(self, trace: RequestTrace, send, url, **kwargs):
+        # 占用代理发出请求，把代理、排队和网络耗时、发送字节数记到trace上
+        start = perf_counter()
+        lease = proxy_man.lease()
+        trace.proxy_id = lease.item.item_id
+        trace.queue_time += perf_counter() - start
+        data = kwargs.get("data")
+        if data is not None:
+            trace.bytes_out += len(data)
+        start = perf_counter()
+        with lease as proxy:
+            resp = send(url, **kwargs, proxies=proxy)
+        trace.network_time += perf_counter() - start
+        return resp
 
     def init_header(self, header):
         user_agent = [
@@ -355,58 +1225,80 @@ class WebRequest:
         if "pvzol" not in url:
             return None
         url = url.replace(f"http://{self.cfg.host}/", "")
-        src_path = os.path.join("./data/cache", url)
-        if os.path.exists(src_path) and not os.path.isdir(src_path):
-            with open(src_path, "rb") as f:
-                return f.read()
+        return private_cache.get(url)
 
-    def get(self, url, use_cache=False, init_header=True, url_format=True, **kwargs):
-        try:
-            self.cfg.acquire()
-            if url_format:
-                url = "http://" + self.cfg.host + url
-            private_cached = self.get_private_cache(url)
-            if private_cached is not None:
-                return private_cached
-
-            def check_status(status_code):
-                if status_code == 502:
-                    raise RuntimeError(f"服务器更新中")
-                if status_code != 200:
-                    raise RuntimeError(f"Request Get Error: {status_code} Url: {url}")
-
-            if init_header:
-                if kwargs.get("headers") is None:
-                    kwargs["headers"] = {}
-                self.init_header(kwargs["headers"])
-            if "timeout" not in kwargs:
-                kwargs["timeout"] = self.cfg.timeout
-
-            if not use_cache:
-                with LogTimeDecorator(url):
-                    proxy_item = proxy_man.get_proxy_item()
-                    with proxy_item as proxy:
-                        resp = self.session.get(url, **kwargs, proxies=proxy)
-                check_status(resp.status_code)
-                return resp.content
-
-            assert self.cache_dir is not None
+    @property
+    def response_cache(self):
+        assert self.cache_dir is not None
+        return get_response_cache(self.cache_dir)
+
+    def get(
+        self,
+        url,
+        use_cache=False,
+        init_header=True,
+        url_format=True,
+        endpoint=None,
+        attempt=1,
+        **kwargs,
+    ):
+        if url_format:
+            url = "http://" + self.cfg.host + url
+        private_cached = self.get_private_cache(url)
+        if private_cached is not None:
+            return private_cached
+
+        validators = {}
+        if use_cache:
             url_hash = self.hash(url)
-            if os.path.exists(os.path.join(self.cache_dir, url_hash)):
-                with open(os.path.join(self.cache_dir, url_hash), "rb") as f:
-                    content = f.read()
-            else:
-                with LogTimeDecorator(url):
-                    proxy_item = proxy_man.get_proxy_item()
-                    with proxy_item as proxy:
-                        resp = self.session.get(url, **kwargs, proxies=proxy)
-                check_status(resp.status_code)
-                content = resp.content
-                with open(os.path.join(self.cache_dir, url_hash), "wb") as f:
-                    f.write(content)
-            return content
-        finally:
-            self.cfg.release()
+            content, fresh, validators = self.response_cache.lookup(
+                url_hash, ttl=self.cfg.cache_ttl
+            )
+            if content is not None and fresh:
+                return content
+
+        def check_status(status_code):
+            if status_code == 502:
+                raise RuntimeError(f"服务器更新中")
+            if status_code != 200:
+                raise RuntimeError(f"Request Get Error: {status_code} Url: {url}")
+
+        if init_header:
+            if kwargs.get("headers") is None:
+                kwargs["headers"] = {}
+            self.init_header(kwargs["headers"])
+        if len(validators) > 0:
+            if kwargs.get("headers") is None:
+                kwargs["headers"] = {}
+            kwargs["headers"].update(validators)
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = self.cfg.timeout
+
+        if endpoint is None:
+            endpoint = endpoint_name(url)
+        with request_tracer.trace(
+            self.account, endpoint, url, "GET", attempt=attempt
+        ) as trace:
+            token = None
+            try:
+                start = perf_counter()
+                token = self.cfg.acquire(endpoint)
+                trace.queue_time += perf_counter() - start
+                resp = self._send(trace, self.session.get, url, **kwargs)
+            finally:
+                self.cfg.release(token)
+            trace.bytes_in = len(resp.content)
+            if use_cache and resp.status_code == 304 and content is not None:
+                trace.outcome = "not_modified"
+                self.response_cache.revalidated(url_hash)
+                return content
+            check_status(resp.status_code)
+            # 限流提示是很短的文本，长响应不用查
+            if len(resp.content) < 1024 and "请求过于频繁".encode("utf-8") in resp.content:
+                trace.outcome = "throttled"
+            if use_cache:
+                self.response_cache.store(url_hash, resp.content, resp.headers)
+            return resp.content
 
     def get_async(self, *args, **kwargs):
         def run():
@@ -448,76 +1340,103 @@ class WebRequest:
         init_header=True,
         url_format=True,
         exit_response=False,
+        endpoint=None,
+        trace: RequestTrace = None,
         **kwargs,
     ):
-        try:
-            self.cfg.acquire()
-            if url_format:
-                url = "http://" + self.cfg.host + url
-            private_cached = self.get_private_cache(url)
-            if private_cached is not None:
-                return private_cached
-
-            if "timeout" not in kwargs:
-                kwargs["timeout"] = self.cfg.timeout
-
-            def check_status(status_code):
-                if status_code == 502:
-                    raise RuntimeError(f"服务器更新中")
-                if status_code != 200:
-                    raise RuntimeError(f"Request Post Error: {status_code} Url: {url}")
-
-            if init_header:
-                if kwargs.get("headers") is None:
-                    kwargs["headers"] = {}
-                self.init_header(kwargs["headers"])
-
-            if not use_cache:
-                if not exit_response:
-                    with LogTimeDecorator(url):
-                        proxy_item = proxy_man.get_proxy_item()
-                        with proxy_item as proxy:
-                            resp = self.session.post(url, **kwargs, proxies=proxy)
-                    check_status(resp.status_code)
-                    return resp.content
-                with LogTimeDecorator(url):
-                    proxy_item = proxy_man.get_proxy_item()
-                    with proxy_item as proxy:
-                        resp = self.session.post(
-                            url,
-                            stream=True,
-                            **kwargs,
-                            proxies=proxy,
-                        )
-                check_status(resp.status_code)
-                for _ in resp.iter_content(chunk_size=16):
-                    break
-                return
-
-            assert self.cache_dir is not None
+        '''
+        Args:
+            trace: 调用方(amf_post等)的记录，为None时单独记录这次请求
+        '''
+        if url_format:
+            url = "http://" + self.cfg.host + url
+        private_cached = self.get_private_cache(url)
+        if private_cached is not None:
+            return private_cached
+
+        if use_cache:
+            # POST不做验证，命中即返回
             url_hash = self.hash(url)
-            if os.path.exists(os.path.join(self.cache_dir, url_hash)):
-                with open(os.path.join(self.cache_dir, url_hash), "rb") as f:
-                    content = f.read()
-            else:
-                with LogTimeDecorator(url):
-                    proxy_item = proxy_man.get_proxy_item()
-                    with proxy_item as proxy:
-                        resp = self.session.post(url, **kwargs, proxies=proxy)
-                check_status(resp.status_code)
-                content = resp.content
-                with open(os.path.join(self.cache_dir, url_hash), "wb") as f:
-                    f.write(content)
-
-            return content
-        finally:
-            self.cfg.release()
+            content, _, _ = self.response_cache.lookup(url_hash)
+            if content is not None:
+                return content
+
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = self.cfg.timeout
+
+        def check_status(status_code):
+            if status_code == 502:
+                raise RuntimeError(f"服务器更新中")
+            if status_code != 200:
+                raise RuntimeError(f"Request Post Error: {status_code} Url: {url}")
+
+        if init_header:
+            if kwargs.get("headers") is None:
+                kwargs["headers"] = {}
+            self.init_header(kwargs["headers"])
+
+        if endpoint is None:
+            endpoint = endpoint_name(url)
+        if trace is None:
+            trace = request_tracer.trace(self.account, endpoint, url, "POST")
+        trace.url = url
+        with trace:
+            token = None
+            try:
+                start = perf_counter()
+                token = self.cfg.acquire(endpoint)
+                trace.queue_time += perf_counter() - start
+                if exit_response and not use_cache:
+                    resp = self._send(
+                        trace, self.session.post, url, stream=True, **kwargs
+                    )
+                    check_status(resp.status_code)
+                    for _ in resp.iter_content(chunk_size=16):
+                        break
+                    return
+                resp = self._send(trace, self.session.post, url, **kwargs)
+            finally:
+                self.cfg.release(token)
+            trace.bytes_in = len(resp.content)
+            check_status(resp.status_code)
+            if use_cache:
+                self.response_cache.store(url_hash, resp.content, resp.headers)
+            return resp.content
 
     def clear_cache(self):
-        assert self.cache_dir is not None
-        if os.path.exists(self.cache_dir):
-            shutil.rmtree(self.cache_dir)
-            os.mkdir(self.cache_dir)
+        self.response_cache.clear()
+
+    def _run_step(self, step):
+        kind = step[0]
+        if kind == "call":
+            _, method, args, kwargs = step
+            return getattr(self, method)(*args, **kwargs)
+        if kind == "wait_free":
+            self.cfg.free_event.wait()
+        elif kind == "sleep_freq":
+            self.cfg.sleep_freq(step[1])
+        else:
+            sleep(step[1])
+
+    def _run_retry(self, steps):
+        '''
+        执行重试状态机(*_retry_steps)产出的动作，直到状态机返回结果。
+        请求的结果或异常送回状态机，由它决定重试、等待还是结束
+        '''
+        value, error = None, None
+        while True:
+            try:
+                if error is None:
+                    step = steps.send(value)
+                else:
+                    step = steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            value, error = None, None
+            try:
+                value = self._run_step(step)
+            except Exception as e:
+                error = e
 
     def get_retry(
         self,
@@ -531,107 +1450,40 @@ class WebRequest:
         except_retry=False,
         **kwargs,
     ):
-        cnt = 0
-        while cnt < max_retry:
-            cnt += 1
-            try:
-                self.cfg.free_event.wait()
-                response = self.get(
-                    url,
-                    use_cache=use_cache,
-                    init_header=init_header,
-                    url_format=url_format,
-                    **kwargs,
-                )
-
-                # import random
-                # if random.random() < 0.2:
-
-                #     raise requests.ConnectionError("test")
-
-                if len(response) == 0:
-                    return None
-                try:
-                    text = response.decode("utf-8")
-                    if "请求过于频繁" in text:
-                        warning_msg = "请求{}过于频繁，选择等待3秒后重试".format(msg)
-                        cnt -= 1
-                        if logger is not None:
-                            logger.log(warning_msg)
-                        else:
-                            logging.warning(warning_msg)
-                        self.cfg.sleep_freq(3)
-                        continue
-                    if "服务器更新" in text:
-                        warning_msg = (
-                            "请求{}的时候服务器更新，选择等待10秒后重试".format(msg)
-                        )
-                        cnt -= 1
-                        if logger is not None:
-                            logger.log(warning_msg)
-                        else:
-                            logging.warning(warning_msg)
-                        self.cfg.sleep_freq(10)
-                        continue
-                except:
-                    pass
-                break
-            except Exception as e:
-                if "429" in str(e):
-                    warning_msg = (
-                        "请求{}过于频繁，触发ip限流，选择等待10秒后重试".format(msg)
-                    )
-                    cnt -= 1
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    self.cfg.sleep_freq(10)
-                    continue
-                if "服务器更新" in str(e):
-                    warning_msg = "请求{}的时候服务器更新，选择等待10秒后重试".format(
-                        msg
-                    )
-                    cnt -= 1
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    self.cfg.sleep_freq(10)
-                    continue
-                if except_retry:
-                    warning_msg = "重新尝试请求{}，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
-                        msg, max_retry - cnt, type(e).__name__
-                    )
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    sleep(1)
-                    continue
-                raise e
-        else:
-            warning_msg = "尝试请求{}失败，超过最大尝试次数{}次".format(msg, max_retry)
-            if logger is not None:
-                logger.log(warning_msg)
-            else:
-                logging.warning(warning_msg)
-            raise Exception(warning_msg)
-        return response
+        return self._run_retry(
+            get_retry_steps(
+                self.cfg,
+                url,
+                msg,
+                max_retry=max_retry,
+                logger=logger,
+                except_retry=except_retry,
+                use_cache=use_cache,
+                init_header=init_header,
+                url_format=url_format,
+                **kwargs,
+            )
+        )
 
-    def _amf_post_decode(self, url, data, exit_response=False, **kwargs):
+    def _amf_post_decode(self, url, data, exit_response=False, trace=None, **kwargs):
         resp = self.post(
             url,
             data=data,
             exit_response=exit_response,
             headers={"Content-Type": "application/x-amf"},
+            trace=trace,
             **kwargs,
         )
         if exit_response:
             return
         if len(resp) == 0:
             raise RuntimeError("amf返回结果为空")
+        from pyamf import remoting
+
+        start = perf_counter()
         resp_ev = remoting.decode(resp)
+        if trace is not None:
+            trace.decode_time += perf_counter() - start
 
         return resp_ev["/1"]
 
@@ -641,21 +1493,27 @@ class WebRequest:
         target,
         url,
         exit_response=False,
+        attempt=1,
         **kwargs,
     ):
-        req = remoting.Request(target=target, body=body)
-        ev = remoting.Envelope(AMF3)
-        ev['/1'] = req
-        bin_msg = remoting.encode(ev, strict=True)
-        result = self._amf_post_decode(
-            url,
-            bin_msg.getvalue(),
-            exit_response=exit_response,
-            **kwargs,
-        )
-        if exit_response:
-            return
-        return result
+        with request_tracer.trace(
+            self.account, target, url, "POST", attempt=attempt
+        ) as trace:
+            start = perf_counter()
+            data = encode_amf(target, body)
+            trace.encode_time += perf_counter() - start
+            kwargs.setdefault("endpoint", target)
+            result = self._amf_post_decode(
+                url,
+                data,
+                exit_response=exit_response,
+                trace=trace,
+                **kwargs,
+            )
+            if exit_response:
+                return
+            trace.outcome = amf_outcome(result)
+            return result
 
     def amf_post_retry(
         self,
@@ -670,104 +1528,93 @@ class WebRequest:
         except_retry=False,
         **kwargs,
     ):
-        cnt = 0
-        while cnt < max_retry:
-            cnt += 1
-            try:
-                self.cfg.free_event.wait()
-                response = self.amf_post(
-                    body,
-                    target,
-                    url,
-                    exit_response=exit_response,
-                    **kwargs,
-                )
-
-                # import random
+        return self._run_retry(
+            amf_post_retry_steps(
+                self.cfg,
+                body,
+                target,
+                url,
+                msg,
+                max_retry=max_retry,
+                logger=logger,
+                exit_response=exit_response,
+                allow_empty=allow_empty,
+                except_retry=except_retry,
+                **kwargs,
+            )
+        )
 
-                # if random.random() < 0.2:
-                #     raise requests.ConnectionError("test")
+    def amf_batch(self, call_list, url, attempt=1, **kwargs):
+        '''
+        把多个amf调用打包进一个envelope，用一次POST发出去
+
+        Args:
+            call_list: [(target, body), ...]
+            url: amf地址
+            attempt: 重试函数中的第几次尝试
+
+        Returns:
+            list: 与call_list一一对应的响应，服务器没有返回的为None
+        '''
+        kwargs.setdefault("endpoint", call_list[0][0])
+        with request_tracer.trace(
+            self.account,
+            batch_endpoint(call_list),
+            url,
+            "POST",
+            attempt=attempt,
+            call_num=len(call_list),
+        ) as trace:
+            start = perf_counter()
+            data = encode_amf_batch(call_list)
+            trace.encode_time += perf_counter() - start
+            resp = self.post(
+                url,
+                data=data,
+                headers={"Content-Type": "application/x-amf"},
+                trace=trace,
+                **kwargs,
+            )
+            start = perf_counter()
+            response_list = decode_amf_batch(resp, len(call_list))
+            trace.decode_time += perf_counter() - start
+            trace.outcome = batch_outcome(response_list)
+            return response_list
 
-                if exit_response:
-                    return
-                if response.status != 0:
-                    if "频繁" in response.body.description:
-                        warning_msg = "{}过于频繁，选择等待3秒后重试".format(msg)
-                        cnt -= 1
-                        if logger is not None:
-                            logger.log(warning_msg)
-                        else:
-                            logging.warning(warning_msg)
-                        self.cfg.sleep_freq(3)
-                        continue
-                    if "更新" in response.body.description:
-                        warning_msg = "{}的时候服务器更新，选择等待10秒后重试".format(
-                            msg
-                        )
-                        cnt -= 1
-                        if logger is not None:
-                            logger.log(warning_msg)
-                        else:
-                            logging.warning(warning_msg)
-                        self.cfg.sleep_freq(10)
-                        continue
-                break
-            except RuntimeError as e:
-                if "429" in str(e):
-                    warning_msg = (
-                        "请求{}过于频繁，触发ip限流，选择等待10秒后重试".format(msg)
-                    )
-                    cnt -= 1
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    self.cfg.sleep_freq(10)
-                    continue
-                if "服务器更新" in str(e):
-                    warning_msg = "请求{}的时候服务器更新，选择等待10秒后重试".format(
-                        msg
-                    )
-                    cnt -= 1
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    self.cfg.sleep_freq(10)
-                    continue
-                if "amf返回结果为空" in str(e) and allow_empty:
-                    return None
-                if except_retry:
-                    warning_msg = "{}失败，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
-                        msg, max_retry - cnt, type(e).__name__
-                    )
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    sleep(1)
-                    continue
-                raise e
-            except Exception as e:
-                if except_retry:
-                    warning_msg = "{}失败，选择等待1秒后重试。最多再等待{}次。异常类型: {}".format(
-                        msg, max_retry - cnt, type(e).__name__
-                    )
-                    if logger is not None:
-                        logger.log(warning_msg)
-                    else:
-                        logging.warning(warning_msg)
-                    sleep(1)
-                    continue
-                raise e
-        else:
-            warning_msg = "{}失败，超过最大尝试次数{}次".format(msg, max_retry)
-            if logger is not None:
-                logger.log(warning_msg)
-            else:
-                logging.warning(warning_msg)
-            raise RuntimeError(warning_msg)
-        return response
+    def amf_batch_retry(
+        self,
+        call_list,
+        url,
+        msg,
+        batch_size=20,
+        max_retry=50,
+        logger=None,
+        allow_empty=False,
+        except_retry=False,
+        **kwargs,
+    ):
+        '''
+        amf_batch的重试版本，每批最多batch_size个调用。
+        重试规则与amf_post_retry一致：频繁和服务器更新的调用会等待后重新打包，
+        服务器没有返回结果的调用会退化为单独用amf_post_retry请求。
+
+        Returns:
+            list: 与call_list一一对应的响应
+        '''
+        return self._run_retry(
+            amf_batch_retry_steps(
+                self.cfg,
+                call_list,
+                url,
+                msg,
+                batch_size=batch_size,
+                max_retry=max_retry,
+                logger=logger,
+                allow_empty=allow_empty,
+                except_retry=except_retry,
+                **kwargs,
+            )
+        )
 
     def amf_post_retry_async(
         self,
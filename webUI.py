@@ -35,39 +35,13 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtGui import QImage, QPixmap, QTextCursor, QTextCharFormat, QColor
 from PyQt6.QtCore import Qt, pyqtSignal
-from PIL import Image
 
-from pypvz import WebRequest, Config, User, Repository, Library
-from pypvz.ui.message import IOLogger
+from pypvz import WebRequest, Config
+from pypvz.library import library_registry
 from pypvz.ui.wrapped import QLabel
-from pypvz.ui.windows.common import (
-    HeritageWindow,
-)
-from pypvz.ui.user import UserSettings
-from pypvz.ui.windows import (
-    EvolutionPanelWindow,
-    UpgradeQualityWindow,
-    AutoSynthesisWindow,
-    AutoCompoundWindow,
-    RepositoryRecordWindow,
-    FubenSettingWindow,
-    GardenChallengeSettingWindow,
-    TerritorySettingWindow,
-    PipelineSettingWindow,
-    ShopAutoBuySetting,
-    Challenge4levelSettingWindow,
-    DailySettingWindow,
-    SimulateWindow,
-    AutoUseItemSettingWindow,
-    CommandSettingWindow,
-    OpenFubenWindow,
-    PlantRelativeWindow,
-    # GameWindow,
-    # run_game_window,
-)
-from pypvz.ui.windows.common import delete_layout_children
-from pypvz.web import proxy_man, test_proxy_alive
-from pypvz.proxy import GameWindowProxyServer
+from pypvz.ui.user import UserSettings, LoginOrchestrator, LoginTask
+from pypvz.ui import windows
+from pypvz.web import proxy_man, transport_stats
 
 
 class SettingWindow(QMainWindow):
@@ -376,6 +350,32 @@ class SettingWindow(QMainWindow):
         millsecond_delay_widget.setLayout(millsecond_delay_layout)
         menu_layout.addWidget(millsecond_delay_widget, 8, 0)
 
+        pool_size_widget = QWidget()
+        pool_size_layout = QHBoxLayout()
+        pool_size_layout.addWidget(QLabel("连接池大小:"))
+        self.pool_size_input_box = QSpinBox()
+        self.pool_size_input_box.setMinimum(1)
+        self.pool_size_input_box.setMaximum(100)
+        self.pool_size_input_box.setValue(self.usersettings.cfg.pool_size)
+        self.pool_size_input_box.valueChanged.connect(
+            self.pool_size_input_box_valueChanged
+        )
+        pool_size_layout.addWidget(self.pool_size_input_box)
+        pool_size_widget.setLayout(pool_size_layout)
+        menu_layout.addWidget(pool_size_widget, 7, 1)
+
+        burst_widget = QWidget()
+        burst_layout = QHBoxLayout()
+        burst_layout.addWidget(QLabel("请求突发数:"))
+        self.burst_input_box = QSpinBox()
+        self.burst_input_box.setMinimum(1)
+        self.burst_input_box.setMaximum(100)
+        self.burst_input_box.setValue(self.usersettings.cfg.burst)
+        self.burst_input_box.valueChanged.connect(self.burst_input_box_valueChanged)
+        burst_layout.addWidget(self.burst_input_box)
+        burst_widget.setLayout(burst_layout)
+        menu_layout.addWidget(burst_widget, 8, 1)
+
         self.close_if_nothing_todo_checkbox = QCheckBox("无事可做时关闭用户")
         self.close_if_nothing_todo_checkbox.setChecked(
             self.usersettings.exit_if_nothing_todo
@@ -385,6 +385,15 @@ class SettingWindow(QMainWindow):
         )
         menu_layout.addWidget(self.close_if_nothing_todo_checkbox, 9, 0)
 
+        self.congestion_control_checkbox = QCheckBox("被限流时自动降低并发")
+        self.congestion_control_checkbox.setChecked(
+            self.usersettings.cfg.congestion_control
+        )
+        self.congestion_control_checkbox.stateChanged.connect(
+            self.congestion_control_checkbox_stateChanged
+        )
+        menu_layout.addWidget(self.congestion_control_checkbox, 9, 1)
+
         menu_widget.setLayout(menu_layout)
         main_layout.addWidget(menu_widget)
 
@@ -410,23 +419,23 @@ class SettingWindow(QMainWindow):
         )
 
     def command_setting_btn_clicked(self):
-        self.command_setting_window = CommandSettingWindow(
+        self.command_setting_window = windows.CommandSettingWindow(
             self.usersettings, parent=self
         )
         self.command_setting_window.show()
 
     def daily_setting_btn_clicked(self):
-        self.daily_setting_window = DailySettingWindow(self.usersettings, self)
+        self.daily_setting_window = windows.DailySettingWindow(self.usersettings, self)
         self.daily_setting_window.show()
 
     def territory_setting_btn_clicked(self):
-        self.territory_setting_window = TerritorySettingWindow(
+        self.territory_setting_window = windows.TerritorySettingWindow(
             self.usersettings, parent=self
         )
         self.territory_setting_window.show()
 
     def garden_setting_btn_clicked(self):
-        self.garden_setting_window = GardenChallengeSettingWindow(
+        self.garden_setting_window = windows.GardenChallengeSettingWindow(
             self.usersettings, parent=self
         )
         self.garden_setting_window.show()
@@ -452,6 +461,17 @@ class SettingWindow(QMainWindow):
     def max_timeout_input_box_valueChanged(self):
         self.usersettings.cfg.timeout = self.max_timeout_input_box.value()
 
+    def pool_size_input_box_valueChanged(self):
+        self.usersettings.cfg.pool_size = self.pool_size_input_box.value()
+
+    def burst_input_box_valueChanged(self):
+        self.usersettings.cfg.burst = self.burst_input_box.value()
+
+    def congestion_control_checkbox_stateChanged(self):
+        self.usersettings.cfg.congestion_control = (
+            self.congestion_control_checkbox.isChecked()
+        )
+
     def task_setting_checkbox_stateChanged(self):
         self.usersettings.task_enabled = self.task_setting_checkbox.isChecked()
 
@@ -462,11 +482,11 @@ class SettingWindow(QMainWindow):
         self.usersettings.rest_time = value
 
     def fuben_setting_btn_clicked(self):
-        self.fuben_setting_window = FubenSettingWindow(self.usersettings, parent=self)
+        self.fuben_setting_window = windows.FubenSettingWindow(self.usersettings, parent=self)
         self.fuben_setting_window.show()
 
     def shop_auto_buy_setting_btn_clicked(self):
-        self.shop_auto_buy_setting_window = ShopAutoBuySetting(
+        self.shop_auto_buy_setting_window = windows.ShopAutoBuySetting(
             self.usersettings.cfg,
             self.usersettings.lib,
             self.usersettings.logger,
@@ -502,7 +522,7 @@ class SettingWindow(QMainWindow):
         )
 
     def challenge4level_setting_btn_clicked(self):
-        self.challenge4level_setting_window = Challenge4levelSettingWindow(
+        self.challenge4level_setting_window = windows.Challenge4levelSettingWindow(
             self.usersettings.cfg,
             self.usersettings.lib,
             self.usersettings.repo,
@@ -609,33 +629,33 @@ class FunctionPanelWindow(QMainWindow):
         self.setCentralWidget(main_widget)
 
     def open_fuben_btn_clicked(self):
-        self.open_fuben_window = OpenFubenWindow(self.usersettings, parent=self)
+        self.open_fuben_window = windows.OpenFubenWindow(self.usersettings, parent=self)
         self.open_fuben_window.show()
 
     def auto_use_item_setting_btn_clicked(self):
-        self.auto_use_item_setting_window = AutoUseItemSettingWindow(
+        self.auto_use_item_setting_window = windows.AutoUseItemSettingWindow(
             self.usersettings, parent=self
         )
         self.auto_use_item_setting_window.show()
 
     def simulate_btn_clicked(self):
-        self.simulate_window = SimulateWindow(parent=self)
+        self.simulate_window = windows.SimulateWindow(parent=self)
         self.simulate_window.show()
 
     def auto_pipeline_btn_clicked(self):
-        self.auto_pipeline_window = PipelineSettingWindow(
+        self.auto_pipeline_window = windows.PipelineSettingWindow(
             self.usersettings, parent=self
         )
         self.auto_pipeline_window.show()
 
     def repository_tool_record_btn_clicked(self):
-        self.repository_tool_record_window = RepositoryRecordWindow(
+        self.repository_tool_record_window = windows.RepositoryRecordWindow(
             self.usersettings, parent=self
         )
         self.repository_tool_record_window.show()
 
     def compound_btn_clicked(self):
-        self.compound_window = AutoCompoundWindow(
+        self.compound_window = windows.AutoCompoundWindow(
             self.usersettings.cfg,
             self.usersettings.lib,
             self.usersettings.repo,
@@ -646,21 +666,21 @@ class FunctionPanelWindow(QMainWindow):
         self.compound_window.show()
 
     def plant_relative_btn_clicked(self):
-        self.plant_relative_window = PlantRelativeWindow(self.usersettings, parent=self)
+        self.plant_relative_window = windows.PlantRelativeWindow(self.usersettings, parent=self)
         self.plant_relative_window.show()
 
     def heritage_btn_clicked(self):
-        self.heritage_window = HeritageWindow(self.usersettings, parent=self)
+        self.heritage_window = windows.HeritageWindow(self.usersettings, parent=self)
         self.heritage_window.show()
 
     def upgrade_quality_btn_clicked(self):
-        self.upgrade_quality_window = UpgradeQualityWindow(
+        self.upgrade_quality_window = windows.UpgradeQualityWindow(
             self.usersettings, parent=self
         )
         self.upgrade_quality_window.show()
 
     def evolution_panel_btn_clicked(self):
-        self.evolution_panel_window = EvolutionPanelWindow(
+        self.evolution_panel_window = windows.EvolutionPanelWindow(
             self.usersettings.repo,
             self.usersettings.lib,
             self.usersettings.logger,
@@ -670,7 +690,7 @@ class FunctionPanelWindow(QMainWindow):
         self.evolution_panel_window.show()
 
     def auto_synthesis_btn_clicked(self):
-        self.auto_synthesis_window = AutoSynthesisWindow(self.usersettings, parent=self)
+        self.auto_synthesis_window = windows.AutoSynthesisWindow(self.usersettings, parent=self)
         self.auto_synthesis_window.show()
 
     def closeEvent(self, event):
@@ -714,6 +734,8 @@ class CustomMainWindow(QMainWindow):
 
         user_show_layout = QHBoxLayout()
 
+        from PIL import Image
+
         img = Image.open(
             BytesIO(
                 self.wr_cache.get_retry(
@@ -828,6 +850,8 @@ class CustomMainWindow(QMainWindow):
         subprocess.Popen(exe_path)
 
     def refresh_user_info(self, refresh_all=False):
+        from pypvz.ui.windows.common import delete_layout_children
+
         delete_layout_children(self.user_info_1)
         delete_layout_children(self.user_info_2)
 
@@ -913,6 +937,8 @@ class CustomMainWindow(QMainWindow):
             with open("data/cache/pvz/spec_skills.json", mode="w", encoding="utf-8") as f:
                 json.dump(spec_skills, f, ensure_ascii=False)
             self.usersettings.logger.log("刷新专属技能缓存成功")
+            # 所有账号共用的图鉴一起重新加载技能
+            library_registry.refresh_all()
         except Exception as e:
             self.usersettings.logger.log(f"刷新技能缓存失败: {e}")
         else:
@@ -970,7 +996,9 @@ class CustomMainWindow(QMainWindow):
 
     def refresh_repository_btn(self):
         self.usersettings.repo.refresh_repository()
-        self.usersettings.logger.log("仓库刷新完成")
+        self.usersettings.logger.log(
+            "仓库刷新完成。{}".format(self.usersettings.repo.refresh_stats)
+        )
 
     def start_process(self):
         self.process_button.setText("暂停")
@@ -1003,6 +1031,7 @@ class CustomMainWindow(QMainWindow):
         except ValueError:
             pass
         self.usersettings.save()
+        library_registry.release(self.usersettings.lib)
         try:
             main_window_list.remove(self)
         except ValueError:
@@ -1011,11 +1040,13 @@ class CustomMainWindow(QMainWindow):
 
 
 class ProxyManagerWindow(QMainWindow):
+    proxy_test_finish_signal = pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.init_ui()
         self.item_id = None
+        self.proxy_test_finish_signal.connect(self.proxy_test_finished)
 
     def init_ui(self):
         self.setWindowTitle("网络管理面板")
@@ -1072,15 +1103,62 @@ class ProxyManagerWindow(QMainWindow):
         self.test_times.setText("5")
         self.test_times.textChanged.connect(self.test_times_textChanged)
         layout1.addWidget(self.test_times)
-        remove_proxy_btn = QPushButton("测试已添加代理")
-        remove_proxy_btn.clicked.connect(self.test_proxy)
-        layout1.addWidget(remove_proxy_btn)
+        self.test_proxy_btn = QPushButton("测试已添加代理")
+        self.test_proxy_btn.clicked.connect(self.test_proxy)
+        layout1.addWidget(self.test_proxy_btn)
+        layout.addLayout(layout1)
+
+        health_checker = proxy_man.health_checker
+        layout1 = QHBoxLayout()
+        layout1.addWidget(QLabel("测试地址:"))
+        self.test_url_input = QLineEdit()
+        self.test_url_input.setText(health_checker.url)
+        self.test_url_input.editingFinished.connect(self.test_url_input_editingFinished)
+        layout1.addWidget(self.test_url_input)
+        layout.addLayout(layout1)
+
+        layout1 = QHBoxLayout()
+        self.background_check_checkbox = QCheckBox("后台定时检测代理，间隔(秒):")
+        self.background_check_checkbox.setChecked(health_checker.enabled)
+        self.background_check_checkbox.stateChanged.connect(
+            self.background_check_checkbox_stateChanged
+        )
+        layout1.addWidget(self.background_check_checkbox)
+        self.check_interval_input = QSpinBox()
+        self.check_interval_input.setMinimum(10)
+        self.check_interval_input.setMaximum(24 * 3600)
+        self.check_interval_input.setValue(health_checker.interval)
+        self.check_interval_input.valueChanged.connect(
+            self.check_interval_input_valueChanged
+        )
+        layout1.addWidget(self.check_interval_input)
+        layout.addLayout(layout1)
+
+        layout1 = QHBoxLayout()
+        layout1.addWidget(QLabel("连续检测失败多少次后移除(0不移除):"))
+        self.evict_threshold_input = QSpinBox()
+        self.evict_threshold_input.setMinimum(0)
+        self.evict_threshold_input.setMaximum(100)
+        self.evict_threshold_input.setValue(health_checker.evict_threshold)
+        self.evict_threshold_input.valueChanged.connect(
+            self.evict_threshold_input_valueChanged
+        )
+        layout1.addWidget(self.evict_threshold_input)
         layout.addLayout(layout1)
 
         export_proxy_btn = QPushButton("导出已添加代理")
         export_proxy_btn.clicked.connect(self.export_proxy)
         layout.addWidget(export_proxy_btn)
 
+        layout1 = QHBoxLayout()
+        self.transport_stats_label = QLabel()
+        layout1.addWidget(self.transport_stats_label)
+        refresh_transport_stats_btn = QPushButton("刷新连接统计")
+        refresh_transport_stats_btn.clicked.connect(self.refresh_transport_stats)
+        layout1.addWidget(refresh_transport_stats_btn)
+        layout.addLayout(layout1)
+        self.refresh_transport_stats()
+
         self.block_when_no_proxy_checkbox = QCheckBox(
             "没有空闲代理时阻塞(不阻塞则本地直连无限制并发)"
         )
@@ -1150,6 +1228,14 @@ class ProxyManagerWindow(QMainWindow):
         proxy_man.block_when_no_proxy = self.block_when_no_proxy_checkbox.isChecked()
         self.save()
 
+    def refresh_transport_stats(self):
+        stats = transport_stats()
+        self.transport_stats_label.setText(
+            "{}个账号共新建连接{}次，复用连接{}次".format(
+                stats["accounts"], stats["opened"], stats["reused"]
+            )
+        )
+
     def refresh_proxy_list(self):
         self.proxy_list.clear()
         for proxy_item in proxy_man.proxy_item_list:
@@ -1167,26 +1253,42 @@ class ProxyManagerWindow(QMainWindow):
         pass
 
     def test_proxy(self):
-        def test_proxy_thread(proxy_item):
-            alive = test_proxy_alive(
-                proxy_item.proxy, proxy_item.item_id, int(self.test_times.text())
-            )
-            # logging.info("代理地址：{} {}".format(proxy_item.proxy, alive))
+        # 在后台线程检测，完成后通过信号回到UI线程刷新
+        self.test_proxy_btn.setDisabled(True)
+        self.test_proxy_btn.setText("测试中...")
+        proxy_man.health_checker.check_async(
+            int(self.test_times.text()),
+            callback=lambda result: self.proxy_test_finish_signal.emit(),
+        )
 
-        threads = []
-        for proxy_item in proxy_man.proxy_item_list:
-            if proxy_item.item_id == -1:  # 本地
-                continue
+    def proxy_test_finished(self):
+        self.test_proxy_btn.setEnabled(True)
+        self.test_proxy_btn.setText("测试已添加代理")
+        self.save()
+        self.refresh_proxy_list()
+
+    def test_url_input_editingFinished(self):
+        url = self.test_url_input.text().strip()
+        if len(url) == 0:
+            self.test_url_input.setText(proxy_man.health_checker.url)
+            return
+        proxy_man.health_checker.url = url
+        self.save()
 
-            thread = threading.Thread(target=test_proxy_thread, args=(proxy_item,))
-            threads.append(thread)
-            thread.start()
+    def background_check_checkbox_stateChanged(self):
+        if self.background_check_checkbox.isChecked():
+            proxy_man.health_checker.start()
+        else:
+            proxy_man.health_checker.stop()
+        self.save()
 
-        for thread in threads:
-            thread.join()
+    def check_interval_input_valueChanged(self):
+        proxy_man.health_checker.interval = self.check_interval_input.value()
+        self.save()
 
+    def evict_threshold_input_valueChanged(self):
+        proxy_man.health_checker.evict_threshold = self.evict_threshold_input.value()
         self.save()
-        self.refresh_proxy_list()
 
     def export_proxy(self):
         with open("proxy.txt", "w") as f:
@@ -1278,6 +1380,14 @@ class LoginWindow(QMainWindow):
     get_usersettings_finish_signal = pyqtSignal(tuple)
     get_usersettings_finish_export_signal = pyqtSignal(tuple)
     get_usersettings_finish_import_signal = pyqtSignal(tuple)
+    login_progress_signal = pyqtSignal(str)
+
+    # 同时登录的最大账号数
+    login_max_concurrency = 4
+    # 登录优先级，越大越先登录
+    single_login_priority = 2
+    batch_login_priority = 1
+    transfer_config_priority = 0
 
     def __init__(self):
         super().__init__()
@@ -1295,8 +1405,15 @@ class LoginWindow(QMainWindow):
         self.get_usersettings_finish_import_signal.connect(
             self.get_usersettings_finished_import
         )
+        self.login_progress_signal.connect(self.login_progress_label.setText)
+        self.login_orchestrator = LoginOrchestrator(
+            root_dir,
+            max_concurrency=self.login_max_concurrency,
+            on_progress=lambda progress: self.login_progress_signal.emit(
+                str(progress)
+            ),
+        )
         self.export_save_dir = os.path.join(root_dir, "导出的用户数据")
-        self.main_window_thread = []
         self.game_queue = None
 
     def init_ui(self):
@@ -1350,11 +1467,16 @@ class LoginWindow(QMainWindow):
         # pack_deal_layout.addWidget(game_start_btn)
         pack_deal_widget.setLayout(pack_deal_layout)
         main_layout.addWidget(pack_deal_widget)
+        self.login_progress_label = QLabel("")
+        main_layout.addWidget(self.login_progress_label)
 
         layout = QHBoxLayout()
         proxy_manager_window_btn = QPushButton("网络面板")
         proxy_manager_window_btn.clicked.connect(self.proxy_manager_window_btn_clicked)
         layout.addWidget(proxy_manager_window_btn)
+        request_stats_window_btn = QPushButton("请求统计面板")
+        request_stats_window_btn.clicked.connect(self.request_stats_window_btn_clicked)
+        layout.addWidget(request_stats_window_btn)
         main_layout.addLayout(layout)
 
         username_widget = QWidget()
@@ -1430,6 +1552,10 @@ class LoginWindow(QMainWindow):
         window = ProxyManagerWindow(parent=self)
         window.show()
 
+    def request_stats_window_btn_clicked(self):
+        window = windows.RequestStatsWindow(parent=self)
+        window.show()
+
     def import_cookie_btn_clicked(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self,
@@ -1497,9 +1623,11 @@ class LoginWindow(QMainWindow):
         self._export_rest_count_lock = threading.Lock()
         for cfg_index in cfg_indices:
             cfg = Config(self.configs[cfg_index])
-            GetUsersettings(
-                cfg, root_dir, self.get_usersettings_finish_export_signal
-            ).start()
+            self.submit_login(
+                cfg,
+                self.get_usersettings_finish_export_signal,
+                priority=self.transfer_config_priority,
+            )
 
     def get_usersettings_finished_export(self, args):
         usersettings, cache_dir = args
@@ -1512,6 +1640,7 @@ class LoginWindow(QMainWindow):
         )
         save_path = os.path.join(self.export_save_dir, f"{save_info}.bin")
         usersettings.export_data(save_path)
+        library_registry.release(usersettings.lib)
         logging.info(f"导出用户配置: {save_info}")
         with self._export_rest_count_lock:
             self.export_rest_count -= 1
@@ -1543,15 +1672,19 @@ class LoginWindow(QMainWindow):
             data = pickle.loads(data_bin)
             config, data = data["config"], data["data"]
             cfg = Config(config)
-            GetUsersettings(
-                cfg, root_dir, self.get_usersettings_finish_import_signal, data
-            ).start()
+            self.submit_login(
+                cfg,
+                self.get_usersettings_finish_import_signal,
+                data,
+                priority=self.transfer_config_priority,
+            )
 
     def get_usersettings_finished_import(self, args):
         usersettings, cache_dir, data = args
         assert isinstance(usersettings, UserSettings)
         usersettings.import_data(data)
         usersettings.save()
+        library_registry.release(usersettings.lib)
         user_info = "{}_{}{}区".format(
             usersettings.cfg.username,
             usersettings.cfg.server,
@@ -1602,7 +1735,7 @@ class LoginWindow(QMainWindow):
             for item in self.login_user_list.selectedItems()
         ]
         for index in selected_index:
-            self.login(index)
+            self.login(index, priority=self.batch_login_priority)
 
     def start_all_user_btn_clicked(self):
         for main_window in main_window_list:
@@ -1690,17 +1823,24 @@ class LoginWindow(QMainWindow):
         QApplication.processEvents()
         self.create_main_window(Config(cfg))
 
-    def login(self, index):
-        self.create_main_window(Config(self.configs[index]))
+    def login(self, index, priority=None):
+        self.create_main_window(Config(self.configs[index]), priority=priority)
 
     def login_list_item_double_clicked(self, item):
         cfg_index = item.data(Qt.ItemDataRole.UserRole)
         self.login(cfg_index)
 
-    def create_main_window(self, cfg: Config):
-        thread = GetUsersettings(cfg, root_dir, self.get_usersettings_finish_signal)
-        self.main_window_thread.append(thread)
-        thread.start()
+    def create_main_window(self, cfg: Config, priority=None):
+        if priority is None:
+            priority = self.single_login_priority
+        self.submit_login(cfg, self.get_usersettings_finish_signal, priority=priority)
+
+    def submit_login(self, cfg: Config, finish_signal, *args, priority):
+        def callback(task: LoginTask):
+            logger_list.append(task.usersettings.io_logger)
+            finish_signal.emit((task.usersettings, task.cache_dir, *task.args))
+
+        self.login_orchestrator.submit(cfg, callback, *args, priority=priority)
 
     def get_usersettings_finished(self, args):
         main_window = CustomMainWindow(*args)
@@ -1758,65 +1898,6 @@ class LoginWindow(QMainWindow):
         return super().closeEvent(event)
 
 
-class GetUsersettings(threading.Thread):
-    def __init__(self, cfg: Config, root_dir, finish_trigger, *args):
-        super().__init__()
-        self.cfg = cfg
-        self.root_dir = root_dir
-        self.finish_trigger = finish_trigger
-        self.args = args
-
-    def run(self):
-        data_dir = os.path.join(
-            self.root_dir,
-            f"data/user/{self.cfg.username}/{self.cfg.region}/{self.cfg.host}",
-        )
-        os.makedirs(data_dir, exist_ok=True)
-        cache_dir = os.path.join(data_dir, "cache")
-        os.makedirs(cache_dir, exist_ok=True)
-        log_dir = os.path.join(data_dir, "log")
-        os.makedirs(log_dir, exist_ok=True)
-        setting_dir = os.path.join(data_dir, "usersettings")
-        os.makedirs(setting_dir, exist_ok=True)
-
-        max_info_capacity = 500
-        # TODO: 从配置文件中读取
-        logger = IOLogger(log_dir, max_info_capacity=max_info_capacity)
-        logger_list.append(logger)
-        usersettings = get_usersettings(self.cfg, logger, setting_dir)
-        self.finish_trigger.emit((usersettings, cache_dir, *self.args))
-
-
-def get_usersettings(cfg: Config, logger: IOLogger, setting_dir):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        futures = []
-        futures.append(executor.submit(User, cfg))
-        futures.append(executor.submit(Library, cfg))
-        futures.append(executor.submit(Repository, cfg))
-
-    concurrent.futures.wait(futures, return_when=concurrent.futures.ALL_COMPLETED)
-
-    user: User = futures[0].result()
-    lib: Library = futures[1].result()
-    repo: Repository = futures[2].result()
-
-    usersettings = UserSettings(
-        cfg,
-        repo,
-        lib,
-        user,
-        logger,
-        setting_dir,
-    )
-    if not os.path.exists(setting_dir):
-        os.mkdir(setting_dir)
-        usersettings.save()
-    else:
-        usersettings.load()
-
-    return usersettings
-
-
 if __name__ == "__main__":
     multiprocessing.freeze_support()
     # 解析命令行，获取debug参数
@@ -1840,6 +1921,8 @@ if __name__ == "__main__":
     CACHE_DIR = os.path.join(data_dir, "cache")
     proxy_man_save_path = os.path.join(data_dir, "config", "proxy.bin")
     if ENABLE_GAME_WINDOW:
+        from pypvz.proxy import GameWindowProxyServer
+
         GameWindowProxyServer(CACHE_DIR, GAME_PORT).start()
     # start_game_window_proxy()
 